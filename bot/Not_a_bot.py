@@ -34,15 +34,47 @@ from asyncpg.exceptions import PostgresError, InterfaceError
 
 from bot.botbase import BotBase
 from bot.cooldown import CooldownManager
+from bot.partitions import PartitionManager
 from bot.server import WebhookServer
 from utils.init_tf import LoadedModel
-from utils.utilities import (random_color)
+from utils.lazy import warmup_modules
+from utils.utilities import (random_color, gather_bounded)
 
 logger = logging.getLogger('terminal')
 
 
+# Cogs loaded by run.py
+INITIAL_COGS = [
+    'admin',
+    'autoresponds',
+    'autoroles',
+    'botadmin',
+    'botmod',
+    'colors',
+    'command_blacklist',
+    'dbl',
+    'emotes',
+    'gachiGASM',
+    'images',
+    'jojo',
+    'last_seen',
+    'logging',
+    'misc',
+    'moderator',
+    'pokemon',
+    'privacy',
+    'search',
+    'server',
+    'server_specific',
+    'settings',
+    'stats',
+    'utils',
+    'voting']
+
+
 class NotABot(BotBase):
-    def __init__(self, prefix, conf, aiohttp=None, test_mode=False, cogs=None, model: LoadedModel=None, poke_model=None, **options):
+    def __init__(self, prefix, conf, aiohttp=None, test_mode=False, cogs=None, model: LoadedModel=None, poke_model=None,
+                 model_loader=None, **options):
         super().__init__(prefix, conf, aiohttp=aiohttp, test_mode=test_mode, cogs=cogs, **options)
         cdm = CooldownManager()
         cdm.add_cooldown('oshit', 3, 8)
@@ -50,6 +82,8 @@ class NotABot(BotBase):
 
         self._random_color = None
         self._tf_model = model
+        # Loads the tf model in the background after ready so it doesn't slow down startup
+        self._model_loader = model_loader
         self._poke_model = poke_model
         self.polls = {}
         self.timeouts = {}
@@ -58,6 +92,9 @@ class NotABot(BotBase):
         self.every_giveaways = {}
         self.anti_abuse_switch = False  # lol
         self._server = WebhookServer(self)
+        self._partitions = PartitionManager(self, {'messages': self.config.messages_retention,
+                                                   'command_usage': self.config.command_usage_retention},
+                                            drop_expired=self.config.drop_expired_partitions)
         self.redis = None
         self.antispam = True
         self._ready_called = False
@@ -66,6 +103,10 @@ class NotABot(BotBase):
     def server(self):
         return self._server
 
+    @property
+    def partitions(self):
+        return self._partitions
+
     @property
     def tf_model(self):
         return self._tf_model
@@ -78,13 +119,19 @@ class NotABot(BotBase):
         logger.info('Caching guilds')
         t = time.time()
         guilds = self.guilds
-        sql = 'SELECT guild FROM guilds'
-        guild_ids = {r[0] for r in await self.dbutil.fetch(sql)}
+        if self.guild_cache.lazy:
+            # Only the guilds of this process are loaded and the rest on demand
+            with self.startup.phase('prefetch guild settings'):
+                guild_ids = await self.guild_cache.prefetch([g.id for g in guilds])
+        else:
+            sql = 'SELECT guild FROM guilds'
+            guild_ids = {r[0] for r in await self.dbutil.fetch(sql)}
         new_guilds = {s.id for s in guilds}.difference(guild_ids)
 
         blacklisted = await self.dbutil.get_blacklisted_guilds()
         blacklisted = {row['guild_id'] for row in blacklisted}
 
+        to_index = []
         for guild in guilds:
             if guild.id in blacklisted:
                 await guild.leave()
@@ -95,43 +142,35 @@ class NotABot(BotBase):
             if len(guild.roles) < 2:
                 continue
 
-            if not self._ready_called:
-                await self.dbutil.index_guild_roles(guild)
-                await self.dbutil.index_join_dates(guild)
+            to_index.append(guild)
 
-        logger.debug('Caching prefixes')
-        if new_guilds:
-            await self.dbutils.add_guilds(*new_guilds)
+        if not self._ready_called and to_index:
+            with self.startup.phase('index roles'):
+                if not await self.dbutil.index_guilds_roles(to_index):
+                    # Index guilds one by one so a single failing guild doesn't affect the others
+                    await gather_bounded(self.dbutil.index_guild_roles, to_index)
 
-        sql = 'SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes ON guilds.guild=prefixes.guild'
-        rows = {}
-        for row in await self.dbutil.fetch(sql):
-            guild_id = row['guild']
-            if guild_id in rows:
-                prefix = row['prefix']
-                if prefix is not None:
-                    rows[guild_id]['prefixes'].add(prefix)
+            with self.startup.phase('index join dates'):
+                await self.dbutil.index_guilds_join_dates(to_index)
 
-            else:
-                d = {**row}
-                d.pop('guild', None)
-                d['prefixes'] = {d.get('prefix') or self.default_prefix}
-                d.pop('prefix', None)
-                rows[guild_id] = d
+        if new_guilds:
+            await self.dbutils.add_guilds(*new_guilds)
 
-        for guild_id, row in rows.items():
-            self.guild_cache.update_cached_guild(guild_id, **row)
+        if not self.guild_cache.lazy:
+            logger.debug('Caching prefixes')
+            sql = 'SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes ON guilds.guild=prefixes.guild'
+            self.guild_cache.cache_rows(await self.dbutil.fetch(sql))
 
         if not self._ready_called:
             logger.info('Indexing user roles')
-            for guild in guilds:
-                if self.guild_cache.keeproles(guild.id):
-                    if guild.unavailable:
-                        continue
+            keeprole_guilds = [g for g in guilds if self.guild_cache.keeproles(g.id) and not g.unavailable]
+
+            # Chunking the guilds is the slow part so they are done concurrently
+            with self.startup.phase('index member roles'):
+                results = await gather_bounded(self.dbutil.index_guild_member_roles, keeprole_guilds)
 
-                    success = await self.dbutil.index_guild_member_roles(guild)
-                    if not success:
-                        raise EnvironmentError('Failed to cache keeprole servers')
+            if not all(results):
+                raise EnvironmentError('Failed to cache keeprole servers')
 
         # Always chunk my own server
         g = self.get_guild(217677285442977792)
@@ -153,19 +192,32 @@ class NotABot(BotBase):
                 await self.change_presence(activity=discord.Activity(**self.config.default_activity))
             return
 
+        self.startup.mark_connected()
         self._mention_prefix = (self.user.mention + ' ', f'<@!{self.user.id}> ')
         await self.dbutil.add_command('help')
         try:
-            await self.cache_guilds()
+            with self.startup.phase('cache_guilds'):
+                await self.cache_guilds()
         except InterfaceError as e:
             logger.exception("Failed to cache guilds")
             raise e
 
-        self.redis = await aioredis.create_redis((self.config.db_host, self.config.redis_port),
-                                                 password=self.config.redis_auth,
-                                                 loop=self.loop, encoding='utf-8')
-
-        await self.loop.run_in_executor(self.threadpool, self._load_cogs)
+        # Only one process should create and drop partitions
+        if self.is_primary_cluster:
+            with self.startup.phase('partitions'):
+                await self.partitions.maintain()
+            self.partitions.start()
+
+        with self.startup.phase('redis'):
+            self.redis = await aioredis.create_redis((self.config.db_host, self.config.redis_port),
+                                                     password=self.config.redis_auth,
+                                                     loop=self.loop, encoding='utf-8')
+
+        with self.startup.phase('cogs'):
+            await self.loop.run_in_executor(self.threadpool, self._load_cogs)
+        self.startup.mark_ready()
+        logger.info(f'Ready {self.startup.ready_at:.2f}s after startup')
+        self.loop.create_task(self._warmup())
         if self.config.default_activity:
             await self.change_presence(activity=discord.Activity(**self.config.default_activity))
         if self._random_color is None or self._random_color.done():
@@ -173,6 +225,24 @@ class NotABot(BotBase):
         logger.debug('READY')
         self._ready_called = True
 
+    async def _warmup(self):
+        """Load heavy dependencies in the background after startup"""
+        for module in warmup_modules:
+            with self.startup.phase(f'warmup {module._name}'):
+                try:
+                    await self.loop.run_in_executor(self.threadpool, module.load)
+                except ImportError:
+                    logger.exception(f'Failed to import {module._name}')
+
+        if self._model_loader is not None and self._tf_model is None:
+            with self.startup.phase('tensorflow'):
+                try:
+                    self._tf_model = await self.loop.run_in_executor(self.threadpool, self._model_loader)
+                except Exception:  # skipcq: PYL-W0703
+                    logger.exception('Failed to initialize tensorflow')
+
+        logger.debug(f'Startup timeline\n{self.startup.format()}')
+
     async def _random_color_task(self):
         if self.test_mode:
             return
@@ -224,24 +294,17 @@ class NotABot(BotBase):
             await guild.leave()
             return
 
-        sql = 'INSERT INTO guilds (guild) VALUES (%s) ON CONFLICT (guild) DO NOTHING' % guild.id
         try:
-            await self.dbutil.execute(sql)
-            await self.dbutil.execute('INSERT INTO prefixes (guild) VALUES (%s) ON CONFLICT DO NOTHING' % guild.id)
+            await self.dbutil.execute_statement('add_guild', guild.id)
+            await self.dbutil.execute_statement('add_guild_prefix', guild.id)
         except PostgresError:
             logger.exception('Failed to add new server')
 
-        sql = 'SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes ON guilds.guild=prefixes.guild WHERE guilds.guild=%s' % guild.id
-        rows = await self.dbutil.fetch(sql)
-        if not rows:
-            return
+        rows = await self.dbutil.fetch_statement('guild_settings', guild.id)
+        self.guild_cache.cache_rows(rows)
 
-        prefixes = {r['prefix'] for r in rows if r['prefix'] is not None} or {self.default_prefix}
-        d = {**rows[0]}
-        d.pop('guild', None)
-        d.pop('prefix', None)
-        d['prefixes'] = prefixes
-        self.guild_cache.update_cached_guild(guild.id, **d)
+    async def on_guild_remove(self, guild):
+        del self.guild_cache[guild.id]
 
     async def on_guild_role_delete(self, role):
         await self.dbutils.delete_role(role.id, role.guild.id)
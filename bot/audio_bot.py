@@ -1,6 +1,7 @@
 import discord
 
 from bot.botbase import BotBase
+from bot.guildcache import PrefixMatcher
 from bot.youtube import YTApi
 
 
@@ -10,6 +11,7 @@ class AudioBot(BotBase):
         self.playlists = {}
         self.viewed_playlists = {}
         self.prefix = self.get_command_prefix
+        self._prefix_matcher = PrefixMatcher(self.default_prefix)
         self.yt_api = YTApi(self.config.youtube_api_key)
 
     async def on_ready(self):
@@ -23,3 +25,6 @@ class AudioBot(BotBase):
     @staticmethod
     def get_command_prefix(self, message):  # skipcq: PYL-W0211
         return self.default_prefix
+
+    def match_prefix(self, message):
+        return self._prefix_matcher.match(message.content)
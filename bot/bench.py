@@ -0,0 +1,208 @@
+"""
+Offline benchmarks. Run with test_run.py --bench [name] [args]
+
+Benchmarks that need the bot create it like run.py does with the
+production cog list and test mode off so the listeners and the event
+loop behave like they do in production. The bot uses the test database
+or the in memory backend when Backend = memory is set in the Database
+section of the config. Nothing connects to discord.
+"""
+
+import logging
+
+import discord
+
+logger = logging.getLogger('terminal')
+
+
+def create_bot(config):
+    """Create the main bot for a benchmark without starting it"""
+    from bot.Not_a_bot import NotABot, INITIAL_COGS
+
+    intents = discord.Intents.default()
+    intents.members = True
+    return NotABot(prefix='!', conf=config, max_messages=5000, cogs=INITIAL_COGS,
+                   intents=intents, chunk_guilds_at_startup=False, database='test')
+
+
+def bench_replay(config, args):
+    """
+    Replays gateway events to the bot.
+    Args: [events] [rate] [recorded events file]
+    """
+    from bot.replay import EventFactory, ReplayHarness, read_recorded_events
+
+    event_count = int(args[0]) if len(args) > 0 else 10000
+    rate = int(args[1]) if len(args) > 1 else 500
+
+    bot = create_bot(config)
+    factory = EventFactory(prefix=bot.default_prefix, seed=0)
+    harness = ReplayHarness(bot, factory)
+    if len(args) > 2:
+        events = read_recorded_events(args[2])
+    else:
+        events = factory.events(event_count)
+
+    try:
+        bot.loop.run_until_complete(harness.setup())
+        return bot.loop.run_until_complete(harness.run(events, rate=rate))
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+
+def bench_dispatch(config, args):
+    """
+    Dispatch cost of messages with and without listener scopes.
+    Args: [messages]
+    """
+    from bot.dispatch_bench import run
+    from bot.replay import EventFactory, ReplayHarness
+
+    bot = create_bot(config)
+    factory = EventFactory(prefix=bot.default_prefix, seed=0)
+    harness = ReplayHarness(bot, factory)
+    try:
+        bot.loop.run_until_complete(harness.setup())
+        return bot.loop.run_until_complete(run(bot, harness, factory, int(args[0]) if args else 5000))
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+
+def bench_reactions(config, args):
+    """
+    Cost of a reaction event with many paginators waiting for reactions.
+    Args: [paginators]
+    """
+    from bot.reaction_bench import run
+
+    return run(int(args[0]) if args else 1000)
+
+
+def bench_guildcache(config, args):
+    """
+    Memory and lookup times of the guild settings cache.
+    Args: [guilds]
+    """
+    from bot.guildcache_bench import run
+
+    return run(int(args[0]) if args else 100000)
+
+
+def bench_blacklist(config, args):
+    """
+    Per invocation latency of the command blacklist checks.
+    Args: [rules] [guilds]
+    """
+    from bot.blacklist_bench import run
+
+    rules = int(args[0]) if len(args) > 0 else 100000
+    guilds = int(args[1]) if len(args) > 1 else 1000
+    return run(rules, guilds)
+
+
+def bench_prefix(config, args):
+    """
+    Prefix matching of messages compared to the old startswith path.
+    Args: [guilds]
+    """
+    from bot.prefix_bench import run
+
+    return run(int(args[0]) if args else 1000)
+
+
+def bench_startup(config, args):
+    """
+    Time to ready and to the first command of a cold start with the memory backend.
+    Args: [runs]
+    """
+    from bot.startup_bench import run
+
+    return run(int(args[0]) if args else 5)
+
+
+def bench_bulk_upsert(config, args):
+    """
+    Bulk upsert compared to the VALUES string and executemany inserts.
+    Needs postgres.
+    Args: [rows...]
+    """
+    from bot.bulk_upsert_bench import run
+
+    if config.db_backend == 'memory':
+        return 'bulk_upsert benchmark needs postgres. Remove Backend = memory from the config'
+
+    sizes = [int(a) for a in args] or (1000, 100000, 1000000)
+    bot = create_bot(config)
+    try:
+        return bot.loop.run_until_complete(run(bot.dbutil, sizes))
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+
+def bench_command_activity(config, args):
+    """
+    Latency of the command stats queries with and without the daily rollups.
+    Needs postgres.
+    Args: [rows] [users]
+    """
+    from bot.command_activity_bench import run
+
+    if config.db_backend == 'memory':
+        return 'command_activity benchmark needs postgres. Remove Backend = memory from the config'
+
+    rows = int(args[0]) if len(args) > 0 else 5000000
+    users = int(args[1]) if len(args) > 1 else 100000
+    bot = create_bot(config)
+    try:
+        return bot.loop.run_until_complete(run(bot.dbutil, rows, users))
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+
+def bench_statements(config, args):
+    """
+    Named statements compared to queries with the values formatted in.
+    Needs postgres.
+    Args: [queries]
+    """
+    from bot.statement_bench import run
+
+    if config.db_backend == 'memory':
+        return 'statements benchmark needs postgres. Remove Backend = memory from the config'
+
+    bot = create_bot(config)
+    try:
+        return bot.loop.run_until_complete(run(bot.dbutil, int(args[0]) if args else 2000))
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+
+BENCHMARKS = {
+    'replay': bench_replay,
+    'dispatch': bench_dispatch,
+    'reactions': bench_reactions,
+    'guildcache': bench_guildcache,
+    'blacklist': bench_blacklist,
+    'prefix': bench_prefix,
+    'startup': bench_startup,
+    'bulk_upsert': bench_bulk_upsert,
+    'command_activity': bench_command_activity,
+    'statements': bench_statements,
+}
+
+
+def run_benchmark(config, args):
+    """
+    Run the benchmark named by the first argument. When the first argument
+    isn't the name of a benchmark the gateway replay benchmark is run
+
+    Returns:
+        The report as a string
+    """
+    if args and args[0] in BENCHMARKS:
+        name, args = args[0], args[1:]
+    else:
+        name = 'replay'
+
+    logger.info(f'Running benchmark {name}')
+    return BENCHMARKS[name](config, args)
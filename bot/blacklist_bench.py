@@ -0,0 +1,92 @@
+"""
+Per invocation latency of the command blacklist checks.
+Run with test_run.py --bench blacklist [rules] [guilds]
+
+Times the lookups DatabaseUtils.check_blacklist and the help command
+make against a BlacklistCache filled with random rules. Doesn't need
+discord or the database. Before the cache every check was one or two
+queries.
+"""
+
+import gc
+import random
+import time
+import tracemalloc
+
+from bot.blacklist_cache import BlacklistCache
+from bot.globals import BlacklistTypes
+
+_COMMANDS = ('ping', 'ban', 'mute', 'color', 'avatar', 'userinfo', 'seen', 'stats')
+
+
+def _random_rule(rng, rule_id, guilds):
+    command = rng.choice(_COMMANDS + (None,))
+    if rng.random() < 0.01:
+        return dict(id=rule_id, command=command, type=BlacklistTypes.GLOBAL,
+                    uid=rng.randrange(10000) if rng.random() < 0.9 else None)
+
+    guild = rng.randrange(guilds)
+    row = dict(id=rule_id, command=command, guild=guild,
+               type=rng.choice((BlacklistTypes.WHITELIST, BlacklistTypes.BLACKLIST)))
+    scope = rng.random()
+    if scope < 0.4:
+        row['uid'] = rng.randrange(10000)
+    elif scope < 0.7:
+        row['role'] = guild * 100 + rng.randrange(20)
+    elif scope < 0.9:
+        row['channel'] = guild * 100 + rng.randrange(20)
+
+    return row
+
+
+def _random_check(rng, guilds):
+    guild = rng.randrange(guilds * 2)  # Half of the guilds have no rules
+    roles = [guild * 100 + r for r in rng.sample(range(20), rng.randint(0, 5))]
+    return rng.choice(_COMMANDS), guild, rng.randrange(10000), roles, guild * 100 + rng.randrange(20)
+
+
+def _time_ns(func, checks):
+    t = time.perf_counter()
+    for check in checks:
+        func(*check)
+    return (time.perf_counter() - t) / len(checks) * 1e9
+
+
+def run(rules=100000, guilds=1000, checks=200000, seed=0):
+    """
+    Returns:
+        The report as a string
+    """
+    rng = random.Random(seed)
+    rows = [_random_rule(rng, i, guilds) for i in range(rules)]
+
+    gc.collect()
+    tracemalloc.start()
+    t = time.perf_counter()
+    cache = BlacklistCache(None)
+    for row in rows:
+        cache.add_rule(**row)
+    load_time = time.perf_counter() - t
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queries = [_random_check(rng, guilds) for _ in range(checks)]
+
+    def check_blacklist(command, guild, user, roles, channel):
+        # Same lookups as DatabaseUtils.check_blacklist
+        if cache.is_globally_blacklisted(command, user):
+            return False
+        return cache.get_value(command, guild, user, roles, channel)
+
+    def help_page(_, guild, user, roles, channel):
+        return cache.get_command_values(guild, user, roles, channel)
+
+    lines = [f'{rules} rules in {guilds} guilds loaded in {load_time * 1000:.0f}ms using {memory / 2**20:.1f} MiB',
+             f'check_blacklist {_time_ns(check_blacklist, queries):.0f}ns per invocation',
+             f'help page perms {_time_ns(help_page, queries):.0f}ns per invocation']
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,333 @@
+import asyncio
+import logging
+
+from asyncpg.exceptions import PostgresError, InterfaceError
+
+from bot.globals import BlacklistTypes, PermValues
+from bot.pool_manager import INTERACTIVE, BACKGROUND
+
+logger = logging.getLogger('terminal')
+
+
+def rule_value(type_, uid, role, channel):
+    """
+    Calculates the permission value of a single command_blacklist row.
+    Works the same way as utils.utilities.check_perms does for one row
+    """
+    if type_ == BlacklistTypes.WHITELIST:
+        v1 = PermValues.VALUES['whitelist']
+    else:
+        v1 = PermValues.VALUES['blacklist']
+
+    if uid is not None:
+        v2 = PermValues.VALUES['user']
+    elif role is not None:
+        v2 = PermValues.VALUES['role']
+    elif channel is not None:
+        v2 = PermValues.VALUES['channel']
+    else:
+        v2 = PermValues.VALUES['guild']
+
+    return v1 | v2
+
+
+class Rule:
+    __slots__ = ('id', 'command', 'type', 'uid', 'role', 'channel', 'guild', 'value')
+
+    def __init__(self, id, command, type, uid, role, channel, guild):  # skipcq: PYL-W0622
+        self.id = id
+        self.command = command
+        self.type = type
+        self.uid = uid
+        self.role = role
+        self.channel = channel
+        self.guild = guild
+        self.value = rule_value(type, uid, role, channel)
+
+    @property
+    def is_compound(self):
+        """Rules with more than one scope set must match all of them"""
+        return sum(v is not None for v in (self.uid, self.role, self.channel)) > 1
+
+    def matches(self, user_id, role_ids, channel_id):
+        if self.uid is not None and self.uid != user_id:
+            return False
+        if self.role is not None and self.role not in role_ids:
+            return False
+        if self.channel is not None and self.channel != channel_id:
+            return False
+
+        return True
+
+
+class _CommandRules:
+    """Rules of a single command in a single guild split by scope"""
+    __slots__ = ('users', 'roles', 'channels', 'guild', 'compound')
+
+    def __init__(self):
+        self.users = {}
+        self.roles = {}
+        self.channels = {}
+        self.guild = {}
+        self.compound = {}
+
+    def _scope(self, rule):
+        if rule.is_compound:
+            return self.compound, None
+        if rule.uid is not None:
+            return self.users, rule.uid
+        if rule.role is not None:
+            return self.roles, rule.role
+        if rule.channel is not None:
+            return self.channels, rule.channel
+
+        return self.guild, None
+
+    def add(self, rule):
+        d, key = self._scope(rule)
+        if d is self.guild or d is self.compound:
+            d[rule.id] = rule
+        else:
+            d.setdefault(key, {})[rule.id] = rule
+
+    def remove(self, rule):
+        d, key = self._scope(rule)
+        if d is self.guild or d is self.compound:
+            d.pop(rule.id, None)
+            return
+
+        rules = d.get(key)
+        if rules is None:
+            return
+
+        rules.pop(rule.id, None)
+        if not rules:
+            d.pop(key, None)
+
+    def __bool__(self):
+        return bool(self.users or self.roles or self.channels or self.guild or self.compound)
+
+    def smallest(self, user_id, role_ids, channel_id):
+        """
+        Smallest permission value of the rules that apply or None if no rules apply
+        """
+        values = []
+
+        rules = self.users.get(user_id)
+        if rules:
+            values.extend(r.value for r in rules.values())
+
+        if self.roles:
+            for role_id in role_ids:
+                rules = self.roles.get(role_id)
+                if rules:
+                    values.extend(r.value for r in rules.values())
+
+        rules = self.channels.get(channel_id)
+        if rules:
+            values.extend(r.value for r in rules.values())
+
+        if self.guild:
+            values.extend(r.value for r in self.guild.values())
+
+        for rule in self.compound.values():
+            if rule.matches(user_id, role_ids, channel_id):
+                values.append(rule.value)
+
+        if not values:
+            return None
+
+        return min(values)
+
+
+class BlacklistCache:
+    """
+    In memory copy of the command_blacklist table that answers permission
+    checks without touching the database. Values returned are the same
+    as the ones returned by utils.utilities.check_perms
+
+    Changes made with the command blacklist commands are published on the
+    invalidation bus so other processes reload the changed rule. Rules
+    added straight to the database (e.g. global blacklists) are picked up
+    by a periodic full reload.
+    """
+    SELECT = 'SELECT id, command, type, uid, role, channel, guild FROM command_blacklist'
+
+    def __init__(self, bot, resync_interval=600):
+        self._bot = bot
+        self._resync_interval = resync_interval
+        self._resync_task = None
+        self._rules = {}
+        # command -> uid -> {rule id: rule}. uid of None means everyone
+        self._global = {}
+        # guild id -> command -> _CommandRules
+        self._guilds = {}
+
+    @property
+    def bot(self):
+        return self._bot
+
+    def __len__(self):
+        return len(self._rules)
+
+    async def load(self, priority=INTERACTIVE):
+        rows = await self.bot.dbutil.fetch(self.SELECT, priority=priority)
+
+        self._rules = {}
+        self._global = {}
+        self._guilds = {}
+        for row in rows:
+            self.add_rule(**row)
+
+        logger.debug(f'Loaded {len(self._rules)} command permission rules')
+
+    async def refresh(self, id):  # skipcq: PYL-W0622
+        """Reload a single rule from the database. Removes the rule if it no longer exists"""
+        row = await self.bot.dbutil.fetch(self.SELECT + ' WHERE id=$1', (id,), fetchmany=False)
+        if row is None:
+            self.remove_rule(id)
+        else:
+            self.add_rule(**row)
+
+    async def start(self):
+        await self.load()
+
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = self.bot.loop.create_task(self._resync_loop())
+
+    def stop(self):
+        if self._resync_task:
+            self._resync_task.cancel()
+            self._resync_task = None
+
+    async def _resync_loop(self):
+        while True:
+            await asyncio.sleep(self._resync_interval)
+
+            try:
+                await self.load(priority=BACKGROUND)
+            except (PostgresError, InterfaceError, OSError):
+                logger.exception('Failed to resync command blacklist')
+
+    def add_rule(self, id, command, type, uid=None, role=None, channel=None, guild=None):  # skipcq: PYL-W0622
+        if id in self._rules:
+            self.remove_rule(id)
+
+        rule = Rule(id, command, type, uid, role, channel, guild)
+        self._rules[id] = rule
+
+        if type == BlacklistTypes.GLOBAL:
+            self._global.setdefault(command, {}).setdefault(uid, {})[id] = rule
+            return
+
+        if guild is None:
+            return
+
+        commands = self._guilds.setdefault(guild, {})
+        rules = commands.get(command)
+        if rules is None:
+            rules = _CommandRules()
+            commands[command] = rules
+
+        rules.add(rule)
+
+    def remove_rule(self, id):  # skipcq: PYL-W0622
+        rule = self._rules.pop(id, None)
+        if rule is None:
+            return
+
+        if rule.type == BlacklistTypes.GLOBAL:
+            users = self._global.get(rule.command)
+            if not users:
+                return
+
+            rules = users.get(rule.uid)
+            if rules:
+                rules.pop(id, None)
+                if not rules:
+                    users.pop(rule.uid, None)
+            if not users:
+                self._global.pop(rule.command, None)
+            return
+
+        commands = self._guilds.get(rule.guild)
+        if not commands:
+            return
+
+        rules = commands.get(rule.command)
+        if rules is None:
+            return
+
+        rules.remove(rule)
+        if not rules:
+            commands.pop(rule.command, None)
+        if not commands:
+            self._guilds.pop(rule.guild, None)
+
+    def set_rule_type(self, id, type_):  # skipcq: PYL-W0622
+        rule = self._rules.get(id)
+        if rule is None:
+            return
+
+        self.add_rule(rule.id, rule.command, type_, uid=rule.uid, role=rule.role,
+                      channel=rule.channel, guild=rule.guild)
+
+    def is_globally_blacklisted(self, command, user_id):
+        for cmd in (command, None):
+            users = self._global.get(cmd)
+            if not users:
+                continue
+
+            if users.get(user_id) or users.get(None):
+                return True
+
+        return False
+
+    def get_value(self, command, guild_id, user_id, role_ids, channel_id):
+        """
+        Get the smallest permission value that applies to the command or None
+        when no rules apply. Global blacklists are not checked here.
+
+        Args:
+            command: Qualified name of the command
+            guild_id: Id of the guild
+            user_id: Id of the user
+            role_ids: Collection of the users role ids
+            channel_id: Id of the channel
+        """
+        commands = self._guilds.get(guild_id)
+        if not commands:
+            return None
+
+        smallest = None
+        for cmd in (command, None):
+            rules = commands.get(cmd)
+            if rules is None:
+                continue
+
+            v = rules.smallest(user_id, role_ids, channel_id)
+            if v is not None and (smallest is None or v < smallest):
+                smallest = v
+
+        return smallest
+
+    def get_command_values(self, guild_id, user_id, role_ids, channel_id):
+        """
+        Permission values of every command that has rules applying to the
+        given user. Rules that apply to all commands are not included.
+
+        Returns:
+            dict of command name: permission value
+        """
+        commands = self._guilds.get(guild_id)
+        values = {}
+        if commands:
+            for cmd, rules in commands.items():
+                if cmd is None:
+                    continue
+
+                v = rules.smallest(user_id, role_ids, channel_id)
+                if v is not None:
+                    values[cmd] = v
+
+        return values
@@ -34,6 +34,8 @@ from discord.ext.commands import CheckFailure
 from bot.commands import command, group, Command, Group, cooldown
 from bot.cooldowns import CooldownMapping
 from bot.formatter import HelpCommand
+from bot.metrics import ListenerStats, QueryStats
+from bot.pool_manager import PoolManager
 from utils.utilities import seconds2str, call_later
 
 try:
@@ -60,6 +62,7 @@ __all__ = [
     'has_permissions',
     'bot_has_permissions',
     'guild_has_features',
+    'listener_scope',
     'Bot'
 ]
 
@@ -111,6 +114,8 @@ class Context(commands.context.Context):
 class Bot(commands.AutoShardedBot):
     def __init__(self, prefix, config, aiohttp=None, **options):
         options.setdefault('help_command', HelpCommand())
+        # Index of this process when running in cluster mode. See bot.cluster
+        self.cluster_id = options.pop('cluster_id', None)
         super().__init__(prefix, owner_id=config.owner, **options)
         self._runas = None
         self._exit_code = 0
@@ -129,10 +134,115 @@ class Bot(commands.AutoShardedBot):
         self.voice_clients_ = {}
         self._error_cdm = CooldownMapping(commands.Cooldown(2, 5, commands.BucketType.guild))
 
+        # Listener latency stats. None when disabled
+        self.listener_stats = ListenerStats() if getattr(config, 'listener_stats', False) else None
+        # Database query stats. Always collected. Kept here so they survive reloading dbutil
+        self.query_stats = QueryStats(getattr(config, 'slow_query_threshold', 500) / 1000)
+        # Lanes of the database pool. See DatabaseUtils.acquire
+        self.pool_manager = PoolManager(self, getattr(config, 'background_connections', 6))
+
+        # Cached dispatch tables of extra_events. See _get_routes
+        self._listener_routes = {}
+
+        # message id -> {future: check} of reaction waiters.
+        # Waiters not bound to a message use wait_for('reaction_changed')
+        self._reaction_waiters = {}
+
     @property
     def runas(self):
         return self._runas
 
+    @property
+    def is_primary_cluster(self):
+        """
+        True when not running in cluster mode or when this is the first cluster.
+        Things that should only run once (e.g. the webhook server) check this
+        """
+        return not self.cluster_id
+
+    def owns_guild(self, guild_id):
+        """
+        Whether the guild belongs to one of the shards of this process.
+        Used to partition guild specific tasks loaded from the database
+        when multiple processes share it
+        """
+        if not self.shard_ids or not self.shard_count:
+            return True
+
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def add_listener(self, func, name=None):
+        super().add_listener(func, name=name)
+        self._listener_routes.pop(func.__name__ if name is None else name, None)
+
+    def remove_listener(self, func, name=None):
+        super().remove_listener(func, name=name)
+        self._listener_routes.pop(func.__name__ if name is None else name, None)
+
+    def _get_routes(self, ev):
+        """
+        Get the dispatch table of an event. Listeners without a scope are
+        always called and scoped ones only for their guilds and channels
+        """
+        routes = self._listener_routes.get(ev)
+        if routes is not None:
+            return routes
+
+        unscoped = []
+        scoped = []
+        guilds = {}
+        channels = {}
+        for listener in self.extra_events.get(ev, ()):
+            scope = getattr(listener, '__listener_scope__', None)
+            if scope is None:
+                unscoped.append(listener)
+                continue
+
+            scoped.append(listener)
+            guild_ids, channel_ids = scope
+            for guild_id in guild_ids:
+                guilds.setdefault(guild_id, []).append(listener)
+            for channel_id in channel_ids:
+                channels.setdefault(channel_id, []).append(listener)
+
+        routes = (unscoped, scoped, guilds, channels)
+        self._listener_routes[ev] = routes
+        return routes
+
+    def dispatch(self, event_name, *args, **kwargs):
+        # Same as commands.Bot.dispatch except that it skips listeners
+        # that are scoped to other guilds or channels
+        discord.Client.dispatch(self, event_name, *args, **kwargs)
+        ev = 'on_' + event_name
+        if ev not in self.extra_events:
+            return
+
+        unscoped, scoped, guilds, channels = self._get_routes(ev)
+        for event in unscoped:
+            self._schedule_event(event, ev, *args, **kwargs)
+
+        if not scoped:
+            return
+
+        guild_id, channel_id = _event_location(args)
+        if guild_id is None and channel_id is None:
+            # Location couldn't be determined so call every listener
+            listeners = scoped
+        else:
+            listeners = guilds.get(guild_id, [])
+            extra = channels.get(channel_id)
+            if extra:
+                listeners = listeners + [l for l in extra if l not in listeners]
+
+        for event in listeners:
+            self._schedule_event(event, ev, *args, **kwargs)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        if self.listener_stats is not None:
+            coro = self.listener_stats.wrap(coro, event_name)
+
+        return super()._schedule_event(coro, event_name, *args, **kwargs)
+
     def _check_error_cd(self, message):
         if self._error_cdm.valid:
             bucket = self._error_cdm.get_bucket(message)
@@ -286,7 +396,56 @@ class Bot(commands.AutoShardedBot):
 
         return decorator
 
+    async def wait_for_reaction(self, message_id, check=None, timeout=None):
+        """
+        Works like wait_for('reaction_changed') except that only reactions
+        to the message with the given id are checked. Waiters are indexed by
+        message id so other messages' reactions never have to go through them
+
+        Returns:
+            tuple of reaction, user
+        """
+        future = self.loop.create_future()
+        if check is None:
+            def check(*_):
+                return True
+
+        waiters = self._reaction_waiters.get(message_id)
+        if waiters is None:
+            waiters = {}
+            self._reaction_waiters[message_id] = waiters
+
+        waiters[future] = check
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters.pop(future, None)
+            if not waiters and self._reaction_waiters.get(message_id) is waiters:
+                self._reaction_waiters.pop(message_id, None)
+
+    def _handle_message_reaction_waiters(self, reaction, user):
+        waiters = self._reaction_waiters.get(reaction.message.id)
+        if not waiters:
+            return
+
+        for future, condition in list(waiters.items()):
+            if future.done():
+                waiters.pop(future, None)
+                continue
+
+            try:
+                result = condition(reaction, user)
+            except Exception as e:  # skipcq: PYL-W0703
+                future.set_exception(e)
+                waiters.pop(future, None)
+            else:
+                if result:
+                    future.set_result((reaction, user))
+                    waiters.pop(future, None)
+
     def handle_reaction_changed(self, reaction, user):
+        self._handle_message_reaction_waiters(reaction, user)
+
         removed = []
         event = 'reaction_changed'
         listeners = self._listeners.get(event)
@@ -320,6 +479,47 @@ class Bot(commands.AutoShardedBot):
         self.handle_reaction_changed(reaction, user)
 
 
+def _event_location(args):
+    """
+    Get the guild and channel ids of an event based on its first argument.
+    Returns None for the values that can't be determined
+    """
+    if not args:
+        return None, None
+
+    obj = args[0]
+    if isinstance(obj, discord.Guild):
+        return obj.id, None
+
+    guild_id = getattr(obj, 'guild_id', None)
+    if guild_id is None:
+        guild_id = getattr(getattr(obj, 'guild', None), 'id', None)
+
+    channel_id = getattr(obj, 'channel_id', None)
+    if channel_id is None:
+        channel_id = getattr(getattr(obj, 'channel', None), 'id', None)
+
+    return guild_id, channel_id
+
+
+def listener_scope(guilds=(), channels=()):
+    """
+    Limits a cog listener to events from the given guilds or channels.
+    Events that don't come from any of them won't schedule the listener at all.
+    The listener should still do its own checks as events that have no
+    guild or channel are dispatched to every listener.
+
+    Args:
+        guilds: Iterable of guild ids
+        channels: Iterable of channel ids
+    """
+    def decorator(func):
+        func.__listener_scope__ = (frozenset(guilds), frozenset(channels))
+        return func
+
+    return decorator
+
+
 def has_permissions(**perms):
     """
     Same as the default discord.ext.commands.has_permissions
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+
+from asyncpg.exceptions import PostgresError, InterfaceError
+
+logger = logging.getLogger('terminal')
+
+
+class BotBans:
+    """
+    Resident set of botbanned user ids so on_message doesn't have to
+    query the database for every message.
+
+    The set is loaded once on startup and kept current by
+    DatabaseUtils.botban and DatabaseUtils.botunban. Changes made by other
+    processes (e.g. the audio bot) are received with postgres LISTEN/NOTIFY
+    and a periodic full reload is done in case notifications were missed.
+    """
+    CHANNEL = 'botbans'
+
+    def __init__(self, bot, resync_interval=600):
+        self._bot = bot
+        self._banned = set()
+        self._resync_interval = resync_interval
+        self._conn = None
+        self._resync_task = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def bot(self):
+        return self._bot
+
+    def __len__(self):
+        return len(self._banned)
+
+    def __contains__(self, user_id):
+        return self.is_banned(user_id)
+
+    def is_banned(self, user_id):
+        if user_id in self._banned:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def add(self, user_id):
+        self._banned.add(user_id)
+
+    def remove(self, user_id):
+        self._banned.discard(user_id)
+
+    async def load(self):
+        rows = await self.bot.dbutil.fetch('SELECT uid FROM banned_users')
+        self._banned = {r['uid'] for r in rows}
+        logger.debug(f'Loaded {len(self._banned)} botbans')
+
+    async def start(self):
+        await self._listen()
+        await self.load()
+
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = self.bot.loop.create_task(self._resync_loop())
+
+    async def stop(self):
+        if self._resync_task:
+            self._resync_task.cancel()
+            self._resync_task = None
+
+        if self._conn is not None:
+            conn = self._conn
+            self._conn = None
+            try:
+                await conn.remove_listener(self.CHANNEL, self._on_notify)
+            except InterfaceError:
+                pass
+            await self.bot.pool.release(conn)
+
+    async def _listen(self):
+        if self._conn is not None and not self._conn.is_closed():
+            return
+
+        # Dedicated connection that is held for as long as we want notifications
+        self._conn = await self.bot.pool.acquire()
+        await self._conn.add_listener(self.CHANNEL, self._on_notify)
+
+    def _on_notify(self, _conn, _pid, _channel, payload):
+        action, _, user_id = payload.partition(':')
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            logger.warning(f'Invalid botban notification {payload}')
+            return
+
+        if action == 'ban':
+            self.add(user_id)
+        elif action == 'unban':
+            self.remove(user_id)
+
+    async def _resync_loop(self):
+        while True:
+            await asyncio.sleep(self._resync_interval)
+
+            try:
+                # Connection might have been closed in which case we have to
+                # listen again before the reload so nothing is lost in between
+                if self._conn is not None and self._conn.is_closed():
+                    conn = self._conn
+                    self._conn = None
+                    await self.bot.pool.release(conn)
+
+                await self._listen()
+
+                await self.load()
+            except (PostgresError, InterfaceError, OSError):
+                logger.exception('Failed to resync botbans')
@@ -30,28 +30,57 @@ import asyncpg
 from discord.ext.commands.errors import ExtensionError
 
 from bot import exceptions
+from bot.blacklist_cache import BlacklistCache
 from bot.bot import Bot
+from bot.botbans import BotBans
 from bot.dbutil import DatabaseUtils
 from bot.globals import Auth
 from bot.guildcache import GuildCache
+from bot.invalidation import InvalidationBus
+from bot.memory_db import MemoryDatabaseUtils, MemoryPool
+from bot.staff_cache import StaffCache
+from bot.startup import StartupTimeline
 
 logger = logging.getLogger('terminal')
 
 
 class BotBase(Bot):
     """Base class for main bot. Used to separate audio part from main bot"""
-    def __init__(self, prefix, conf, aiohttp=None, test_mode=False, cogs=None, **options):
+    def __init__(self, prefix, conf, aiohttp=None, test_mode=False, cogs=None, database=None, **options):
         super().__init__(self.get_command_prefix, conf, aiohttp, **options)
+        self._startup = StartupTimeline()
+        self._startup.add('imports and config', self._startup.started_at, time.perf_counter() - self._startup.started_at)
         self.default_prefix = prefix
         self._mention_prefix = ()
         self.test_mode = test_mode
+        # Name of the postgres database. Defaults to test in test mode
+        self._database = database or ('discord' if not test_mode else 'test')
         if test_mode:
             self.loop.set_debug(True)
 
-        self._guild_cache = GuildCache(self)
-        self._dbutil = DatabaseUtils(self)
+        self._guild_cache = GuildCache(self, max_size=self.config.guild_cache_size)
+        if self.config.db_backend == 'memory':
+            self._dbutil = MemoryDatabaseUtils(self)
+        else:
+            self._dbutil = DatabaseUtils(self)
+        self._botbans = BotBans(self)
+        self._invalidation = InvalidationBus(self)
+        self._invalidation.subscribe('guild_settings', self._guild_cache.refresh, self._guild_cache.resync)
+        self._blacklist_cache = BlacklistCache(self)
+        self._invalidation.subscribe('command_blacklist', self._blacklist_cache.refresh,
+                                     self._blacklist_cache.load)
+        self._staff = StaffCache(self)
         self.call_laters = {}
-        self.loop.run_until_complete(self._setup_db())
+        with self._startup.phase('database pool'):
+            self.loop.run_until_complete(self._setup_db())
+        with self._startup.phase('botbans'):
+            self.loop.run_until_complete(self._botbans.start())
+        with self._startup.phase('invalidation bus'):
+            self.loop.run_until_complete(self._invalidation.start())
+        with self._startup.phase('command blacklist'):
+            self.loop.run_until_complete(self._blacklist_cache.start())
+        with self._startup.phase('bot staff'):
+            self.loop.run_until_complete(self._staff.load())
         self.threadpool = ThreadPoolExecutor(4)
         self.loop.set_default_executor(self.threadpool)
 
@@ -60,9 +89,14 @@ class BotBase(Bot):
         else:
             self.default_cogs = set()
 
+        self._startup.mark_initialized()
+
     async def _setup_db(self):
-        db = 'discord' if not self.test_mode else 'test'
-        self._pool = await asyncpg.create_pool(database=db,
+        if self.config.db_backend == 'memory':
+            self._pool = MemoryPool(max_size=20)
+            return
+
+        self._pool = await asyncpg.create_pool(database=self._database,
                                                user=self.config.db_user,
                                                host=self.config.db_host,
                                                loop=self.loop,
@@ -76,6 +110,12 @@ class BotBase(Bot):
     # I made this a staticmethod instead
     @staticmethod
     def get_command_prefix(self, message):  # skipcq: PYL-W0211
+        prefix = self.match_prefix(message)
+        if prefix is not None:
+            return prefix
+
+        # No prefix matched. Return every prefix so the context gets created
+        # the same way it would without prefix matching
         guild = message.guild
         if not guild:
             prefixes = (*self._mention_prefix, self.default_prefix)
@@ -83,14 +123,55 @@ class BotBase(Bot):
             prefixes = (*self.guild_cache.prefixes(guild.id), *self._mention_prefix)
         return prefixes
 
+    def match_prefix(self, message):
+        """
+        Get the prefix the message starts with or None if the message
+        doesn't start with any of the usable prefixes
+        """
+        content = message.content
+        guild = message.guild
+        if guild:
+            prefix = self.guild_cache.prefix_matcher(guild.id).match(content)
+            if prefix is not None:
+                return prefix
+
+        for prefix in self._mention_prefix:
+            if content.startswith(prefix):
+                return prefix
+
+        if not guild and content.startswith(self.default_prefix):
+            return self.default_prefix
+
+        return None
+
     @property
     def pool(self):
         return self._pool
 
+    @property
+    def startup(self) -> StartupTimeline:
+        return self._startup
+
     @property
     def guild_cache(self):
         return self._guild_cache
 
+    @property
+    def botbans(self) -> BotBans:
+        return self._botbans
+
+    @property
+    def invalidation(self) -> InvalidationBus:
+        return self._invalidation
+
+    @property
+    def blacklist_cache(self) -> BlacklistCache:
+        return self._blacklist_cache
+
+    @property
+    def staff(self) -> StaffCache:
+        return self._staff
+
     @property
     def dbutil(self) -> DatabaseUtils:
         return self._dbutil
@@ -107,7 +188,9 @@ class BotBase(Bot):
                 if cog in self.extensions:
                     continue
 
-                self.load_extension(cog)
+                # Includes the import time of the cog and its dependencies
+                with self.startup.phase(f'load {cog}'):
+                    self.load_extension(cog)
             except ExtensionError as e:
                 if not print_err:
                     errors.append('Failed to load extension {}\n{}: {}'.format(cog, type(e).__name__, e))
@@ -122,10 +205,13 @@ class BotBase(Bot):
             self.unload_extension(c)
 
     async def on_ready(self):
+        self.startup.mark_connected()
         self._mention_prefix = (self.user.mention, f'<@!{self.user.id}>')
         logger.info(f'Logged in as {self.user.name}')
         await self.dbutil.add_command('help')
-        await self.loop.run_in_executor(self.threadpool, self._load_cogs)
+        with self.startup.phase('cogs'):
+            await self.loop.run_in_executor(self.threadpool, self._load_cogs)
+        self.startup.mark_ready()
         logger.debug('READY')
 
         for guild in self.guilds:
@@ -143,7 +229,16 @@ class BotBase(Bot):
             return
 
         # Ignore if user is botbanned
-        if message.author.id != self.owner_id and (await self.dbutil.fetch('SELECT 1 FROM banned_users WHERE uid=%s' % message.author.id, fetchmany=False)):
+        if message.author.id != self.owner_id and message.author.id in self.botbans:
+            return
+
+        # Prefixes must be known before matching them
+        guild = message.guild
+        if guild is not None and self.guild_cache.lazy and not self.guild_cache.is_cached(guild.id):
+            await self.guild_cache.load(guild.id)
+
+        # No need to create a context for messages that can't be commands
+        if self.match_prefix(message) is None:
             return
 
         await self.process_commands(message, local_time=local)
@@ -152,15 +247,7 @@ class BotBase(Bot):
         if auth_level == 0:
             return True
 
-        sql = 'SELECT auth_level FROM bot_staff WHERE uid=%s' % user_id
-        rows = await self.dbutil.fetch(sql, fetchmany=False)
-        if not rows:
-            return False
-
-        if rows['auth_level'] >= auth_level:
-            return True
-        else:
-            return False
+        return await self.staff.get_auth_level(user_id) >= auth_level
 
     async def check_auth(self, ctx):
         if not await self._check_auth(ctx.author.id, ctx.command.auth):
@@ -178,6 +265,7 @@ class BotBase(Bot):
             logger.info(s)
 
             await super().invoke(ctx)
+            self.startup.mark_command()
 
     async def on_guild_join(self, guild):
         logger.info(f'Joined guild {guild.name} {guild.id}')
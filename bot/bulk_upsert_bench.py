@@ -0,0 +1,86 @@
+"""
+Bulk upsert benchmark. Run with test_run.py --bench bulk_upsert [rows...]
+
+Inserts userroles style (uid, role) records into a temporary table with
+DatabaseUtils.bulk_upsert and with the paths used before it: INSERT
+statements built from VALUES strings in chunks of 100k rows and a
+prepared INSERT with executemany. Each size is timed once with new rows
+and once with rows that all conflict. Needs postgres. Everything is
+rolled back afterwards.
+"""
+
+import time
+
+from bot.metrics import format_ms
+from bot.pool_manager import BACKGROUND
+
+_TABLE = '_bench_userroles'
+_COLUMNS = ('uid', 'role')
+# Chunk size of the VALUES string path
+_CHUNK_SIZE = 100000
+
+
+def _records(count):
+    # Members have 8 roles on average like in big guilds
+    return [(10**17 + i // 8, 2 * 10**17 + i % 8) for i in range(count)]
+
+
+async def _values_string(dbutil, conn, records):
+    # Same statements as index_guild_member_roles built before bulk_upsert
+    for i in range(0, len(records), _CHUNK_SIZE):
+        s = '(' + '),('.join(f'{u}, {r}' for u, r in records[i:i+_CHUNK_SIZE]) + ')'
+        await conn.execute(f'INSERT INTO {_TABLE} (uid, role) VALUES {s} ON CONFLICT DO NOTHING')
+
+
+async def _executemany(dbutil, conn, records):
+    await conn.executemany(f'INSERT INTO {_TABLE} (uid, role) VALUES ($1, $2) ON CONFLICT DO NOTHING', records)
+
+
+async def _bulk_upsert(dbutil, conn, records):
+    await dbutil.bulk_upsert(_TABLE, _COLUMNS, records, conn=conn)
+
+
+async def _measure(dbutil, conn, method, records):
+    """Returns the time it took to insert new records and to insert them again"""
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await conn.execute(f'CREATE TEMPORARY TABLE {_TABLE} (uid bigint NOT NULL, role bigint NOT NULL, '
+                           f'PRIMARY KEY (uid, role)) ON COMMIT DROP')
+        times = []
+        for _ in range(2):
+            t = time.perf_counter()
+            await method(dbutil, conn, records)
+            times.append(time.perf_counter() - t)
+
+        count = await conn.fetchval(f'SELECT COUNT(*) FROM {_TABLE}')
+        if count != len(records):
+            raise RuntimeError(f'{method.__name__} inserted {count} rows instead of {len(records)}')
+
+        return times
+    finally:
+        await tr.rollback()
+
+
+async def run(dbutil, sizes=(1000, 100000, 1000000)):
+    """
+    Args:
+        dbutil: DatabaseUtils connected to postgres
+        sizes: Amounts of records inserted
+
+    Returns:
+        The report as a string
+    """
+    methods = (('bulk_upsert', _bulk_upsert), ('VALUES string', _values_string),
+               ('executemany', _executemany))
+    lines = [f'{"rows":>8} {"method":<14} {"new rows":>9} {"conflicts":>9} {"rows/s":>9}']
+
+    async with dbutil.acquire(BACKGROUND) as conn:
+        for size in sizes:
+            records = _records(size)
+            for name, method in methods:
+                new, conflicts = await _measure(dbutil, conn, method, records)
+                lines.append(f'{size:>8} {name:<14} {format_ms(new):>9} {format_ms(conflicts):>9} '
+                             f'{size / new:>9.0f}')
+
+    return '\n'.join(lines)
@@ -0,0 +1,174 @@
+"""
+Runs the shards of the main bot in multiple processes.
+
+The supervisor starts one run.py process per cluster with a contiguous
+range of shard ids, prefixes and forwards their output and restarts them
+when they exit. A worker exiting with ExitStatus.PreventRestart stops the
+whole cluster and the supervisor exits with the same code so systemctl
+behaves the same way it does with a single process.
+
+State that is kept in memory is either owned by the guild's shard
+(guild settings, timeouts, temproles, polls, see Bot.owns_guild)
+or synchronized through postgres (botbans).
+"""
+
+import asyncio
+import logging
+import signal
+import sys
+import time
+
+logger = logging.getLogger('terminal')
+
+# Same values as in cogs.botadmin.ExitStatus
+PREVENT_RESTART = 2
+
+
+def shard_ranges(shard_count, clusters):
+    """
+    Split shard ids into contiguous ranges as evenly as possible
+
+    Returns:
+        list of lists of shard ids. One list per cluster
+    """
+    clusters = max(1, min(clusters, shard_count))
+    per_cluster, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for i in range(clusters):
+        n = per_cluster + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + n)))
+        start += n
+
+    return ranges
+
+
+class Worker:
+    def __init__(self, cluster_id, shard_ids, shard_count, script):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.script = script
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+
+    @property
+    def name(self):
+        return f'cluster {self.cluster_id}'
+
+    @property
+    def args(self):
+        return [sys.executable, self.script,
+                '--cluster-id', str(self.cluster_id),
+                '--shard-count', str(self.shard_count),
+                '--shards', ','.join(map(str, self.shard_ids))]
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+
+class Supervisor:
+    # Discord only allows one identify every 5 seconds
+    IDENTIFY_DELAY = 5
+    # Workers that run longer than this before exiting have their backoff reset
+    STABLE_AFTER = 60
+    MAX_BACKOFF = 300
+
+    def __init__(self, script, shard_count, clusters, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.workers = [Worker(i, shards, shard_count, script)
+                        for i, shards in enumerate(shard_ranges(shard_count, clusters))]
+        self._stopping = False
+        # Set by stop. Created in run so it belongs to the running loop
+        self._stop_event = None
+        self.exit_code = 0
+
+    async def _forward_output(self, worker):
+        prefix = f'[{worker.name}] '.encode('utf-8')
+        stream = worker.process.stdout
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+
+            sys.stdout.buffer.write(prefix + line)
+            sys.stdout.flush()
+
+    async def _start(self, worker):
+        logger.info(f'Starting {worker.name} with shards {worker.shard_ids}')
+        worker.process = await asyncio.create_subprocess_exec(*worker.args,
+                                                              stdout=asyncio.subprocess.PIPE,
+                                                              stderr=asyncio.subprocess.STDOUT)
+        worker.started_at = time.monotonic()
+
+    async def _sleep(self, delay):
+        """Sleep for delay seconds or until stop is called"""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _supervise(self, worker, delay):
+        await self._sleep(delay)
+
+        while not self._stopping:
+            try:
+                await self._start(worker)
+            except OSError:
+                logger.exception(f'Failed to start {worker.name}')
+                code = None
+            else:
+                await self._forward_output(worker)
+                code = await worker.process.wait()
+
+            if self._stopping:
+                return
+
+            if code == PREVENT_RESTART:
+                logger.info(f'{worker.name} requested shutdown. Stopping all clusters')
+                self.exit_code = code
+                self.stop()
+                return
+
+            if worker.started_at and time.monotonic() - worker.started_at > self.STABLE_AFTER:
+                worker.restarts = 0
+
+            backoff = min(self.MAX_BACKOFF, self.IDENTIFY_DELAY * len(worker.shard_ids) * 2 ** worker.restarts)
+            worker.restarts += 1
+            logger.warning(f'{worker.name} exited with code {code}. Restarting in {backoff}s')
+            await self._sleep(backoff)
+
+    def stop(self):
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for worker in self.workers:
+            if worker.running:
+                try:
+                    worker.process.terminate()
+                except ProcessLookupError:
+                    pass
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        if self._stopping:
+            self._stop_event.set()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on windows
+                pass
+
+        # Stagger the starts so the workers don't all identify at the same time
+        delay = 0
+        tasks = []
+        for worker in self.workers:
+            tasks.append(self.loop.create_task(self._supervise(worker, delay)))
+            delay += self.IDENTIFY_DELAY * len(worker.shard_ids)
+
+        await asyncio.gather(*tasks)
+        return self.exit_code
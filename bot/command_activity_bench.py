@@ -0,0 +1,145 @@
+"""
+Command activity benchmark. Run with test_run.py --bench command_activity [rows] [users]
+
+Fills temporary tables that shadow command_usage and its daily rollups
+with random command uses over the past year and times the queries of
+the command stats command. DatabaseUtils.get_command_activity, which
+reads the rollups, is compared to counting the raw command_usage rows
+like it did for user stats before command_usage_daily_user existed.
+Needs postgres. The temporary tables are dropped afterwards and the
+real tables aren't touched.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+from bot.dbutil import DatabaseUtils
+from bot.metrics import format_ms
+from bot.pool_manager import BACKGROUND
+
+_TABLES = ('command_usage', 'command_usage_daily', 'command_usage_daily_guild', 'command_usage_daily_user')
+_COMMANDS = 50
+_GUILDS = 10000
+
+
+class _Dbutil:
+    """The parts of DatabaseUtils used by get_command_activity on a single connection"""
+    get_command_activity = DatabaseUtils.get_command_activity
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetch(self, sql, args=None):
+        return await self.conn.fetch(sql, *(args or ()))
+
+
+async def _raw_activity(conn, names, after, user=None, guild=None):
+    # The query user stats used before the per user rollup
+    where = ['used_at > $1']
+    args = [after]
+    if user:
+        where.append(f'uid={int(user)}')
+    if guild:
+        where.append(f'guild={int(guild)}')
+    if names:
+        args.append(list(names))
+        where.append(f'cmd=ANY(${len(args)}::text[])')
+
+    sql = f'SELECT COUNT(cmd) AS count, cmd FROM command_usage WHERE {" AND ".join(where)} ' \
+          f'GROUP BY cmd ORDER BY COUNT(cmd) DESC'
+    return await conn.fetch(sql, *args)
+
+
+async def _create_tables(conn, rows, users):
+    # Temporary tables come first in the search path so the queries use these
+    for table in _TABLES:
+        await conn.execute(f'CREATE TEMPORARY TABLE {table} (LIKE {table} INCLUDING ALL)')
+
+    await conn.execute(f'''
+        INSERT INTO command_usage (cmd, used_at, uid, guild)
+        SELECT 'cmd' || (random() * {_COMMANDS - 1})::int,
+               now() AT TIME ZONE 'utc' - random() * INTERVAL '365 days',
+               (random() * {users - 1})::bigint,
+               CASE WHEN random() < 0.05 THEN NULL ELSE (random() * {_GUILDS - 1})::bigint END
+        FROM generate_series(1, {rows})''')
+
+    # Same queries as the backfill in migrations/001_command_usage_rollups.sql
+    await conn.execute('''
+        INSERT INTO command_usage_daily (day, cmd, uses)
+        SELECT used_at::date, cmd, COUNT(*) FROM command_usage
+        GROUP BY used_at::date, cmd''')
+    await conn.execute('''
+        INSERT INTO command_usage_daily_guild (day, guild, cmd, uses)
+        SELECT used_at::date, guild, cmd, COUNT(*) FROM command_usage
+        WHERE guild IS NOT NULL GROUP BY used_at::date, guild, cmd''')
+    await conn.execute('''
+        INSERT INTO command_usage_daily_user (day, uid, guild, cmd, uses)
+        SELECT used_at::date, uid, COALESCE(guild, 0), cmd, COUNT(*) FROM command_usage
+        WHERE uid IS NOT NULL GROUP BY used_at::date, uid, COALESCE(guild, 0), cmd''')
+
+    for table in _TABLES:
+        await conn.execute(f'ANALYZE {table}')
+
+
+async def _time(func, queries):
+    times = []
+    results = []
+    for query in queries:
+        t = time.perf_counter()
+        results.append(await func(*query))
+        times.append(time.perf_counter() - t)
+
+    times.sort()
+    return times[len(times) // 2], times[-1], results
+
+
+def _as_dict(rows):
+    return {r['cmd']: r['count'] for r in rows}
+
+
+async def run(dbutil, rows=5000000, users=100000, queries=20, seed=0):
+    """
+    Args:
+        dbutil: DatabaseUtils connected to postgres
+        rows: Amount of command uses generated
+        users: Amount of different users using commands
+
+    Returns:
+        The report as a string
+    """
+    rng = random.Random(seed)
+    # Default time range of the command stats command
+    after = datetime.utcnow() - timedelta(days=182)
+    cases = {
+        'user': [(None, user, None) for user in rng.sample(range(users), queries)],
+        'user and command': [([f'cmd{rng.randrange(_COMMANDS)}'], rng.randrange(users), None)
+                             for _ in range(queries)],
+        'guild': [(None, None, rng.randrange(_GUILDS)) for _ in range(queries)],
+    }
+
+    async with dbutil.acquire(BACKGROUND) as conn:
+        try:
+            t = time.perf_counter()
+            await _create_tables(conn, rows, users)
+            lines = [f'{rows} command uses by {users} users generated in {time.perf_counter() - t:.1f}s',
+                     f'{"stats of":<18} {"raw p50":>9} {"raw max":>9} {"rollup p50":>10} {"rollup max":>10}']
+
+            shim = _Dbutil(conn)
+            for name, params in cases.items():
+                raw = [(conn, names, after, user, guild) for names, user, guild in params]
+                rollup = [(names, after, user, guild) for names, user, guild in params]
+                raw_p50, raw_max, raw_results = await _time(_raw_activity, raw)
+                p50, max_, results = await _time(shim.get_command_activity, rollup)
+
+                for old, new in zip(raw_results, results):
+                    if _as_dict(old) != _as_dict(new):
+                        raise RuntimeError(f'Rollup and raw counts differ for stats of {name}')
+
+                lines.append(f'{name:<18} {format_ms(raw_p50):>9} {format_ms(raw_max):>9} '
+                             f'{format_ms(p50):>10} {format_ms(max_):>10}')
+        finally:
+            for table in _TABLES:
+                await conn.execute(f'DROP TABLE IF EXISTS pg_temp.{table}')
+
+    return '\n'.join(lines)
@@ -75,6 +75,13 @@ class Config:
         self.sfx_db_pass = get_config_value(self.config, 'Database', 'SFXPassword', str)
         self.redis_auth = get_config_value(self.config, 'Database', 'RedisAuth', str)
         self.redis_port = get_config_value(self.config, 'Database', 'RedisPort', int)
+        self.messages_retention = get_config_value(self.config, 'Database', 'MessagesRetention', int, 0)
+        self.command_usage_retention = get_config_value(self.config, 'Database', 'CommandUsageRetention', int, 0)
+        self.drop_expired_partitions = get_config_value(self.config, 'Database', 'DropExpiredPartitions', bool, True)
+        self.slow_query_threshold = get_config_value(self.config, 'Database', 'SlowQueryThreshold', int, 500)
+        self.background_connections = get_config_value(self.config, 'Database', 'BackgroundConnections', int, 6)
+        self.db_backend = get_config_value(self.config, 'Database', 'Backend', str, 'postgres').lower()
+        self.persist_last_images = get_config_value(self.config, 'Database', 'PersistLastImages', bool, True)
 
 
         try:
@@ -151,6 +158,16 @@ class Config:
             terminal.exception("DeleteMessages value is not boolean. DeleteMessages set to off")
             self.delete_messages = False
 
+        try:
+            self.listener_stats = self.config.getboolean('BotOptions', 'ListenerStats', fallback=False)
+        except ValueError:
+            terminal.exception("ListenerStats value is not boolean. ListenerStats set to off")
+            self.listener_stats = False
+
+        self.shard_count = get_config_value(self.config, 'BotOptions', 'ShardCount', int, 2)
+        self.clusters = get_config_value(self.config, 'BotOptions', 'Clusters', int, 1)
+        self.guild_cache_size = get_config_value(self.config, 'BotOptions', 'GuildCacheSize', int, 0)
+
         try:
             self.max_combo = self.config.getint('SFXSettings', 'MaxCombo', fallback=8)
         except ValueError:
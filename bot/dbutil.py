@@ -1,40 +1,65 @@
 import logging
 import time
-import types
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import discord
 from asyncpg.exceptions import PostgresError
 from discord.errors import InvalidArgument
 
-from bot.globals import BlacklistTypes
-from utils.utilities import check_perms
+from bot.botbans import BotBans
+from bot.metrics import QueryStats
+from bot.pool_manager import INTERACTIVE, BACKGROUND
+from bot.ttl_cache import TTLCache
+from bot.globals import PermValues
 
 logger = logging.getLogger('terminal')
 
-
-def _args_to_string(args):
-    """
-    DO NOT USE WITH STRINGS
-    ARGS ARE NOT ESCAPED
-
-    Will turn args to a string. Should be only used on non string args only
-    Args:
-        args: List or generator of arguments
-
-    Returns:
-        String of args in format (1,2),(3,4),(5,6),...
-    """
-    if isinstance(args, types.GeneratorType) or isinstance(args[0], list) or isinstance(args[0], tuple):
-        return ','.join(f"({','.join(map(str, arg))})" for arg in args)
-    else:
-        return ','.join(f"({arg})" for arg in args)
+# Named statements for queries run on hot paths. Values are always passed
+# as parameters so the sql of a statement never changes. That way asyncpg
+# prepares each statement only once per connection and reuses it from its
+# statement cache instead of postgres planning a new query on every call.
+# Run them with DatabaseUtils.fetch_statement and execute_statement
+STATEMENTS = {
+    'last_attachment': 'SELECT attachment FROM attachments WHERE channel=$1',
+    'user_guild_roles': 'SELECT roles.id FROM userroles INNER JOIN roles ON roles.id=userroles.role '
+                        'WHERE roles.guild=$1 AND userroles.uid=$2',
+    'remove_user_roles': 'DELETE FROM userroles WHERE uid=$1 AND role=ANY($2::bigint[])',
+    'delete_user_guild_roles': 'DELETE FROM userroles USING roles WHERE roles.id=userroles.role '
+                               'AND roles.guild=$1 AND userroles.uid=$2',
+    'delete_poll': 'DELETE FROM polls WHERE message=$1',
+    'check_role_grant': 'SELECT role FROM role_granting WHERE guild=$1 AND role=$2 '
+                        'AND (uid=$3 OR user_role=ANY($4::bigint[])) LIMIT 1',
+    'user_role_grants': 'SELECT role FROM role_granting WHERE guild=$1 AND (uid=$2 OR user_role=ANY($3::bigint[]))',
+    'is_guild_blacklisted': 'SELECT 1 FROM guild_blacklist WHERE guild=$1',
+    'add_guild': 'INSERT INTO guilds (guild) VALUES ($1) ON CONFLICT (guild) DO NOTHING',
+    'add_guild_prefix': 'INSERT INTO prefixes (guild) VALUES ($1) ON CONFLICT DO NOTHING',
+    'guild_settings': 'SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes '
+                      'ON guilds.guild=prefixes.guild WHERE guilds.guild=$1',
+    'guilds_settings': 'SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes '
+                       'ON guilds.guild=prefixes.guild WHERE guilds.guild=ANY($1::bigint[])',
+    'user_messages_after': 'SELECT message_id, channel FROM messages WHERE guild=$1 AND user_id=$2 '
+                           'AND message_id > $3 ORDER BY message_id DESC LIMIT $4',
+    'delete_messages': 'DELETE FROM messages WHERE message_id=ANY($1::bigint[])',
+}
 
 
 class DatabaseUtils:
     def __init__(self, bot):
         self._bot = bot
 
+        # Read-through caches of small values that are read often but rarely change.
+        # Setters in this class invalidate the keys they change
+        self.timezones = TTLCache('timezones', ttl=3600)  # user_id
+        self.join_dates = TTLCache('join_dates', maxsize=20000, ttl=3600)  # (uid, guild_id)
+        self.last_banners = TTLCache('last_banners', maxsize=500, ttl=3600)  # guild_id
+        self.role_times = TTLCache('role_times', ttl=600)  # user
+        self.event_points = TTLCache('event_points', ttl=300)  # user_id
+        self.guild_blacklist = TTLCache('guild_blacklist', ttl=600)  # guild_id
+        self.temproles = TTLCache('temproles', ttl=600)  # (guild, user)
+        # Newest image url of a channel. Set by the Logger cog from messages and
+        # read by image commands. Urls are ~200 bytes so 50k channels take ~15MB
+        self.last_images = TTLCache('last_images', maxsize=50000, ttl=86400)  # channel_id
+
     @property
     def bot(self):
         return self._bot
@@ -53,30 +78,96 @@ class DatabaseUtils:
 
         return s.rstrip(',')
 
-    async def fetchval(self, sql, args=None):
+    @property
+    def caches(self):
+        return (self.timezones, self.join_dates, self.last_banners, self.role_times,
+                self.event_points, self.guild_blacklist, self.temproles, self.last_images)
+
+    @property
+    def stats(self) -> QueryStats:
+        return self.bot.query_stats
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        Acquire a connection from the pool. Same as pool.acquire but
+        records the time spent waiting for and holding the connection
+
+        Args:
+            priority: Lane of the pool manager the connection is taken from.
+                Long running or periodic work should use BACKGROUND so
+                it can't starve commands of connections
+        """
+        return self.bot.pool_manager.acquire(priority)
+
+    @staticmethod
+    def _status_rows(status):
+        """Amount of rows affected from a command status like INSERT 0 5"""
+        try:
+            return int(status.rsplit(' ', 1)[-1])
+        except (AttributeError, ValueError):
+            return None
+
+    async def fetch_statement(self, name, *args, fetchmany=True, timeout=None, priority=INTERACTIVE):
+        """
+        Run a named statement from STATEMENTS and return its rows
+
+        Args:
+            name: Name of the statement
+            *args: Values of the statement parameters
+            fetchmany: If False only the first row or None is returned
+            timeout: Optional timeout for the query
+            priority: Lane of the pool the query is run in
+        """
+        sql = STATEMENTS[name]
+        async with self.acquire(priority) as conn:
+            with self.stats.measure(sql) as m:
+                if fetchmany:
+                    rows = await conn.fetch(sql, *args, timeout=timeout)
+                    m.rows = len(rows)
+                else:
+                    rows = await conn.fetchrow(sql, *args, timeout=timeout)
+                    m.rows = int(rows is not None)
+
+        return rows
+
+    async def execute_statement(self, name, *args, timeout=None, priority=INTERACTIVE):
+        """Run a named statement from STATEMENTS and return its status"""
+        sql = STATEMENTS[name]
+        async with self.acquire(priority) as conn:
+            with self.stats.measure(sql) as m:
+                status = await conn.execute(sql, *args, timeout=timeout)
+                m.rows = self._status_rows(status)
+
+        return status
+
+    async def fetchval(self, sql, args=None, priority=INTERACTIVE):
         args = args or ()
 
-        async with self.bot.pool.acquire() as conn:
+        async with self.acquire(priority) as conn:
             async with conn.transaction():
-                return await conn.fetchval(sql, *args)
+                with self.stats.measure(sql):
+                    return await conn.fetchval(sql, *args)
 
-    async def fetch(self, sql, args=None, timeout=None, measure_time=False, fetchmany=True):
+    async def fetch(self, sql, args=None, timeout=None, measure_time=False, fetchmany=True,
+                    priority=INTERACTIVE):
         args = args or ()
 
-        async with self.bot.pool.acquire() as conn:
-            t = time.perf_counter()
-
-            if fetchmany:
-                row = await conn.fetch(sql, *args, timeout=timeout)
-            else:
-                row = await conn.fetchrow(sql, *args, timeout=timeout)
+        async with self.acquire(priority) as conn:
+            with self.stats.measure(sql) as m:
+                if fetchmany:
+                    row = await conn.fetch(sql, *args, timeout=timeout)
+                    m.rows = len(row)
+                else:
+                    row = await conn.fetchrow(sql, *args, timeout=timeout)
+                    m.rows = int(row is not None)
 
             if measure_time:
-                return row, time.perf_counter() - t
+                return row, m.elapsed
 
             return row
 
-    async def insertmany(self, table, *, records=None, columns=None, measure_time=False, timeout=None):
+    async def insertmany(self, table, *, records=None, columns=None, measure_time=False, timeout=None,
+                         priority=INTERACTIVE):
         """
         Insert many records to a table. Will fail on conflicting unique keys for example because
         ON CONFLICT isn't supported
@@ -87,26 +178,103 @@ class DatabaseUtils:
             columns: Optional list of columns to update. If not given will update all columns
             measure_time: If we should measure query time
             timeout: Optional timeout for the query
+            priority: Lane of the pool the query is run in
 
         Returns:
             Status from Connection.copy_records_to_table
         """
-        async with self.bot.pool.acquire() as conn:
+        async with self.acquire(priority) as conn:
             async with conn.transaction():
                 try:
-                    t = time.perf_counter()
-                    row = await conn.copy_records_to_table(table, records=records, columns=columns, timeout=timeout)
+                    with self.stats.measure(f'COPY {table}') as m:
+                        row = await conn.copy_records_to_table(table, records=records, columns=columns, timeout=timeout)
+                        m.rows = self._status_rows(row)
 
                     if measure_time:
-                        return row, time.perf_counter() - t
+                        return row, m.elapsed
 
                 except PostgresError as e:
                     raise e
 
         return row
 
+    # Below this many records a prepared statement is used instead of COPY
+    BULK_COPY_THRESHOLD = 200
+
+    async def bulk_upsert(self, table, columns, records, conflict=None, update=None,
+                          conn=None, timeout=None, priority=INTERACTIVE):
+        """
+        Insert records into a table resolving conflicts with ON CONFLICT.
+        Large amounts of records are streamed with COPY into a temporary table
+        and merged with a single INSERT. Smaller amounts use a prepared
+        INSERT with executemany.
+
+        Args:
+            table: Name of the table
+            columns: Names of the columns in the records
+            records: Iterable of record tuples
+            conflict: Columns of the conflict target. Required if update is given
+            update: Columns that are updated from the new row on conflict.
+                If not given conflicting rows are ignored
+            conn: Connection to use. When given the caller handles the transaction
+            timeout: Optional timeout for the queries
+            priority: Lane of the pool used when conn isn't given.
+                Reindexing and periodic flushes should pass BACKGROUND
+
+        Returns:
+            Amount of records given
+        """
+        records = list(records)
+        if not records:
+            return 0
+
+        if update and not conflict:
+            raise ValueError('Conflict target is required when updating')
+
+        cols = ', '.join(columns)
+        if update:
+            on_conflict = 'ON CONFLICT (%s) DO UPDATE SET %s' % (', '.join(conflict),
+                                                                 ', '.join(f'{c}=EXCLUDED.{c}' for c in update))
+        elif conflict:
+            on_conflict = 'ON CONFLICT (%s) DO NOTHING' % ', '.join(conflict)
+        else:
+            on_conflict = 'ON CONFLICT DO NOTHING'
+
+        async def upsert(conn):
+            if len(records) < self.BULK_COPY_THRESHOLD:
+                binds = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+                sql = f'INSERT INTO {table} ({cols}) VALUES ({binds}) {on_conflict}'
+                with self.stats.measure(sql) as m:
+                    await conn.executemany(sql, records, timeout=timeout)
+                    m.rows = len(records)
+                return
+
+            tmp = f'_bulk_{table}'
+            # Creates a table with the same column types but no constraints.
+            # Must be run inside a transaction. A failed transaction will get rid of the table
+            await conn.execute(f'CREATE TEMPORARY TABLE {tmp} ON COMMIT DROP AS '
+                               f'SELECT {cols} FROM {table} WITH NO DATA')
+            with self.stats.measure(f'COPY {tmp}') as m:
+                await conn.copy_records_to_table(tmp, records=records, columns=columns, timeout=timeout)
+                m.rows = len(records)
+
+            sql = f'INSERT INTO {table} ({cols}) SELECT {cols} FROM {tmp} {on_conflict}'
+            with self.stats.measure(sql) as m:
+                m.rows = self._status_rows(await conn.execute(sql, timeout=timeout))
+            # Dropped right away so the function can be called again in the same transaction
+            await conn.execute(f'DROP TABLE {tmp}')
+
+        if conn is not None:
+            await upsert(conn)
+        else:
+            async with self.acquire(priority) as conn:
+                async with conn.transaction():
+                    await upsert(conn)
+
+        return len(records)
+
     async def execute_chunked(self, sql_statements, args=None, insertmany=False,
-                              measure_time=False, timeout=None):
+                              measure_time=False, timeout=None, priority=INTERACTIVE):
         """
 
         Args:
@@ -121,17 +289,19 @@ class DatabaseUtils:
         """
         args = args or [() for _ in sql_statements]
 
-        async with self.bot.pool.acquire() as conn:
+        async with self.acquire(priority) as conn:
             async with conn.transaction():
                 try:
                     t = time.perf_counter()
                     rows = []
 
                     for idx, sql in enumerate(sql_statements):
-                        if insertmany:
-                            row = await conn.executemany(sql, args[idx], timeout=timeout)
-                        else:
-                            row = await conn.execute(sql, *args[idx], timeout=timeout)
+                        with self.stats.measure(sql) as m:
+                            if insertmany:
+                                row = await conn.executemany(sql, args[idx], timeout=timeout)
+                            else:
+                                row = await conn.execute(sql, *args[idx], timeout=timeout)
+                                m.rows = self._status_rows(row)
 
                         rows.append(rows)
 
@@ -144,12 +314,13 @@ class DatabaseUtils:
         return row
 
     async def execute(self, sql, args=None, measure_time=False,
-                      insertmany=False, timeout=None):
+                      insertmany=False, timeout=None, priority=INTERACTIVE):
         """
         Args:
             sql: sql query
             *args: args passed to execute
             measure_time: Return time it took to run query as well as ResultProxy
+            priority: Lane of the pool the query is run in
             **params: params passed to execute
 
         Returns:
@@ -158,17 +329,18 @@ class DatabaseUtils:
 
         args = args or ()
 
-        async with self.bot.pool.acquire() as conn:
+        async with self.acquire(priority) as conn:
             async with conn.transaction():
                 try:
-                    t = time.perf_counter()
-                    if insertmany:
-                        row = await conn.executemany(sql, args, timeout=timeout)
-                    else:
-                        row = await conn.execute(sql, *args, timeout=timeout)
+                    with self.stats.measure(sql) as m:
+                        if insertmany:
+                            row = await conn.executemany(sql, args, timeout=timeout)
+                        else:
+                            row = await conn.execute(sql, *args, timeout=timeout)
+                            m.rows = self._status_rows(row)
 
                     if measure_time:
-                        return row, time.perf_counter() - t
+                        return row, m.elapsed
 
                 except PostgresError as e:
                     raise e
@@ -179,14 +351,6 @@ class DatabaseUtils:
         t = time.time()
         default_role = guild.default_role.id
 
-        async def execute(sql_, args=None, insertmany=False):
-            try:
-                await self.execute(sql_, args, insertmany=insertmany)
-            except PostgresError:
-                logger.exception('Failed to execute sql')
-                return False
-            return True
-
         success = await self.index_guild_roles(guild)
         if not success:
             return success
@@ -201,36 +365,26 @@ class DatabaseUtils:
             pass
         _m = list(guild.members)
         members = list(filter(lambda u: len(u.roles) > 1, _m))
-        all_members = [str(u.id) for u in _m]
-
-        t1 = time.time()
-        sql = 'DELETE FROM userroles ur USING roles r WHERE r.id=ur.role AND r.guild={} AND ur.uid IN ({})'.format(guild.id, ', '.join(all_members))
-
-        # Deletes all server records
-        # sql = 'DELETE userRoles FROM userRoles INNER JOIN roles WHERE roles.server=%s AND userRoles.role_id=roles.id'
-        if not await execute(sql):
-            return False
-        logger.info(f'Deleted old records in {time.time() - t1}')
-        t1 = time.time()
+        all_members = [u.id for u in _m]
 
         args = []
         for u in members:
             uid = u.id
             args.extend([(uid, r.id) for r in u.roles if r.id != default_role])
 
-        sql_statements = []
-        # 100k default chunk size
-        chunk_size = 100000
-        for i in range(0, len(args), chunk_size):
-            # This piece of spaghetti code basically creates the
-            # VALUES (1,2), (3,4), (5,6)...
-            # part because asyncpg doesn't support any meaningful way to do it
-            s = '(' + '),('.join(', '.join((str(u), str(r))) for u, r in args[i:i+chunk_size]) + ')'
-            sql_statements.append('INSERT INTO userroles (uid, role) VALUES %s ON CONFLICT DO NOTHING' % s)
-
+        t1 = time.time()
         try:
-            await self.execute_chunked(sql_statements)
+            async with self.acquire(BACKGROUND) as conn:
+                async with conn.transaction():
+                    # Deletes all server records
+                    sql = 'DELETE FROM userroles ur USING roles r WHERE r.id=ur.role AND r.guild=$1 AND ur.uid=ANY($2::bigint[])'
+                    await conn.execute(sql, guild.id, all_members)
+                    logger.info(f'Deleted old records in {time.time() - t1}')
+                    t1 = time.time()
+
+                    await self.bulk_upsert('userroles', ('uid', 'role'), args, conn=conn)
         except PostgresError:
+            logger.exception('Failed to index user roles')
             return False
 
         logger.info(f'added user roles in {time.time() - t1}')
@@ -238,24 +392,23 @@ class DatabaseUtils:
         return True
 
     async def index_guild_roles(self, guild):
-        guild_id = guild.id
-
-        def tuples():
-            for r in guild.roles:
-                yield r.id, guild_id
-
-        roles = _args_to_string(tuples())
-        role_ids = [str(r.id) for r in guild.roles]
+        return await self.index_guilds_roles([guild])
 
-        # We won't be using insertmany on this so we can use ON CONFLICT
-        # Instead we prepare the args as a string beforehand. This works because
-        # they're all just integers
-        sql = 'INSERT INTO roles (id, guild) VALUES %s ON CONFLICT DO NOTHING' % roles
+    async def index_guilds_roles(self, guilds):
+        """
+        Add the roles of the given guilds to the database and delete
+        roles that no longer exist in them
+        """
+        records = [(r.id, g.id) for g in guilds for r in g.roles]
+        guild_ids = [g.id for g in guilds]
+        role_ids = [r[0] for r in records]
 
         try:
-            await self.execute(sql)
-            sql = 'DELETE FROM roles WHERE guild={} AND NOT id IN ({})'.format(guild.id, ', '.join(role_ids))
-            await self.execute(sql)
+            async with self.acquire(BACKGROUND) as conn:
+                async with conn.transaction():
+                    await self.bulk_upsert('roles', ('id', 'guild'), records, conn=conn)
+                    sql = 'DELETE FROM roles WHERE guild=ANY($1::bigint[]) AND NOT id=ANY($2::bigint[])'
+                    await conn.execute(sql, guild_ids, role_ids)
         except PostgresError:
             logger.exception('Failed to index guild roles')
             return False
@@ -265,27 +418,20 @@ class DatabaseUtils:
         if not ids:
             return
 
-        ids = _args_to_string(ids)
-        sql = 'INSERT INTO guilds (guild) VALUES %s ON CONFLICT DO NOTHING' % ids
+        records = [(guild_id,) for guild_id in ids]
         try:
-            await self.execute(sql)
-            sql = 'INSERT INTO prefixes (guild) VALUES %s ON CONFLICT DO NOTHING' % ids
-            await self.execute(sql)
+            async with self.acquire(BACKGROUND) as conn:
+                async with conn.transaction():
+                    await self.bulk_upsert('guilds', ('guild',), records, conn=conn)
+                    await self.bulk_upsert('prefixes', ('guild',), records, conn=conn)
         except PostgresError:
             logger.exception('Failed to add new servers to db')
             return False
         return True
 
     async def add_roles(self, guild_id, *role_ids):
-        def it():
-            for r in role_ids:
-                yield r, guild_id
-
-        ids = _args_to_string(it())
-        sql = 'INSERT INTO roles (id, guild) VALUES %s ON CONFLICT DO NOTHING' % ids
-
         try:
-            await self.execute(sql)
+            await self.bulk_upsert('roles', ('id', 'guild'), ((r, guild_id) for r in role_ids))
         except PostgresError:
             logger.exception('Failed to add roles')
             return False
@@ -303,11 +449,8 @@ class DatabaseUtils:
         return True
 
     async def add_users(self, *user_ids):
-        ids = _args_to_string(user_ids)
-        sql = 'INSERT INTO users (id) VALUES %s ON CONFLICT DO NOTHING' % ids
-
         try:
-            await self.execute(sql)
+            await self.bulk_upsert('users', ('id',), ((uid,) for uid in user_ids))
         except PostgresError:
             logger.exception('Failed to add users')
             return False
@@ -318,15 +461,8 @@ class DatabaseUtils:
         if not await self.add_roles(guild_id, *role_ids):
             return
 
-        def it():
-            for r in role_ids:
-                yield user_id, r
-
-        ids = _args_to_string(it())
-        sql = 'INSERT INTO userroles (uid, role) VALUES %s ON CONFLICT DO NOTHING' % ids
-
         try:
-            await self.execute(sql)
+            await self.bulk_upsert('userroles', ('uid', 'role'), ((user_id, r) for r in role_ids))
         except PostgresError:
             logger.exception('Failed to add roles foreign keys')
             return False
@@ -334,9 +470,8 @@ class DatabaseUtils:
         return True
 
     async def remove_user_roles(self, role_ids, user_id: int):
-        sql = 'DELETE FROM userroles WHERE uid=%s and role IN (%s)' % (user_id, ', '.join(map(str, role_ids)))
         try:
-            await self.execute(sql)
+            await self.execute_statement('remove_user_roles', user_id, list(role_ids))
             return True
         except PostgresError:
             logger.exception('Failed to delete roles')
@@ -371,8 +506,7 @@ class DatabaseUtils:
 
     async def delete_user_roles(self, guild_id: int, user_id: int):
         try:
-            sql = f'DELETE FROM userroles USING roles WHERE roles.id=userroles.role AND roles.guild={guild_id} AND userroles.uid={user_id}'
-            await self.execute(sql)
+            await self.execute_statement('delete_user_guild_roles', guild_id, user_id)
         except PostgresError:
             logger.exception('Could not delete user roles')
 
@@ -432,24 +566,11 @@ class DatabaseUtils:
         return success
 
     async def multiple_last_seen(self, user_ids, usernames, guild_id, timestamps):
-
-        sql_statements = []
-        args = []
-        step = 500
-
-        for i in range(0, len(user_ids), step):
-            data = []
-            for uid, u, g, t in zip(user_ids[i:i+step], usernames[i:i+step], guild_id[i:i+step], timestamps[i:i+step]):
-                data.extend((uid, u, g, t))
-
-            sql = 'INSERT INTO last_seen_users (uid, username, guild, last_seen) VALUES %s ' \
-                  'ON CONFLICT (uid, guild) DO UPDATE SET last_seen=EXCLUDED.last_seen, username=EXCLUDED.username' % self.create_bind_groups(len(data)//4, 4)
-
-            sql_statements.append(sql)
-            args.append(data)
-
         try:
-            await self.execute_chunked(sql_statements, args)
+            await self.bulk_upsert('last_seen_users', ('uid', 'username', 'guild', 'last_seen'),
+                                   zip(user_ids, usernames, guild_id, timestamps),
+                                   conflict=('uid', 'guild'), update=('last_seen', 'username'),
+                                   priority=BACKGROUND)
         except PostgresError:
             logger.exception('Failed to set last seen')
             return False
@@ -493,34 +614,92 @@ class DatabaseUtils:
 
         await self.insertmany('command_usage',
                               records=values,
-                              columns=('cmd', 'used_at', 'uid', 'guild'))
+                              columns=('cmd', 'used_at', 'uid', 'guild'),
+                              priority=BACKGROUND)
 
     async def command_used(self, parent, name, used_at, user_id=None, guild=None):
-        if name is None:
-            name = ""
-
-        async with self.bot.pool.acquire() as conn:
-            async with conn.transaction():
-                sql = 'UPDATE command_stats SET uses=(uses+1) WHERE parent=$1 AND cmd=$2'
-                try:
-                    await conn.execute(sql, *(parent, name))
-                except PostgresError:
-                    logger.exception('Failed to update command {} {} usage'.format(parent, name))
-                    return False
-
-                sql = 'INSERT INTO command_usage (cmd, used_at, uid, guild) ' \
-                      'VALUES ($1, $2, $3, $4)'
-                cmd = parent
-                if name:
-                    cmd += ' ' + name
-                try:
-                    await conn.execute(sql, *(cmd, used_at, user_id, guild))
-                except PostgresError:
-                    logger.exception(f'Failed to update command use {cmd} {used_at}')
-                    return False
+        try:
+            await self.record_command_uses([(parent, name, used_at, user_id, guild)])
+        except PostgresError:
+            logger.exception(f'Failed to update command use {parent} {name} {used_at}')
+            return False
 
         return True
 
+    async def record_command_uses(self, uses, conn=None):
+        """
+        Record multiple command uses at once. Updates command_stats,
+        command_usage and the daily rollup tables of command_usage.
+
+        Args:
+            uses: List of tuples (parent, name, used_at, user_id, guild)
+            conn: Connection to use. When given the caller handles the transaction
+        """
+        if not uses:
+            return
+
+        stats = {}
+        daily = {}
+        daily_guild = {}
+        daily_user = {}
+        usage = []
+        for parent, name, used_at, user_id, guild in uses:
+            name = name or ""
+            key = (parent, name)
+            stats[key] = stats.get(key, 0) + 1
+
+            cmd = parent
+            if name:
+                cmd += ' ' + name
+            usage.append((cmd, used_at, user_id, guild))
+
+            day = used_at.date()
+            key = (day, cmd)
+            daily[key] = daily.get(key, 0) + 1
+            if guild:
+                key = (day, guild, cmd)
+                daily_guild[key] = daily_guild.get(key, 0) + 1
+            if user_id:
+                # Uses outside of guilds are stored with guild 0
+                key = (day, user_id, guild or 0, cmd)
+                daily_user[key] = daily_user.get(key, 0) + 1
+
+        async def executemany(conn, sql, records):
+            with self.stats.measure(sql) as m:
+                await conn.executemany(sql, records)
+                m.rows = len(records)
+
+        async def record(conn):
+            sql = 'UPDATE command_stats SET uses=(uses+$3) WHERE parent=$1 AND cmd=$2'
+            await executemany(conn, sql, [(*k, v) for k, v in stats.items()])
+
+            with self.stats.measure('COPY command_usage') as m:
+                await conn.copy_records_to_table('command_usage', records=usage,
+                                                 columns=('cmd', 'used_at', 'uid', 'guild'))
+                m.rows = len(usage)
+
+            sql = 'INSERT INTO command_usage_daily AS c (day, cmd, uses) VALUES ($1, $2, $3) ' \
+                  'ON CONFLICT (cmd, day) DO UPDATE SET uses=c.uses+EXCLUDED.uses'
+            await executemany(conn, sql, [(*k, v) for k, v in daily.items()])
+
+            if daily_guild:
+                sql = 'INSERT INTO command_usage_daily_guild AS c (day, guild, cmd, uses) VALUES ($1, $2, $3, $4) ' \
+                      'ON CONFLICT (guild, day, cmd) DO UPDATE SET uses=c.uses+EXCLUDED.uses'
+                await executemany(conn, sql, [(*k, v) for k, v in daily_guild.items()])
+
+            if daily_user:
+                sql = 'INSERT INTO command_usage_daily_user AS c (day, uid, guild, cmd, uses) VALUES ($1, $2, $3, $4, $5) ' \
+                      'ON CONFLICT (uid, day, guild, cmd) DO UPDATE SET uses=c.uses+EXCLUDED.uses'
+                await executemany(conn, sql, [(*k, v) for k, v in daily_user.items()])
+
+        if conn is not None:
+            await record(conn)
+            return
+
+        async with self.acquire(BACKGROUND) as conn:
+            async with conn.transaction():
+                await record(conn)
+
     async def get_command_stats(self, parent=None, name=""):
         sql = 'SELECT * FROM command_stats'
         args = ()
@@ -537,42 +716,45 @@ class DatabaseUtils:
             return False
 
     async def get_command_activity(self, names, after, user=None, guild=None, limit: int=None):
-
-        where = []
-        # Optimizations for single command cases
-        if len(names) == 1:
-            where.append('cmd=$1')
-            select = 'COUNT(*), $1 as cmd'
-
-        # Selection when no names specified
-        elif not names:
-            select = 'COUNT(cmd), cmd'
-
-        else:
-            where.append('cmd IN ' + self.create_bind_groups(1, len(names)))
-            select = 'COUNT(cmd), cmd '
-
-        sql = f'SELECT {select} FROM command_usage WHERE '
-
+        # Whole days are read from the daily rollups and the rest of the first
+        # day from command_usage so the results are the same as counting raw rows
+        args = [after, after.date()]
         if user:
-            where.append(f'uid={int(user)}')
+            table = 'command_usage_daily_user'
+            args.append(int(user))
+            rollup_where = ['uid=$3']
+            raw_where = ['uid=$3']
+        elif guild:
+            table = 'command_usage_daily_guild'
+            rollup_where = []
+            raw_where = []
+        else:
+            table = 'command_usage_daily'
+            rollup_where = []
+            raw_where = []
 
         if guild:
-            where.append(f'guild={int(guild)}')
+            args.append(int(guild))
+            rollup_where.append(f'guild=${len(args)}')
+            raw_where.append(f'guild=${len(args)}')
 
-        idx = len(names) + 1
-        where.append(f'used_at > ${idx}')
+        if names:
+            args.append(list(names))
+            rollup_where.append(f'cmd=ANY(${len(args)}::text[])')
+            raw_where.append(f'cmd=ANY(${len(args)}::text[])')
 
-        sql += ' AND '.join(where)
+        rollup = f'SELECT cmd, uses FROM {table} WHERE ' + ' AND '.join(['day > $2', *rollup_where])
+        raw = 'SELECT cmd, 1 FROM command_usage WHERE ' + \
+              ' AND '.join(["used_at > $1 AND used_at < $2 + INTERVAL '1 day'", *raw_where])
 
-        if len(names) != 1:
-            sql += ' GROUP BY cmd ORDER BY COUNT(cmd) DESC'
+        sql = f'SELECT SUM(uses) AS count, cmd FROM ({rollup} UNION ALL {raw}) AS u ' \
+              f'GROUP BY cmd ORDER BY count DESC'
 
         if limit:
             sql += f' LIMIT {int(limit)}'
 
         try:
-            return await self.fetch(sql, (*names, after))
+            return await self.fetch(sql, args)
         except PostgresError:
             logger.exception('Failed to get command stats')
             return False
@@ -622,25 +804,45 @@ class DatabaseUtils:
         return rows
 
     async def botban(self, user_id: int, reason):
-        sql = 'INSERT INTO banned_users (uid, reason) VALUES ($1, $2)'
-        await self.execute(sql, (user_id, reason))
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                sql = 'INSERT INTO banned_users (uid, reason) VALUES ($1, $2)'
+                await conn.execute(sql, user_id, reason)
+                # Notify other processes of the change
+                await conn.execute('SELECT pg_notify($1, $2)', BotBans.CHANNEL, f'ban:{user_id}')
+
+        # Bots without a local ban cache only get the notification
+        botbans = getattr(self.bot, 'botbans', None)
+        if botbans is not None:
+            botbans.add(user_id)
 
     async def botunban(self, user_id: int):
-        sql = 'DELETE FROM banned_users WHERE uid=%s' % user_id
-        await self.execute(sql)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                sql = 'DELETE FROM banned_users WHERE uid=$1'
+                await conn.execute(sql, user_id)
+                await conn.execute('SELECT pg_notify($1, $2)', BotBans.CHANNEL, f'unban:{user_id}')
+
+        botbans = getattr(self.bot, 'botbans', None)
+        if botbans is not None:
+            botbans.remove(user_id)
 
     async def blacklist_guild(self, guild_id: int, reason):
         sql = 'INSERT INTO guild_blacklist (guild, reason) VALUES ($1, $2)'
         await self.execute(sql, (guild_id, reason))
+        self.guild_blacklist.invalidate(guild_id)
 
     async def unblacklist_guild(self, guild_id: int):
-        sql = 'DELETE FROM guild_blacklist WHERE guild=%s' % guild_id
-        await self.execute(sql)
+        sql = 'DELETE FROM guild_blacklist WHERE guild=$1'
+        await self.execute(sql, (guild_id,))
+        self.guild_blacklist.invalidate(guild_id)
 
     async def is_guild_blacklisted(self, guild_id: int):
-        sql = 'SELECT 1 FROM guild_blacklist WHERE guild=%s' % guild_id
-        r = await self.fetch(sql, fetchmany=False)
-        return r is not None and r[0] == 1
+        async def load():
+            r = await self.fetch_statement('is_guild_blacklisted', guild_id, fetchmany=False)
+            return r is not None and r[0] == 1
+
+        return await self.guild_blacklist.get(guild_id, load)
 
     async def get_blacklisted_guilds(self):
         sql = 'SELECT guild FROM guild_blacklist'
@@ -654,7 +856,7 @@ class DatabaseUtils:
         sql = 'INSERT INTO activity_log (uid, game, time) VALUES ($1, $2, $3) ON CONFLICT (uid) DO UPDATE SET time=EXCLUDED.time'
 
         try:
-            await self.execute(sql, data)
+            await self.execute(sql, data, priority=BACKGROUND)
         except PostgresError:
             logger.exception('Failed to log activities')
             return False
@@ -731,6 +933,8 @@ class DatabaseUtils:
             await self.execute(sql, (user, role, guild, expires_at))
         except PostgresError:
             logger.exception('Failed to add temprole')
+        finally:
+            self.temproles.invalidate((guild, user))
 
     async def remove_temprole(self, user: int, role: int):
         sql = 'DELETE FROM temproles WHERE uid=$1 AND role=$2'
@@ -739,11 +943,18 @@ class DatabaseUtils:
             await self.execute(sql, (user, role))
         except PostgresError:
             logger.exception('Failed to remove temprole')
+        finally:
+            # The guild isn't known here so all guilds of the user are invalidated
+            self.temproles.invalidate_where(lambda k: k[1] == user)
 
     async def get_temproles(self, guild: int, user: int):
         sql = 'SELECT * FROM temproles WHERE guild=$1 AND uid=$2'
 
-        return await self.fetch(sql, (guild, user))
+        # Cached as a tuple so callers can't modify the cached value
+        async def load():
+            return tuple(await self.fetch(sql, (guild, user)))
+
+        return await self.temproles.get((guild, user), load)
 
     async def add_changes(self, changes):
         sql = 'INSERT INTO changelog (changes) VALUES ($1) RETURNING id'
@@ -751,31 +962,46 @@ class DatabaseUtils:
         return rowid
 
     async def index_join_dates(self, guild):
-        sql = "INSERT INTO join_dates (uid, guild, first_join) VALUES %s ON CONFLICT DO NOTHING"
-        chunk_size = 10000
-        values = []
-        sqls = []
-        members = guild.members.copy()
+        await self.index_guilds_join_dates([guild])
 
-        for i in range(0, len(members), chunk_size):
-            data = []
-            for m in members[i:i+chunk_size]:
-                data.extend((m.id, guild.id, m.joined_at))
+    async def index_guilds_join_dates(self, guilds):
+        records = ((m.id, g.id, m.joined_at) for g in guilds for m in g.members)
+        await self.bulk_upsert('join_dates', ('uid', 'guild', 'first_join'), records, priority=BACKGROUND)
+        guild_ids = {g.id for g in guilds}
+        self.join_dates.invalidate_where(lambda k: k[1] in guild_ids)
 
-            values.append(data)
-            sqls.append(sql % self.create_bind_groups(len(data)//3, 3))
+    async def get_join_date(self, uid: int, guild_id: int):
+        sql = 'SELECT first_join FROM join_dates WHERE uid=$1 AND guild=$2'
 
-        await self.execute_chunked(sqls, values)
+        async def load():
+            row = await self.fetch(sql, (uid, guild_id), fetchmany=False)
+            return row[0] if row else None
 
-    async def get_join_date(self, uid: int, guild_id: int):
-        sql = f"SELECT first_join FROM join_dates WHERE uid={uid} AND guild={guild_id}"
         try:
-            row = await self.fetch(sql, fetchmany=False)
+            return await self.join_dates.get((uid, guild_id), load)
         except PostgresError:
             return None
 
-        if row:
-            return row[0]
+    def set_last_image(self, channel_id: int, url):
+        self.last_images.set(channel_id, url)
+
+    async def get_last_image(self, channel_id: int):
+        """
+        Newest image posted in the channel. Channels that aren't cached are read
+        from the attachments table if the Logger cog persists images there
+        """
+        async def load():
+            if not self.bot.config.persist_last_images:
+                return None
+
+            row = await self.fetch_statement('last_attachment', channel_id, fetchmany=False)
+            return row['attachment'] if row else None
+
+        try:
+            return await self.last_images.get(channel_id, load)
+        except PostgresError:
+            logger.exception('Failed to get last image')
+            return None
 
     async def add_timeout_log(self, guild_id, user_id, author_id, reason, embed=None,
                               timestamp=None, modlog_message_id=None, duration=None,
@@ -861,12 +1087,22 @@ class DatabaseUtils:
         return row
 
     async def get_last_role_time(self, user: int):
-        sql = f'SELECT last_use FROM role_cooldown WHERE uid={user}'
-        return await self.fetch(sql, fetchmany=False)
+        sql = 'SELECT last_use FROM role_cooldown WHERE uid=$1'
+        return await self.role_times.get(user, lambda: self.fetch(sql, (user,), fetchmany=False))
 
     async def update_last_role_time(self, user: int, last_use):
         sql = f'INSERT INTO role_cooldown (uid, last_use) VALUES ($1, $2) ON CONFLICT(uid) DO UPDATE SET last_use=$2'
-        await self.execute(sql, (user, last_use))
+        try:
+            await self.execute(sql, (user, last_use))
+        finally:
+            self.role_times.invalidate(user)
+
+    async def reduce_role_cooldown(self, user: int, amount: timedelta):
+        sql = 'UPDATE role_cooldown SET last_use=(last_use - $2) WHERE uid=$1'
+        try:
+            await self.execute(sql, (user, amount))
+        finally:
+            self.role_times.invalidate(user)
 
     async def get_timeout_logs(self, guild_id: int, user_id: int, bot_id: int = None):
         bot_sql = '' if not bot_id else 'author!=$3 AND '
@@ -908,12 +1144,14 @@ class DatabaseUtils:
         return row
 
     async def get_timezone(self, user_id: int):
-        sql = f'SELECT timezone FROM users WHERE id={user_id}'
+        sql = 'SELECT timezone FROM users WHERE id=$1'
+
+        async def load():
+            row = await self.fetch(sql, (user_id,), fetchmany=False)
+            return row['timezone'] if row else None
 
         try:
-            row = await self.fetch(sql, fetchmany=False)
-            if row:
-                return row['timezone']
+            return await self.timezones.get(user_id, load)
         except PostgresError:
             logger.exception('Failed to get user timezone')
 
@@ -924,26 +1162,30 @@ class DatabaseUtils:
             await self.execute(sql, (user_id, timezone))
         except PostgresError:
             return False
+        finally:
+            self.timezones.invalidate(user_id)
 
         return True
 
     async def last_banner(self, guild_id: int):
-        sql = f'SELECT last_banner FROM guilds WHERE guild={guild_id}'
+        sql = 'SELECT last_banner FROM guilds WHERE guild=$1'
 
         try:
-            return await self.fetch(sql, fetchmany=False)
+            return await self.last_banners.get(guild_id, lambda: self.fetch(sql, (guild_id,), fetchmany=False))
         except PostgresError:
             logger.exception('Failed to get last banner')
             return None
 
     async def set_last_banner(self, guild_id: int, banner):
-        sql = f'UPDATE guilds SET last_banner=$1 WHERE guild={guild_id}'
+        sql = 'UPDATE guilds SET last_banner=$1 WHERE guild=$2'
 
         try:
-            return await self.execute(sql, (banner, ))
+            return await self.execute(sql, (banner, guild_id))
         except PostgresError:
             logger.exception('Failed to set last banner')
             return None
+        finally:
+            self.last_banners.invalidate(guild_id)
 
     async def create_poll(self, emotes, title, strict, guild_id: int,
                           message_id: int, channel_id, expires_in,
@@ -952,7 +1194,7 @@ class DatabaseUtils:
                           max_winners=1,
                           giveaway=False,
                           allow_n_votes=None):
-        async with self.bot.pool.acquire() as conn:
+        async with self.acquire() as conn:
             tr = conn.transaction()
             await tr.start()
             sql = 'INSERT INTO polls (guild, title, strict, message, channel, expires_in, ignore_on_dupe, multiple_votes, max_winners, giveaway, allow_n_votes) ' \
@@ -1015,12 +1257,15 @@ class DatabaseUtils:
 
     async def get_event_points(self, user_id: int) -> int:
         sql = 'SELECT points FROM event_users WHERE uid=$1'
-        retval = await self.fetchval(sql, (user_id,))
+        retval = await self.event_points.get(user_id, lambda: self.fetchval(sql, (user_id,)))
         return retval or 0
 
     async def update_event_points(self, user_id: int, points: int):
         sql = 'UPDATE event_users SET points=points+$2 WHERE uid=$1'
-        await self.execute(sql, [user_id, points])
+        try:
+            await self.execute(sql, [user_id, points])
+        finally:
+            self.event_points.invalidate(user_id)
 
     async def update_user_protect(self, uid: int, protected_until: datetime = None):
         sql = 'UPDATE event_users SET protected_until=$2 WHERE uid=$1'
@@ -1032,13 +1277,17 @@ class DatabaseUtils:
 
     async def add_event_users(self, users):
         sql = 'INSERT INTO event_users (uid) VALUES %s ON CONFLICT DO NOTHING' % self.create_bind_groups(len(users), 1)
-        await self.execute(sql, users)
+        try:
+            await self.execute(sql, users)
+        finally:
+            for uid in users:
+                self.event_points.invalidate(uid)
 
     async def check_blacklist(self, command, user, ctx, fetch_raw: bool=False):
         """
 
         Args:
-            command: Name of the command
+            command: Qualified name of the command
             user: member/user object
             ctx: The context
             fetch_raw: if True the value of the active permission override is returned
@@ -1059,26 +1308,21 @@ class DatabaseUtils:
             16 whitelist AND server
             18 blacklist AND server
         """
-        sql = 'SELECT * FROM command_blacklist WHERE type=%s AND %s ' \
-              'AND (uid=%s OR uid IS NULL) LIMIT 1' % (BlacklistTypes.GLOBAL, command, user.id)
-        rows = await self.fetch(sql, fetchmany=False)
-
-        if rows:
+        # Rules are cached in memory so no queries are needed here
+        cache = self.bot.blacklist_cache
+        if cache.is_globally_blacklisted(command, user.id):
             return False
 
         if ctx.guild is None:
             return True
 
-        channel = ctx.channel
-        if isinstance(user, discord.Member) and user.roles:
-            roles = '(role IS NULL OR role IN ({}))'.format(', '.join(map(lambda r: str(r.id), user.roles)))
+        if isinstance(user, discord.Member):
+            role_ids = [r.id for r in user.roles]
         else:
-            roles = 'role IS NULL'
+            role_ids = ()
 
-        sql = f'SELECT type, role, uid, channel  FROM command_blacklist WHERE guild={user.guild.id} AND {command} ' \
-              f'AND (uid IS NULL OR uid={user.id}) AND {roles} AND (channel IS NULL OR channel={channel.id})'
-        rows = await self.fetch(sql)
-        if not rows:
+        value = cache.get_value(command, user.guild.id, user.id, role_ids, ctx.channel.id)
+        if value is None:
             return None
 
-        return check_perms(rows, return_raw=fetch_raw)
+        return value if fetch_raw else PermValues.RETURNS.get(value, False)
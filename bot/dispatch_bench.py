@@ -0,0 +1,90 @@
+"""
+Event dispatch benchmark. Run with test_run.py --bench dispatch [messages]
+
+Dispatches the same messages to the bot with Bot.dispatch, which only
+schedules scoped listeners for their own guilds and channels, and with
+commands.Bot.dispatch, which schedules every listener like the bot did
+before listener scopes. Measures the dispatch call alone and the time
+until every listener it scheduled has finished.
+"""
+
+import asyncio
+import time
+
+import discord
+from discord.ext import commands
+
+
+def _scoped_listeners(bot, ev):
+    return sum(getattr(l, '__listener_scope__', None) is not None for l in bot.extra_events.get(ev, ()))
+
+
+def _create_messages(bot, factory, count):
+    state = bot._connection
+    messages = []
+    for _ in range(count):
+        data = factory.message_create()
+        channel = state._get_guild(int(data['guild_id'])).get_channel(int(data['channel_id']))
+        messages.append(discord.Message(state=state, channel=channel, data=data))
+
+    return messages
+
+
+def _percentile_us(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1e6
+
+
+async def _measure(bot, harness, dispatch, messages):
+    # Histogram buckets start at 0.1ms which is too coarse for a single dispatch
+    call = []
+    total = []
+    scheduled = 0
+    for message in messages:
+        harness._scheduled = []
+        t = time.perf_counter()
+        dispatch('message', message)
+        call.append(time.perf_counter() - t)
+        tasks = harness._scheduled
+        harness._scheduled = None
+        scheduled += len(tasks)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        total.append(time.perf_counter() - t)
+
+    return call, total, scheduled / len(messages)
+
+
+async def run(bot, harness, factory, count=5000):
+    """
+    Args:
+        bot: Bot that has been set up with harness
+        harness: ReplayHarness of the bot
+        factory: EventFactory used by the harness
+        count: Amount of messages dispatched with each dispatcher
+
+    Returns:
+        The report as a string
+    """
+    # Only chat so commands don't dominate the listener times
+    factory.command_ratio = 0
+    messages = _create_messages(bot, factory, count)
+
+    dispatchers = (('scoped', bot.dispatch),
+                   ('all listeners', lambda *args: commands.Bot.dispatch(bot, *args)))
+
+    # Warm up caches of both paths before measuring
+    for _, dispatch in dispatchers:
+        await _measure(bot, harness, dispatch, messages[:100])
+
+    lines = [f'{len(bot.extra_events.get("on_message", ()))} on_message listeners of which '
+             f'{_scoped_listeners(bot, "on_message")} are scoped. {count} messages',
+             f'{"dispatcher":<14} {"listeners":>9} {"call p50":>9} {"call p99":>9} {"total p50":>9} {"total p99":>9}']
+    for name, dispatch in dispatchers:
+        call, total, listeners = await _measure(bot, harness, dispatch, messages)
+        lines.append(f'{name:<14} {listeners:>9.1f} {_percentile_us(call, 50):>7.1f}us '
+                     f'{_percentile_us(call, 99):>7.1f}us {_percentile_us(total, 50):>7.1f}us '
+                     f'{_percentile_us(total, 99):>7.1f}us')
+
+    return '\n'.join(lines)
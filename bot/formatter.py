@@ -4,7 +4,6 @@ import operator
 
 import colors
 import discord
-from asyncpg.exceptions import PostgresError
 from discord import Embed
 from discord.ext.commands import help, BucketType
 from discord.ext.commands.errors import CommandError
@@ -12,7 +11,7 @@ from discord.ext.commands.errors import CommandError
 from bot.commands import Command
 from bot.cooldowns import Cooldown
 from bot.exceptions import CommandBlacklisted
-from utils.utilities import check_perms
+from bot.globals import PermValues
 
 terminal = logging.getLogger('terminal')
 
@@ -39,53 +38,40 @@ class HelpCommand(help.HelpCommand):
     @staticmethod
     async def _get_db_perms(ctx):
         user = ctx.author
-        channel = ctx.channel
         is_guild = ctx.guild is not None
 
-        if isinstance(user, discord.Member) and len(user.roles) > 1:
-            roles = '(role IS NULL OR role IN ({}))'.format(', '.join(map(lambda r: str(r.id), user.roles)))
-        else:
-            roles = 'role IS NULL'
-
         guild_owner = False if (not is_guild or not ctx.guild.owner_id) else user.id == ctx.guild.owner_id
-        command_blacklist = {}
 
         # Filter by custom blacklist
-        if not guild_owner and is_guild:
-            sql = 'SELECT type, role, uid, channel, command FROM command_blacklist WHERE guild=$1 ' \
-                  'AND (uid IS NULL OR uid=$2) AND {} AND (channel IS NULL OR channel=$3)'.format(roles)
+        if guild_owner or not is_guild:
+            return {}
 
-            try:
-                rows = await ctx.bot.dbutil.fetch(sql, (ctx.guild.id, user.id, channel.id))
+        cache = getattr(ctx.bot, 'blacklist_cache', None)
+        if cache is None:
+            return {}
 
-                for row in rows:
-                    name = row['command']
-                    if name in command_blacklist:
-                        command_blacklist[name].append(row)
-                    else:
-                        command_blacklist[name] = [row]
-
-            except PostgresError:
-                terminal.exception('Failed to get role blacklist for help command')
+        if isinstance(user, discord.Member) and len(user.roles) > 1:
+            role_ids = [r.id for r in user.roles]
+        else:
+            role_ids = ()
 
-        return command_blacklist
+        return cache.get_command_values(ctx.guild.id, user.id, role_ids, ctx.channel.id)
 
     @staticmethod
     def check_blacklist(commands, command_blacklist):
-        def check(command):
-            rows = command_blacklist.get(command.name, None)
-            if not rows:
-                return None
-            return check_perms(rows)
-
+        """
+        Args:
+            commands: List of commands to check
+            command_blacklist: dict of command name: permission value
+        """
         new_commands = []
         whitelist = []
         for cmd in commands:
-            retval = check(cmd)
-            if retval:
-                whitelist.append(cmd)
-            elif retval is None:
+            value = command_blacklist.get(cmd.name, None)
+            if value is None:
                 new_commands.append(cmd)
+            elif PermValues.RETURNS.get(value, False):
+                whitelist.append(cmd)
 
         return new_commands, whitelist
 
@@ -1,35 +1,319 @@
-from asyncpg.exceptions import PostgresError
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+
+from asyncpg.exceptions import PostgresError, InterfaceError
 
 from bot.exceptions import (NotEnoughPrefixes, PrefixExists,
                             PrefixDoesntExist)
 
+logger = logging.getLogger('terminal')
+
+
+class PrefixMatcher:
+    """
+    Finds the longest matching prefix from a set of prefixes with
+    a single precompiled regex
+    """
+    __slots__ = ('_regex',)
+
+    def __init__(self, prefixes):
+        if not prefixes:
+            self._regex = None
+            return
+
+        # Longer prefixes go first so that e.g. prefix aa is matched instead of a
+        prefixes = sorted(prefixes, key=len, reverse=True)
+        self._regex = re.compile('|'.join(map(re.escape, prefixes)))
+
+    def match(self, s):
+        """Returns the matched prefix or None"""
+        if self._regex is None:
+            return None
+
+        m = self._regex.match(s)
+        if m is None:
+            return None
+
+        return m.group()
+
+
+class GuildSettings:
+    """
+    Cached settings of a single guild. Attributes match the columns of
+    the guilds table. Defaults are kept in DEFAULTS instead of each instance
+    storing a dict of its own.
+    """
+    DEFAULTS = {
+        'mute_role': None,
+        'modlog': None,
+        'log_unmutes': False,
+        'keeproles': False,
+        'automute': False,
+        'automute_limit': 10,
+        'automute_time': None,
+        'on_join_channel': None,
+        'on_join_message': None,
+        'on_leave_channel': None,
+        'on_leave_message': None,
+        'color_on_join': False,
+        'on_edit_channel': None,
+        'on_edit_message': None,
+        'on_edit_embed': False,
+        'on_delete_channel': None,
+        'on_delete_message': None,
+        'on_delete_embed': False,
+        'dailygachi': None,
+        'last_banner': None,
+    }
+    # prefixes is a frozenset shared by every guild with the same prefixes
+    # or None when the guild uses the default prefix
+    __slots__ = (*DEFAULTS, 'prefixes')
+
+    def __init__(self):
+        for k, v in self.DEFAULTS.items():
+            object.__setattr__(self, k, v)
+
+        object.__setattr__(self, 'prefixes', None)
+
+    def update(self, values):
+        """Set values from a dict. None values and unknown keys are ignored"""
+        for k, v in values.items():
+            if v is None or k not in self.DEFAULTS:
+                continue
+
+            setattr(self, k, v)
+
+    def __repr__(self):
+        values = ' '.join(f'{k}={getattr(self, k)!r}' for k in self.DEFAULTS
+                          if getattr(self, k) != self.DEFAULTS[k])
+        return f'<GuildSettings {values} prefixes={self.prefixes!r}>'
+
+
+class _DefaultGuildSettings(GuildSettings):
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError('Default guild settings are read only')
+
+
+# Returned for guilds that aren't cached so lookups don't allocate anything
+DEFAULT_SETTINGS = _DefaultGuildSettings()
+
 
 class GuildCache:
-    def __init__(self, bot):
+    """
+    Cache of guild settings.
+
+    With max_size 0 the settings of every guild are loaded on startup and
+    kept for as long as the bot is in the guild. Otherwise settings are
+    loaded on demand and at most max_size guilds are kept, evicting the
+    least recently used ones. Getters are synchronous so a getter that
+    misses returns the defaults and starts loading the guild in the
+    background. Use load before reading settings when the values have to
+    be correct on the first access.
+    """
+    # Max amount of guilds loaded with one query
+    PREFETCH_CHUNK = 5000
+    # Seconds before a guild whose load failed is loaded again on access
+    LOAD_RETRY_DELAY = 30
+
+    def __init__(self, bot, max_size=0):
         self._bot = bot
-        self.guilds = {}
+        self.max_size = max_size
+        self.guilds = OrderedDict()
+        # guild id -> Future of the load in progress
+        self._pending = {}
+        # guild id -> time.monotonic() after which a failed load is retried
+        self._failed = {}
+        # prefix frozenset -> (prefix frozenset, reverse sorted tuple, PrefixMatcher)
+        # Most guilds have the same prefixes so these are shared between them
+        self._prefix_data = {}
 
     @property
     def bot(self):
         return self._bot
 
-    def update_cached_guild(self, guild_id, **values):
+    @property
+    def lazy(self):
+        return self.max_size > 0
+
+    def is_cached(self, guild_id):
+        return guild_id in self.guilds
+
+    def _store(self, guild_id, settings):
+        self.guilds[guild_id] = settings
+        if not self.max_size:
+            return
+
+        self.guilds.move_to_end(guild_id)
+        while len(self.guilds) > self.max_size:
+            self.guilds.popitem(last=False)
+
+    def cache_rows(self, rows):
         """
-        Updates a servers cached values. None values are ignored
+        Cache settings from rows of the guild_settings statement
+        which has one row per prefix of each guild
+
+        Returns:
+            set of the guild ids found in the rows
         """
-        settings = self.get_settings(guild_id)
-        for k, v in values.items():
-            if v is None:
-                continue
+        guilds = {}
+        for row in rows:
+            guild_id = row['guild']
+            values = guilds.get(guild_id)
+            if values is None:
+                values = {**row}
+                values['prefixes'] = set()
+                guilds[guild_id] = values
+
+            prefix = row['prefix']
+            if prefix is not None:
+                values['prefixes'].add(prefix)
+
+        for guild_id, values in guilds.items():
+            values.pop('guild', None)
+            values.pop('prefix', None)
+            prefixes = values.pop('prefixes')
+            settings = GuildSettings()
+            settings.update(values)
+            if prefixes:
+                settings.prefixes = self._shared_prefixes(prefixes)
+            self._store(guild_id, settings)
+
+        return set(guilds.keys())
+
+    async def load(self, guild_id):
+        """
+        Load the settings of a guild if they aren't cached.
+        Concurrent loads of the same guild share one query
+        """
+        settings = self.guilds.get(guild_id)
+        if settings is not None:
+            return settings
+
+        fut = self._pending.get(guild_id)
+        if fut is not None:
+            await asyncio.shield(fut)
+            return self.get_settings(guild_id)
+
+        fut = self.bot.loop.create_future()
+        self._pending[guild_id] = fut
+        try:
+            rows = await self.bot.dbutil.fetch_statement('guild_settings', guild_id)
+            # Guild might have been removed from the cache during the load
+            if self._pending.get(guild_id) is fut:
+                if not self.cache_rows(rows):
+                    # Guilds without a row use the defaults
+                    self._store(guild_id, GuildSettings())
+            self._failed.pop(guild_id, None)
+        except (PostgresError, InterfaceError, OSError):
+            logger.exception(f'Failed to load settings of guild {guild_id}')
+            # Without this every access would start a new load while the database is down
+            self._failed[guild_id] = time.monotonic() + self.LOAD_RETRY_DELAY
+        finally:
+            if self._pending.get(guild_id) is fut:
+                del self._pending[guild_id]
+            fut.set_result(None)
+
+        return self.get_settings(guild_id)
+
+    async def refresh(self, guild_id):
+        """Reload the settings of a cached guild. Used when another process changes them"""
+        if guild_id not in self.guilds:
+            return
+
+        rows = await self.bot.dbutil.fetch_statement('guild_settings', guild_id)
+        if not self.cache_rows(rows):
+            self._store(guild_id, GuildSettings())
+
+    async def resync(self):
+        """Reload the settings of every cached guild"""
+        await self.prefetch(list(self.guilds.keys()))
+
+    def _load_later(self, guild_id):
+        if guild_id in self._pending:
+            return
+
+        retry_at = self._failed.get(guild_id)
+        if retry_at is not None:
+            if retry_at > time.monotonic():
+                return
+            del self._failed[guild_id]
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from the event loop
+            return
+
+        loop.create_task(self.load(guild_id))
+
+    async def prefetch(self, guild_ids):
+        """
+        Load the settings of multiple guilds in bulk
 
-            settings[k] = v
+        Returns:
+            set of the guild ids found in the database
+        """
+        guild_ids = list(guild_ids)
+        found = set()
+        for i in range(0, len(guild_ids), self.PREFETCH_CHUNK):
+            chunk = guild_ids[i:i+self.PREFETCH_CHUNK]
+            rows = await self.bot.dbutil.fetch_statement('guilds_settings', chunk)
+            found.update(self.cache_rows(rows))
+
+        for guild_id in guild_ids:
+            if guild_id not in found and guild_id not in self.guilds:
+                self._store(guild_id, GuildSettings())
+
+        return found
+
+    def _get_prefix_data(self, prefixes):
+        if prefixes is None:
+            # Data of the default prefix is stored with the prefix string as
+            # the key so no set has to be created for the lookup
+            key = self.bot.default_prefix
+            data = self._prefix_data.get(key)
+            if data is None:
+                prefixes = frozenset((key,))
+                data = (prefixes, (key,), PrefixMatcher(prefixes))
+                self._prefix_data[key] = data
+
+            return data
+
+        data = self._prefix_data.get(prefixes)
+        if data is None:
+            # Reverse sort prefixes so some prefixes don't get overlooked
+            # e.q. if you add a prefix a and then a prefix aa if the a prefix is
+            # first in the list it will always get invoked when aa is used
+            data = (prefixes, tuple(sorted(prefixes, reverse=True)), PrefixMatcher(prefixes))
+            self._prefix_data[prefixes] = data
+
+        return data
+
+    def _shared_prefixes(self, prefixes):
+        """Get the instance of the prefix set shared between guilds"""
+        return self._get_prefix_data(frozenset(prefixes))[0]
+
+    def _set_prefixes(self, guild_id, prefixes):
+        self.get_or_create_settings(guild_id).prefixes = self._shared_prefixes(prefixes)
 
-        # Reverse sort prefixes so some prefixes don't get overlooked
-        # e.q. if you add a prefix a and then a prefix aa if the a prefix is
-        # first in the list it will always get invoked when aa is used
-        self._set_internal_value(guild_id, 'prefixes', sorted(list(self.prefixes(guild_id, use_set=True)), reverse=True))
+    def update_cached_guild(self, guild_id, **values):
+        """
+        Updates a servers cached values. None values are ignored
+        """
+        settings = self.get_or_create_settings(guild_id)
+        prefixes = values.pop('prefixes', None)
+        settings.update(values)
+        if prefixes:
+            self._set_prefixes(guild_id, prefixes)
 
     async def set_value(self, guild_id, name, value):
+        # Load first so the other settings of the guild aren't replaced by defaults
+        await self.load(guild_id)
         # WARNING sql injection could happen if user input is allowed to the name var
         sql = 'INSERT INTO guilds (guild, {0}) VALUES ($1, $2) ON CONFLICT (guild) DO UPDATE SET {0}=$2'.format(name)
         try:
@@ -37,65 +321,45 @@ class GuildCache:
             success = True
         except PostgresError:
             success = False
-        settings = self.get_settings(guild_id)
-        settings[name] = value
+        settings = self.get_or_create_settings(guild_id)
+        setattr(settings, name, value)
+        if success:
+            await self.bot.invalidation.publish('guild_settings', guild_id)
         return success
 
-    # Used for setting cached values not present in the database or in a different form
-    # e.g. cache a set as a list. Used only for prefixes as we need them stored in a
-    # sorted list when checking for usable prefixes and a set when adding more
-    # to the list
-    def _set_internal_value(self, guild_id, name, value):
-        settings = self.get_settings(guild_id)
-        internals = settings.get('_internals')
-        if internals is None:
-            internals = {}
-            settings['_internals'] = internals
-
-        internals[name] = value
-
-    def _get_internals(self, guild_id):
-        settings = self.get_settings(guild_id)
-        internals = settings.get('_internals')
-        if internals is None:
-            internals = {}
-            settings['_internals'] = internals
-
-        return internals
-
     # utils
     def prefixes(self, guild_id, use_set=False):
-        if use_set:
-            return self.get_settings(guild_id).get('prefixes', {self.bot.default_prefix})
-
-        prefixes = self._get_internals(guild_id).get('prefixes')
-        if prefixes is None:
-            prefixes = list(self.get_settings(guild_id).get('prefixes', [self.bot.default_prefix]))
-            self._set_internal_value(guild_id, 'prefixes', prefixes)
+        """
+        Prefixes of the guild as a frozenset if use_set is True
+        otherwise as a reverse sorted tuple
+        """
+        data = self._get_prefix_data(self.get_settings(guild_id).prefixes)
+        return data[0] if use_set else data[1]
 
-        return prefixes
+    def prefix_matcher(self, guild_id):
+        """
+        Get the PrefixMatcher for the guild. Matchers are shared
+        by all guilds with the same prefixes
+        """
+        return self._get_prefix_data(self.get_settings(guild_id).prefixes)[2]
 
     async def add_prefix(self, guild_id, prefix):
-        settings = self.get_settings(guild_id)
-        if 'prefixes' not in settings:
-            prefixes = {self.bot.default_prefix}
-            settings['prefixes'] = prefixes
-        else:
-            prefixes = self.prefixes(guild_id, use_set=True)
-
+        await self.load(guild_id)
+        prefixes = self.prefixes(guild_id, use_set=True)
         if prefix in prefixes:
             raise PrefixExists('Prefix is already in use')
 
         success = await self.bot.dbutil.add_prefix(guild_id, prefix)
         if success:
-            prefixes_list = self.prefixes(guild_id)
-            prefixes_list.append(prefix)
-            prefixes_list.sort(reverse=True)
-            prefixes.add(prefix)
+            # Re-read in case the prefixes changed during the query
+            prefixes = self.prefixes(guild_id, use_set=True)
+            self._set_prefixes(guild_id, prefixes | {prefix})
+            await self.bot.invalidation.publish('guild_settings', guild_id)
 
         return success
 
     async def remove_prefix(self, guild_id, prefix):
+        await self.load(guild_id)
         prefixes = self.prefixes(guild_id, use_set=True)
         if prefix not in prefixes:
             raise PrefixDoesntExist("Prefix doesn't exist")
@@ -105,64 +369,59 @@ class GuildCache:
 
         success = await self.bot.dbutil.remove_prefix(guild_id, prefix)
         if success:
-            prefixes.discard(prefix)
-            try:
-                self.prefixes(guild_id).remove(prefix)
-            except ValueError:
-                pass
+            prefixes = self.prefixes(guild_id, use_set=True)
+            self._set_prefixes(guild_id, prefixes - {prefix})
+            await self.bot.invalidation.publish('guild_settings', guild_id)
 
         return success
 
     # moderation
     def modlog(self, guild_id):
-        return self.get_settings(guild_id).get('modlog', None)
+        return self.get_settings(guild_id).modlog
 
     async def set_modlog(self, guild_id, channel_id):
         return await self.set_value(guild_id, 'modlog', channel_id)
 
     def mute_role(self, guild_id):
-        return self.get_settings(guild_id).get('mute_role', None)
+        return self.get_settings(guild_id).mute_role
 
     async def set_mute_role(self, guild_id, role_id):
         return await self.set_value(guild_id, 'mute_role', role_id)
 
     def log_unmutes(self, guild_id):
-        return self.get_settings(guild_id).get('log_unmutes', False)
+        return self.get_settings(guild_id).log_unmutes
 
     async def set_log_unmutes(self, guild_id, boolean):
         return await self.set_value(guild_id, 'log_unmutes', boolean)
 
     def keeproles(self, guild_id):
-        if self.get_settings(guild_id).get('keeproles', 0):
-            return True
-        else:
-            return False
+        return bool(self.get_settings(guild_id).keeproles)
 
     async def set_keeproles(self, guild_id, value):
         return await self.set_value(guild_id, 'keeproles', value)
 
     # automod
     def automute(self, guild_id):
-        return self.get_settings(guild_id).get('automute', False)
+        return self.get_settings(guild_id).automute
 
     async def set_automute(self, guild_id, on: bool):
         return await self.set_value(guild_id, 'automute', on)
 
     def automute_limit(self, guild_id):
-        return self.get_settings(guild_id).get('automute_limit', 10)
+        return self.get_settings(guild_id).automute_limit
 
     async def set_automute_limit(self, guild_id, limit: int):
         return await self.set_value(guild_id, 'automute_limit', limit)
 
     def automute_time(self, guild_id):
-        return self.get_settings(guild_id).get('automute_time')
+        return self.get_settings(guild_id).automute_time
 
     async def set_automute_time(self, guild_id, time):
         return await self.set_value(guild_id, 'automute_time', time)
 
     # join config
     def join_message(self, guild_id, default_message=False):
-        message = self.get_settings(guild_id).get('on_join_message')
+        message = self.get_settings(guild_id).on_join_message
         if message is None and default_message:
             message = self.bot.config.join_message
 
@@ -172,21 +431,21 @@ class GuildCache:
         return await self.set_value(guild_id, 'on_join_message', message)
 
     def join_channel(self, guild_id):
-        return self.get_settings(guild_id).get('on_join_channel')
+        return self.get_settings(guild_id).on_join_channel
 
     async def set_join_channel(self, guild_id, channel):
         return await self.set_value(guild_id, 'on_join_channel', channel)
 
     # random color on join
     def random_color(self, guild_id):
-        return self.get_settings(guild_id).get('color_on_join', False)
+        return self.get_settings(guild_id).color_on_join
 
     async def set_random_color(self, guild_id, value):
         return await self.set_value(guild_id, 'color_on_join', value)
 
     # leave config
     def leave_message(self, guild_id, default_message=False):
-        message = self.get_settings(guild_id).get('on_leave_message')
+        message = self.get_settings(guild_id).on_leave_message
         if message is None and default_message:
             message = self.bot.config.leave_message
 
@@ -196,14 +455,14 @@ class GuildCache:
         return await self.set_value(guild_id, 'on_leave_message', message)
 
     def leave_channel(self, guild_id):
-        return self.get_settings(guild_id).get('on_leave_channel')
+        return self.get_settings(guild_id).on_leave_channel
 
     async def set_leave_channel(self, guild_id, channel):
         return await self.set_value(guild_id, 'on_leave_channel', channel)
 
     # On message edit
     def on_edit_message(self, guild_id, default_message=False):
-        message = self.get_settings(guild_id).get('on_edit_message')
+        message = self.get_settings(guild_id).on_edit_message
         if message is None and default_message:
             message = self.bot.config.edit_message
 
@@ -213,20 +472,20 @@ class GuildCache:
         return await self.set_value(guild_id, 'on_edit_message', message)
 
     def on_edit_channel(self, guild_id):
-        return self.get_settings(guild_id).get('on_edit_channel')
+        return self.get_settings(guild_id).on_edit_channel
 
     async def set_on_edit_channel(self, guild_id, channel):
         return await self.set_value(guild_id, 'on_edit_channel', channel)
 
     def on_edit_embed(self, guild_id):
-        return self.get_settings(guild_id).get('on_edit_embed')
+        return self.get_settings(guild_id).on_edit_embed
 
     async def set_on_edit_embed(self, guild_id, boolean):
         return await self.set_value(guild_id, 'on_edit_embed', boolean)
 
     # On message delete
     def on_delete_message(self, guild_id, default_message=False):
-        message = self.get_settings(guild_id).get('on_delete_message')
+        message = self.get_settings(guild_id).on_delete_message
         if message is None and default_message:
             message = self.bot.config.delete_message
 
@@ -236,28 +495,44 @@ class GuildCache:
         return await self.set_value(guild_id, 'on_delete_message', message)
 
     def on_delete_channel(self, guild_id):
-        return self.get_settings(guild_id).get('on_delete_channel')
+        return self.get_settings(guild_id).on_delete_channel
 
     async def set_on_delete_channel(self, guild_id, channel):
         return await self.set_value(guild_id, 'on_delete_channel', channel)
 
     def on_delete_embed(self, guild_id):
-        return self.get_settings(guild_id).get('on_delete_embed')
+        return self.get_settings(guild_id).on_delete_embed
 
     async def set_on_delete_embed(self, guild_id, boolean):
         return await self.set_value(guild_id, 'on_delete_embed', boolean)
 
     def dailygachi(self, guild_id):
-        return self.get_settings(guild_id).get('dailygachi')
+        return self.get_settings(guild_id).dailygachi
 
     async def set_dailygachi(self, guild_id, channel):
         return await self.set_value(guild_id, 'dailygachi', channel)
 
-    def get_settings(self, guild_id):
-        settings = self[guild_id]
-        if not settings:
-            settings = {}
-            self[guild_id] = settings
+    def get_settings(self, guild_id) -> GuildSettings:
+        """
+        Settings of the guild. Guilds that aren't cached get DEFAULT_SETTINGS
+        which can't be modified. Use get_or_create_settings when modifying
+        """
+        settings = self.guilds.get(guild_id)
+        if settings is None:
+            if self.max_size:
+                self._load_later(guild_id)
+            return DEFAULT_SETTINGS
+
+        if self.max_size:
+            self.guilds.move_to_end(guild_id)
+
+        return settings
+
+    def get_or_create_settings(self, guild_id) -> GuildSettings:
+        settings = self.guilds.get(guild_id)
+        if settings is None:
+            settings = GuildSettings()
+            self._store(guild_id, settings)
 
         return settings
 
@@ -265,9 +540,11 @@ class GuildCache:
         return self.guilds.get(item, None)
 
     def __setitem__(self, key, value):
-        self.guilds[key] = value
+        self._store(key, value)
 
     def __delitem__(self, key):
+        self._pending.pop(key, None)
+        self._failed.pop(key, None)
         try:
             del self.guilds[key]
         except KeyError:
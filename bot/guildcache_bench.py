@@ -0,0 +1,86 @@
+"""
+Memory and lookup benchmark of the guild settings cache.
+Run with test_run.py --bench guildcache [guilds]
+
+Doesn't need discord or the database. Only update_cached_guild and the
+getters are used so the same benchmark can be run against older versions
+of bot/guildcache.py to compare them.
+"""
+
+import gc
+import random
+import timeit
+import tracemalloc
+
+from bot.guildcache import GuildCache
+
+# Settings of a typical configured guild
+_ROW = dict(mute_role=123456789012345678, modlog=223456789012345678, on_delete_channel=None,
+            on_edit_channel=None, keeproles=False, on_join_channel=None, on_leave_channel=None,
+            on_join_message=None, on_leave_message=None, color_on_join=False, on_edit_message=None,
+            on_delete_message=None, automute=True, automute_limit=10, automute_time=None,
+            on_delete_embed=False, on_edit_embed=False, dailygachi=None, last_banner=None)
+
+_CUSTOM_PREFIXES = ({'!'}, {'?'}, {'!', '?'}, {'pls '}, {'$', '!'})
+
+_GETTERS = ('modlog', 'mute_role', 'automute', 'prefixes', 'prefix_matcher')
+
+
+class _Bot:
+    default_prefix = '!'
+
+
+def _fill(cache, guilds, custom_ratio, rng):
+    for guild_id in range(guilds):
+        if rng.random() < custom_ratio:
+            prefixes = rng.choice(_CUSTOM_PREFIXES)
+        else:
+            prefixes = {_Bot.default_prefix}
+
+        cache.update_cached_guild(guild_id, prefixes=prefixes, **_ROW)
+
+
+def _time_ns(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def run(guilds=100000, custom_ratio=0.1, lookups=200000, seed=0):
+    """
+    Fills a cache with guilds guilds of which custom_ratio have custom
+    prefixes and measures the memory used and the time of single lookups.
+
+    Returns:
+        The report as a string
+    """
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    cache = GuildCache(_Bot())
+    _fill(cache, guilds, custom_ratio, rng)
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = [f'{guilds} guilds ({custom_ratio:.0%} with custom prefixes)',
+             f'memory {memory / 2**20:.1f} MiB ({memory / guilds:.0f} B per guild) '
+             f'peak {peak / 2**20:.1f} MiB',
+             f'{"lookup":<16} {"hit":>8} {"miss":>8}']
+
+    hit = guilds // 2
+    miss = guilds * 10
+    for name in _GETTERS:
+        getter = getattr(cache, name, None)
+        if getter is None:
+            continue
+
+        hit_ns = _time_ns(lambda: getter(hit), lookups)
+        cached = len(cache.guilds)
+        miss_ns = _time_ns(lambda: getter(miss), lookups)
+        lines.append(f'{name:<16} {hit_ns:>6.0f}ns {miss_ns:>6.0f}ns')
+        if len(cache.guilds) != cached:
+            lines.append(f'{name} miss added {len(cache.guilds) - cached} guilds to the cache')
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from asyncpg.exceptions import PostgresError, InterfaceError
+
+from bot.metrics import Histogram, format_ms
+
+logger = logging.getLogger('terminal')
+
+
+class _Subscription:
+    __slots__ = ('invalidate', 'resync', 'latency', 'received', 'missed', 'resyncs')
+
+    def __init__(self, invalidate, resync):
+        self.invalidate = invalidate
+        self.resync = resync
+        self.latency = Histogram()
+        self.received = 0
+        self.missed = 0
+        self.resyncs = 0
+
+
+class InvalidationBus:
+    """
+    Tells other processes (other clusters, the audio bot) which keys of
+    their in-memory caches have changed using postgres LISTEN/NOTIFY.
+
+    Cache owners publish the name of the cache and the changed key after
+    writing to the database. Other processes call the invalidate callback
+    the cache registered with subscribe which should reload only that key.
+
+    Every message carries a per sender and cache sequence number. A gap in
+    the sequence or losing the listening connection means messages were
+    missed in which case the resync callback reloads the whole cache.
+    Delivery latency is measured from the time the message was published
+    so it is only accurate when the processes share a clock.
+    """
+    CHANNEL = 'cache_invalidation'
+
+    def __init__(self, bot, check_interval=60):
+        self._bot = bot
+        self.sender = uuid.uuid4().hex[:12]
+        self._check_interval = check_interval
+        # cache name -> _Subscription
+        self._subscriptions = {}
+        # cache name -> last sequence number published by us
+        self._published = {}
+        # (sender, cache name) -> last sequence number received
+        self._received = {}
+        self._conn = None
+        self._check_task = None
+        self._lock = None
+        self.published = 0
+        self.publish_errors = 0
+        self.reconnects = 0
+
+    @property
+    def bot(self):
+        return self._bot
+
+    def subscribe(self, name, invalidate, resync=None):
+        """
+        Args:
+            name: Name of the cache
+            invalidate: Coroutine function called with the changed key
+            resync: Coroutine function that reloads the whole cache.
+                    Called when messages might have been missed
+        """
+        self._subscriptions[name] = _Subscription(invalidate, resync)
+
+    def unsubscribe(self, name):
+        self._subscriptions.pop(name, None)
+
+    async def publish(self, name, key):
+        """
+        Publish a change to the key of the cache. Should be called after
+        the database has been modified. Errors are logged and not raised
+        as the local cache has already been updated at that point
+        """
+        # Notifies are sent one at a time so sequence numbers arrive in order
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            seq = self._published.get(name, 0) + 1
+            payload = json.dumps({'s': self.sender, 'n': seq, 't': time.time(), 'c': name, 'k': key})
+            try:
+                await self.bot.dbutil.execute('SELECT pg_notify($1, $2)', (self.CHANNEL, payload))
+            except (PostgresError, InterfaceError, OSError):
+                self.publish_errors += 1
+                logger.exception(f'Failed to publish invalidation of {name} {key}')
+                return
+
+            self._published[name] = seq
+            self.published += 1
+
+    async def start(self):
+        await self._listen()
+
+        if self._check_task is None or self._check_task.done():
+            self._check_task = self.bot.loop.create_task(self._check_loop())
+
+    async def stop(self):
+        if self._check_task:
+            self._check_task.cancel()
+            self._check_task = None
+
+        if self._conn is not None:
+            conn = self._conn
+            self._conn = None
+            try:
+                await conn.remove_listener(self.CHANNEL, self._on_notify)
+            except InterfaceError:
+                pass
+            await self.bot.pool.release(conn)
+
+    async def _listen(self):
+        if self._conn is not None and not self._conn.is_closed():
+            return
+
+        # Dedicated connection that is held for as long as we want notifications
+        self._conn = await self.bot.pool.acquire()
+        await self._conn.add_listener(self.CHANNEL, self._on_notify)
+
+    def _on_notify(self, _conn, _pid, _channel, payload):
+        try:
+            msg = json.loads(payload)
+            sender = msg['s']
+            seq = msg['n']
+            name = msg['c']
+            key = msg['k']
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f'Invalid invalidation message {payload}')
+            return
+
+        if sender == self.sender:
+            return
+
+        sub = self._subscriptions.get(name)
+        if sub is None:
+            return
+
+        sub.received += 1
+        sub.latency.add(max(0.0, time.time() - msg.get('t', time.time())))
+
+        last = self._received.get((sender, name))
+        self._received[(sender, name)] = seq
+        if last is not None and seq > last + 1:
+            sub.missed += seq - last - 1
+            logger.warning(f'Missed {seq - last - 1} invalidations of {name} from {sender}')
+            self._schedule_resync(name, sub)
+            return
+
+        # json turns tuples into lists
+        if isinstance(key, list):
+            key = tuple(key)
+
+        self.bot.loop.create_task(self._run(sub.invalidate(key), f'invalidate {name} {key}'))
+
+    def _schedule_resync(self, name, sub):
+        if sub.resync is None:
+            return
+
+        sub.resyncs += 1
+        self.bot.loop.create_task(self._run(sub.resync(), f'resync {name}'))
+
+    @staticmethod
+    async def _run(coro, what):
+        try:
+            await coro
+        except Exception:  # skipcq: PYL-W0703
+            logger.exception(f'Failed to {what}')
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.sleep(self._check_interval)
+
+            if self._conn is None or not self._conn.is_closed():
+                continue
+
+            try:
+                # Messages sent while the connection was down are lost so
+                # listen again and reload everything
+                conn = self._conn
+                self._conn = None
+                await self.bot.pool.release(conn)
+                await self._listen()
+            except (PostgresError, InterfaceError, OSError):
+                logger.exception('Failed to listen for cache invalidations')
+                continue
+
+            self.reconnects += 1
+            self._received.clear()
+            for name, sub in list(self._subscriptions.items()):
+                self._schedule_resync(name, sub)
+
+    def reset(self):
+        for sub in self._subscriptions.values():
+            sub.latency = Histogram()
+            sub.received = 0
+            sub.missed = 0
+            sub.resyncs = 0
+
+    def format_stats(self):
+        lines = [f'sender {self.sender} published {self.published} publish errors {self.publish_errors} '
+                 f'reconnects {self.reconnects}',
+                 f'{"cache":<20} {"received":>8} {"missed":>6} {"resyncs":>7} {"p50":>8} {"p99":>8} {"max":>8}']
+        for name, sub in self._subscriptions.items():
+            lines.append(f'{name:<20} {sub.received:>8} {sub.missed:>6} {sub.resyncs:>7} '
+                         f'{format_ms(sub.latency.percentile(50)):>8} {format_ms(sub.latency.percentile(99)):>8} '
+                         f'{format_ms(sub.latency.max):>8}')
+
+        return '\n'.join(lines)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+from bot.metrics import Histogram, format_ms
+from utils.utilities import get_avatar, split_string
+
+logger = logging.getLogger('terminal')
+
+
+class LogEntry:
+    __slots__ = ('text', 'embed', 'title', 'author', 'icon_url', 'timestamp')
+
+    def __init__(self, text, embed=False, title=None, author=None, icon_url=None, timestamp=None):
+        self.text = text
+        self.embed = embed
+        self.title = title
+        self.author = author
+        self.icon_url = icon_url
+        self.timestamp = timestamp
+
+
+class _ChannelQueue:
+    __slots__ = ('channel', 'entries', 'task')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.entries = deque()
+        self.task = None
+
+
+class LogBatcher:
+    """
+    Posts log messages (deletes, edits, joins and leaves) to their log
+    channels with as few messages as possible.
+
+    Each channel has its own queue and sends one message at a time. The
+    first entry of an idle channel is sent right away. Entries that arrive
+    while a message is being sent or within window seconds after it are
+    merged into the next message. Text entries are joined up to the message
+    length limit and embed entries become fields of a single embed. During
+    purges and raids a channel therefore gets at most one message per window
+    and when discord rate limits the channel the entries keep piling up in
+    the queue instead of each waiting in a coroutine of its own.
+    When a queue holds max_queue entries the oldest entries are dropped.
+    """
+    # Limits of a single message
+    MAX_CONTENT = 2000
+    MAX_DESCRIPTION = 2048
+    MAX_FIELDS = 25
+    MAX_FIELD_NAME = 256
+    MAX_FIELD_VALUE = 1024
+    # Total characters of an embed is limited to 6000. Leave room for the title
+    MAX_EMBED = 5800
+
+    def __init__(self, bot, window=1.5, max_queue=1000):
+        self._bot = bot
+        self.window = window
+        self.max_queue = max_queue
+        # channel id -> _ChannelQueue
+        self._queues = {}
+
+        self.send_latency = Histogram()
+        self.entries = 0
+        self.messages = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    @property
+    def bot(self):
+        return self._bot
+
+    @property
+    def depth(self):
+        """Amount of entries waiting to be posted"""
+        return sum(len(q.entries) for q in self._queues.values())
+
+    def add(self, channel, entry):
+        """Queue an entry to be posted to the channel. Must be called from the event loop"""
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = _ChannelQueue(channel)
+            self._queues[channel.id] = queue
+
+        if len(queue.entries) >= self.max_queue:
+            queue.entries.popleft()
+            self.dropped += 1
+
+        queue.entries.append(entry)
+        self.entries += 1
+        if len(queue.entries) > self.max_depth:
+            self.max_depth = len(queue.entries)
+
+        if queue.task is None:
+            queue.task = self.bot.loop.create_task(self._run(queue))
+
+    def add_text(self, channel, text):
+        self.add(channel, LogEntry(text))
+
+    def add_embed(self, channel, text, title, author, timestamp):
+        self.add(channel, LogEntry(text, embed=True, title=title, author=str(author),
+                                   icon_url=get_avatar(author), timestamp=timestamp))
+
+    def _field_size(self, entry):
+        return len(entry.text) + min(len(entry.author) + len(entry.title or '') + 2, self.MAX_FIELD_NAME)
+
+    def _take_batch(self, entries):
+        """Remove the entries that fit in one message from the queue"""
+        first = entries.popleft()
+        batch = [first]
+        if first.embed:
+            # Long entries are posted on their own
+            if len(first.text) > self.MAX_FIELD_VALUE:
+                return batch
+
+            size = self._field_size(first)
+            while entries and len(batch) < self.MAX_FIELDS:
+                entry = entries[0]
+                if not entry.embed or len(entry.text) > self.MAX_FIELD_VALUE:
+                    break
+
+                size += self._field_size(entry)
+                if size > self.MAX_EMBED:
+                    break
+
+                batch.append(entries.popleft())
+
+        else:
+            size = len(first.text)
+            while entries and not entries[0].embed:
+                size += len(entries[0].text) + 1
+                if size > self.MAX_CONTENT:
+                    break
+
+                batch.append(entries.popleft())
+
+        return batch
+
+    def _format(self, batch):
+        """Returns a list of (content, embed) tuples to send"""
+        first = batch[0]
+        if not first.embed:
+            content = '\n'.join(e.text for e in batch)
+            return [(m, None) for m in split_string(content, splitter='\n', maxlen=self.MAX_CONTENT)]
+
+        if len(batch) == 1:
+            messages = []
+            for m in split_string(first.text, splitter='\n', maxlen=self.MAX_DESCRIPTION):
+                embed = discord.Embed(title=first.title, description=m, timestamp=first.timestamp)
+                embed.set_author(name=first.author, icon_url=first.icon_url)
+                messages.append((None, embed))
+
+            return messages
+
+        embed = discord.Embed(title=f'{len(batch)} log entries', timestamp=batch[-1].timestamp)
+        for entry in batch:
+            name = f'{entry.author}: {entry.title}'[:self.MAX_FIELD_NAME]
+            embed.add_field(name=name, value=entry.text or '\u200b', inline=False)
+
+        return [(None, embed)]
+
+    async def _run(self, queue):
+        channel = queue.channel
+        try:
+            while queue.entries:
+                batch = self._take_batch(queue.entries)
+                t = time.perf_counter()
+                try:
+                    for content, embed in self._format(batch):
+                        await channel.send(content, embed=embed)
+                        self.messages += 1
+                except (discord.Forbidden, discord.NotFound):
+                    # Channel deleted or perms removed. Nothing else will go through either
+                    self.dropped += len(batch) + len(queue.entries)
+                    queue.entries.clear()
+                    return
+                except discord.HTTPException:
+                    logger.exception(f'Failed to post log entries to {channel.id}')
+                    self.failed += len(batch)
+
+                self.send_latency.add(time.perf_counter() - t)
+
+                # Give other entries time to arrive so they can be merged
+                await asyncio.sleep(self.window)
+        finally:
+            queue.task = None
+            if not queue.entries:
+                self._queues.pop(channel.id, None)
+
+    def close(self):
+        """Cancel posting. Entries still in the queues are dropped"""
+        for queue in list(self._queues.values()):
+            self.dropped += len(queue.entries)
+            queue.entries.clear()
+            if queue.task is not None:
+                queue.task.cancel()
+
+        self._queues.clear()
+
+    def format_stats(self):
+        latency = self.send_latency
+        return (f'{self.depth} entries queued in {len(self._queues)} channels (max {self.max_depth} in one channel). '
+                f'{self.entries} entries added and {self.messages} messages sent. '
+                f'{self.dropped} dropped, {self.failed} failed\n'
+                f'Send latency p50 {format_ms(latency.percentile(50))} '
+                f'p99 {format_ms(latency.percentile(99))} max {format_ms(latency.max)}')
@@ -0,0 +1,369 @@
+"""
+In memory database backend used for tests and benchmarks.
+Enabled with Backend = memory in the Database section of the config.
+
+MemoryPool stands in for the asyncpg pool. Its connections accept every
+query without running it so code that uses the pool directly keeps
+working. MemoryDatabaseUtils implements the domain helpers of
+DatabaseUtils on top of python data structures so they return what was
+written to them. Query methods still go through QueryStats which makes
+it easy to see how many queries a command makes without the database
+latency.
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+from bot.dbutil import DatabaseUtils
+
+logger = logging.getLogger('terminal')
+
+
+class MemoryRecord(dict):
+    """dict that can also be indexed by column position like asyncpg.Record"""
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+
+        return super().__getitem__(key)
+
+
+class MemoryTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class MemoryConnection:
+    """Connection that accepts every query and returns no rows"""
+    def __init__(self, delay=0):
+        # Simulated round trip time in seconds
+        self.delay = delay
+        self.queries = 0
+
+    async def _query(self):
+        self.queries += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            # Still give other tasks a chance to run like a real query would
+            await asyncio.sleep(0)
+
+    async def fetch(self, sql, *args, timeout=None):
+        await self._query()
+        return []
+
+    async def fetchrow(self, sql, *args, timeout=None):
+        await self._query()
+
+    async def fetchval(self, sql, *args, timeout=None):
+        await self._query()
+
+    async def execute(self, sql, *args, timeout=None):
+        await self._query()
+        verb = sql.lstrip().split(' ', 1)[0].upper()
+        if verb == 'INSERT':
+            return 'INSERT 0 0'
+        return f'{verb} 0'
+
+    async def executemany(self, sql, args, timeout=None):
+        await self._query()
+
+    async def copy_records_to_table(self, table, *, records, columns=None, timeout=None):
+        await self._query()
+        return f'COPY {len(records)}'
+
+    def transaction(self):
+        return MemoryTransaction()
+
+    async def add_listener(self, channel, callback):
+        pass
+
+    async def remove_listener(self, channel, callback):
+        pass
+
+    def is_closed(self):
+        return False
+
+
+class _MemoryAcquire:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def __await__(self):
+        return self._pool._acquire().__await__()
+
+    async def __aenter__(self):
+        self._conn = await self._pool._acquire()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._pool.release(self._conn)
+
+
+class MemoryPool:
+    """Stand-in for asyncpg.Pool with max_size connections"""
+    def __init__(self, max_size=20, delay=0):
+        self._max_size = max_size
+        self._delay = delay
+        self._free = None
+
+    async def _acquire(self):
+        # Created here so the queue belongs to the running loop
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for _ in range(self._max_size):
+                self._free.put_nowait(MemoryConnection(self._delay))
+
+        return await self._free.get()
+
+    def acquire(self):
+        return _MemoryAcquire(self)
+
+    async def release(self, conn):
+        self._free.put_nowait(conn)
+
+    def get_size(self):
+        return self._max_size
+
+    async def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+
+class MemoryDatabaseUtils(DatabaseUtils):
+    # Key columns of tables written with bulk_upsert when no conflict target is given
+    PRIMARY_KEYS = {
+        'guilds': ('guild',),
+        'prefixes': ('guild', 'prefix'),
+        'roles': ('id',),
+        'users': ('id',),
+        'userroles': ('uid', 'role'),
+        'join_dates': ('uid', 'guild'),
+        'last_seen_users': ('uid', 'guild'),
+        'messages': ('message_id',),
+        'attachments': ('channel',),
+    }
+    # Column defaults of the tables that are written without them
+    COLUMN_DEFAULTS = {
+        'prefixes': {'prefix': '!'},
+    }
+
+    def __init__(self, bot, max_command_uses=100000):
+        super().__init__(bot)
+        # table name -> {key tuple: row dict}
+        self.tables = {}
+        # (parent, cmd) -> uses
+        self.command_stats = {}
+        # (cmd, used_at, uid, guild)
+        self.command_usage = deque(maxlen=max_command_uses)
+        self.banned_guilds = set()
+        # (guild, user) -> {role: expires_at}
+        self._temproles = {}
+        # user -> last_use
+        self._role_times = {}
+        self._timezones = {}
+        self._last_banners = {}
+        self._event_points = {}
+
+    def get_table(self, table):
+        rows = self.tables.get(table)
+        if rows is None:
+            rows = {}
+            self.tables[table] = rows
+
+        return rows
+
+    async def bulk_upsert(self, table, columns, records, conflict=None, update=None,
+                          conn=None, timeout=None, priority=None):
+        records = list(records)
+        if update and not conflict:
+            raise ValueError('Conflict target is required when updating')
+
+        rows = self.get_table(table)
+        key_columns = conflict or self.PRIMARY_KEYS.get(table) or columns
+        defaults = self.COLUMN_DEFAULTS.get(table, {})
+        for record in records:
+            row = {**defaults, **dict(zip(columns, record))}
+            key = tuple(row[c] for c in key_columns)
+            old = rows.get(key)
+            if old is None:
+                rows[key] = row
+            elif update:
+                for c in update:
+                    old[c] = row[c]
+
+        return len(records)
+
+    async def index_guild_member_roles(self, guild):
+        # Members aren't chunked as this backend is used without a gateway connection
+        if not await self.index_guild_roles(guild):
+            return False
+
+        self._delete_guild_user_roles(guild.id, {m.id for m in guild.members})
+        default_role = guild.default_role.id
+        await self.bulk_upsert('userroles', ('uid', 'role'),
+                               ((m.id, r.id) for m in guild.members for r in m.roles if r.id != default_role))
+        return True
+
+    async def index_guilds_roles(self, guilds):
+        roles = self.get_table('roles')
+        guild_ids = {g.id for g in guilds}
+        role_ids = {r.id for g in guilds for r in g.roles}
+        for key in [k for k, r in roles.items() if r['guild'] in guild_ids and r['id'] not in role_ids]:
+            del roles[key]
+
+        await self.bulk_upsert('roles', ('id', 'guild'), ((r.id, g.id) for g in guilds for r in g.roles))
+        return True
+
+    def _delete_guild_user_roles(self, guild_id, user_ids):
+        roles = self.get_table('roles')
+        userroles = self.get_table('userroles')
+        for key in [k for k, r in userroles.items()
+                    if r['uid'] in user_ids and roles.get((r['role'],), {}).get('guild') == guild_id]:
+            del userroles[key]
+
+    async def remove_user_roles(self, role_ids, user_id: int):
+        userroles = self.get_table('userroles')
+        for role_id in role_ids:
+            userroles.pop((user_id, role_id), None)
+
+        return True
+
+    async def delete_user_roles(self, guild_id: int, user_id: int):
+        self._delete_guild_user_roles(guild_id, {user_id})
+
+    async def delete_role(self, role_id: int, guild_id: int):
+        self.get_table('roles').pop((role_id,), None)
+        userroles = self.get_table('userroles')
+        for key in [k for k in userroles if k[1] == role_id]:
+            del userroles[key]
+
+    async def add_command(self, parent, name=""):
+        self.command_stats.setdefault((parent, name), 0)
+        return True
+
+    async def add_commands(self, values):
+        for parent, name in values:
+            self.command_stats.setdefault((parent, name), 0)
+        return True
+
+    async def record_command_uses(self, uses, conn=None):
+        for parent, name, used_at, user_id, guild in uses:
+            name = name or ""
+            key = (parent, name)
+            self.command_stats[key] = self.command_stats.get(key, 0) + 1
+            cmd = parent + ' ' + name if name else parent
+            self.command_usage.append((cmd, used_at, user_id, guild))
+
+    async def get_command_stats(self, parent=None, name=""):
+        rows = [MemoryRecord(parent=p, cmd=c, uses=uses) for (p, c), uses in self.command_stats.items()
+                if not parent or (p, c) == (parent, name)]
+        rows.sort(key=lambda r: r['uses'], reverse=True)
+        return rows
+
+    async def get_command_activity(self, names, after, user=None, guild=None, limit: int=None):
+        counts = {}
+        for cmd, used_at, uid, guild_id in self.command_usage:
+            if used_at <= after or (names and cmd not in names):
+                continue
+            if (user and uid != user) or (guild and guild_id != guild):
+                continue
+
+            counts[cmd] = counts.get(cmd, 0) + 1
+
+        rows = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)
+        if limit:
+            rows = rows[:limit]
+
+        return [MemoryRecord(count=count, cmd=cmd) for cmd, count in rows]
+
+    async def botban(self, user_id: int, reason):
+        botbans = getattr(self.bot, 'botbans', None)
+        if botbans is not None:
+            botbans.add(user_id)
+
+    async def botunban(self, user_id: int):
+        botbans = getattr(self.bot, 'botbans', None)
+        if botbans is not None:
+            botbans.remove(user_id)
+
+    async def blacklist_guild(self, guild_id: int, reason):
+        self.banned_guilds.add(guild_id)
+
+    async def unblacklist_guild(self, guild_id: int):
+        self.banned_guilds.discard(guild_id)
+
+    async def is_guild_blacklisted(self, guild_id: int):
+        return guild_id in self.banned_guilds
+
+    async def get_blacklisted_guilds(self):
+        return [MemoryRecord(guild=g) for g in self.banned_guilds]
+
+    async def add_temprole(self, user, role, guild, expires_at):
+        self._temproles.setdefault((guild, user), {})[role] = expires_at
+
+    async def remove_temprole(self, user: int, role: int):
+        for (_, uid), roles in self._temproles.items():
+            if uid == user:
+                roles.pop(role, None)
+
+    async def get_temproles(self, guild: int, user: int):
+        roles = self._temproles.get((guild, user), {})
+        return tuple(MemoryRecord(uid=user, role=role, guild=guild, expires_at=expires_at)
+                     for role, expires_at in roles.items())
+
+    async def get_join_date(self, uid: int, guild_id: int):
+        row = self.get_table('join_dates').get((uid, guild_id))
+        return row['first_join'] if row else None
+
+    async def get_last_role_time(self, user: int):
+        last_use = self._role_times.get(user)
+        return MemoryRecord(last_use=last_use) if last_use else None
+
+    async def update_last_role_time(self, user: int, last_use):
+        self._role_times[user] = last_use
+
+    async def reduce_role_cooldown(self, user: int, amount):
+        if user in self._role_times:
+            self._role_times[user] -= amount
+
+    async def get_timezone(self, user_id: int):
+        return self._timezones.get(user_id)
+
+    async def set_timezone(self, user_id: int, timezone):
+        self._timezones[user_id] = timezone
+        return True
+
+    async def last_banner(self, guild_id: int):
+        return MemoryRecord(last_banner=self._last_banners.get(guild_id))
+
+    async def set_last_banner(self, guild_id: int, banner):
+        self._last_banners[guild_id] = banner
+        return 'UPDATE 1'
+
+    async def get_event_points(self, user_id: int) -> int:
+        return self._event_points.get(user_id, 0)
+
+    async def update_event_points(self, user_id: int, points: int):
+        if user_id in self._event_points:
+            self._event_points[user_id] += points
+
+    async def add_event_users(self, users):
+        for uid in users:
+            self._event_points.setdefault(uid, 0)
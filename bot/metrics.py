@@ -0,0 +1,449 @@
+import functools
+import logging
+import re
+import sys
+import time
+import types
+
+logger = logging.getLogger('terminal')
+
+
+class Histogram:
+    """
+    Latency histogram with exponentially growing buckets.
+    Values are in seconds. Percentiles are estimated from the upper
+    bounds of the buckets
+    """
+    # 0.1ms to ~105s
+    BOUNDS = tuple(0.0001 * 2 ** i for i in range(21))
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        # Last bucket is for values over the biggest bound
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+        for idx, bound in enumerate(self.BOUNDS):
+            if value <= bound:
+                self.buckets[idx] += 1
+                return
+
+        self.buckets[-1] += 1
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+
+        return self.total / self.count
+
+    def percentile(self, p):
+        """
+        Args:
+            p: Percentile from 0 to 100
+
+        Returns:
+            Upper bound of the bucket the percentile falls in
+        """
+        if not self.count:
+            return 0.0
+
+        target = self.count * p / 100
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                if idx >= len(self.BOUNDS):
+                    return self.max
+
+                return min(self.BOUNDS[idx], self.max)
+
+        return self.max
+
+    def format(self, width=30):
+        """Text representation of the histogram with one row per non empty bucket"""
+        most = max(self.buckets) or 1
+        lines = []
+        for idx, n in enumerate(self.buckets):
+            if not n:
+                continue
+
+            if idx < len(self.BOUNDS):
+                label = '<= ' + format_ms(self.BOUNDS[idx])
+            else:
+                label = '>  ' + format_ms(self.BOUNDS[-1])
+
+            bar = '#' * max(1, round(n / most * width))
+            lines.append(f'{label:>12} {n:>7} {bar}')
+
+        return '\n'.join(lines)
+
+
+def format_ms(seconds):
+    ms = seconds * 1000
+    if ms < 10:
+        return f'{ms:.1f}ms'
+    return f'{ms:.0f}ms'
+
+
+@types.coroutine
+def _measure_busy(coro, timer):
+    """
+    Drives the given coroutine and adds the time spent running it
+    on the event loop to timer[0]. Time spent suspended is not counted
+    """
+    it = coro.__await__()
+    value = None
+    exc = None
+    while True:
+        t = time.perf_counter()
+        try:
+            if exc is not None:
+                yielded = it.throw(exc)
+            else:
+                yielded = it.send(value)
+        except StopIteration as e:
+            timer[0] += time.perf_counter() - t
+            return e.value
+        except BaseException:
+            timer[0] += time.perf_counter() - t
+            raise
+
+        timer[0] += time.perf_counter() - t
+
+        try:
+            value = yield yielded
+            exc = None
+        except BaseException as e:  # skipcq: PYL-W0703
+            value = None
+            exc = e
+
+
+class ListenerEntry:
+    __slots__ = ('wall', 'awaiting', 'exceptions')
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.awaiting = Histogram()
+        self.exceptions = 0
+
+
+class ListenerStats:
+    """
+    Collects latency statistics of event listeners per owner (cog) and event.
+    Listeners are wrapped in Bot._schedule_event when stats are enabled
+    """
+    def __init__(self):
+        self.entries = {}
+        self.started_at = time.time()
+
+    def reset(self):
+        self.entries = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def owner_name(func):
+        owner = getattr(func, '__self__', None)
+        if owner is None:
+            return getattr(func, '__module__', None) or 'unknown'
+
+        return getattr(owner, 'qualified_name', None) or type(owner).__name__
+
+    def get_entry(self, owner, event_name):
+        key = (owner, event_name)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = ListenerEntry()
+            self.entries[key] = entry
+
+        return entry
+
+    def wrap(self, coro, event_name):
+        """
+        Wraps an event coroutine function so its wall time, time spent
+        awaiting and exceptions are recorded
+        """
+        entry = self.get_entry(self.owner_name(coro), event_name)
+
+        @functools.wraps(coro)
+        async def wrapped(*args, **kwargs):
+            timer = [0.0]
+            t = time.perf_counter()
+            try:
+                return await _measure_busy(coro(*args, **kwargs), timer)
+            except Exception:
+                entry.exceptions += 1
+                raise
+            finally:
+                wall = time.perf_counter() - t
+                entry.wall.add(wall)
+                entry.awaiting.add(max(0.0, wall - timer[0]))
+
+        return wrapped
+
+    def format_table(self, event_name=None):
+        """
+        Percentile table of all listeners sorted by total wall time
+
+        Args:
+            event_name: If given only include listeners of this event
+        """
+        rows = []
+        for (owner, event), entry in sorted(self.entries.items(), key=lambda kv: kv[1].wall.total, reverse=True):
+            if event_name and event != event_name:
+                continue
+
+            wall = entry.wall
+            rows.append(f'{owner[:18]:<18} {event[:18]:<18} {wall.count:>8} '
+                        f'{format_ms(wall.percentile(50)):>8} {format_ms(wall.percentile(95)):>8} '
+                        f'{format_ms(wall.percentile(99)):>8} {format_ms(entry.awaiting.mean):>8} '
+                        f'{entry.exceptions:>5}')
+
+        header = f'{"listener":<18} {"event":<18} {"calls":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"await":>8} {"exc":>5}'
+        return '\n'.join([header, *rows])
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_BIND = re.compile(r'\$\d+')
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_LISTS = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """
+    Normalize sql so queries that only differ by their values are grouped together.
+    Literals and binds are replaced with ? and lists of them with (?+)
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _BIND.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(?+)', sql)
+    sql = _LISTS.sub('(?+)...', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+# Files that are skipped when looking for the code that made a query
+_INTERNAL_FILES = ('dbutil.py', 'metrics.py', 'pool_manager.py', 'contextlib.py', 'asyncio', 'asyncpg')
+
+
+def call_site(skip=2):
+    """
+    Returns (module, "module:line function") of the first frame
+    outside of the database utilities. Awaiting coroutines are part
+    of the stack so this finds the cog that made the query
+    """
+    frame = sys._getframe(skip)  # skipcq: PYL-W0212
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not any(f in filename for f in _INTERNAL_FILES):
+            module = frame.f_globals.get('__name__', '?')
+            return module, f'{module}:{frame.f_lineno} {frame.f_code.co_name}'
+
+        frame = frame.f_back
+
+    return '?', '?'
+
+
+class QueryEntry:
+    __slots__ = ('latency', 'rows', 'errors', 'callers')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+        # call site -> amount of queries
+        self.callers = {}
+
+
+class ConnectionEntry:
+    __slots__ = ('wait', 'held')
+
+    def __init__(self):
+        self.wait = Histogram()
+        self.held = Histogram()
+
+
+class _QueryTimer:
+    __slots__ = ('_stats', '_sql', '_t', 'rows', 'elapsed')
+
+    def __init__(self, stats, sql):
+        self._stats = stats
+        self._sql = sql
+        self._t = 0.0
+        self.rows = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = time.perf_counter() - self._t
+        self._stats.record(self._sql, self.elapsed, self.rows, error=exc_type is not None)
+
+
+class _TimedAcquire:
+    """Acquires a connection from the pool recording the wait and hold times per module"""
+    __slots__ = ('_stats', '_pool', '_conn', '_entry', '_t')
+
+    def __init__(self, stats, pool):
+        self._stats = stats
+        self._pool = pool
+        self._conn = None
+        self._entry = None
+        self._t = 0.0
+
+    async def __aenter__(self):
+        module, _ = call_site()
+        self._entry = self._stats.get_connection_entry(module)
+        t = time.perf_counter()
+        self._conn = await self._pool.acquire()
+        self._t = time.perf_counter()
+        wait = self._t - t
+        self._entry.wait.add(wait)
+        self._stats.acquire_wait.add(wait)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._entry.held.add(time.perf_counter() - self._t)
+        conn = self._conn
+        self._conn = None
+        await self._pool.release(conn)
+
+
+class QueryStats:
+    """
+    Latency statistics of database queries grouped by their fingerprint
+    and connection pool statistics grouped by the module that acquired
+    the connection. Queries slower than slow_threshold seconds are logged
+    with the place they were made from
+    """
+    def __init__(self, slow_threshold=0.5):
+        self.slow_threshold = slow_threshold
+        self.entries = {}
+        self.connections = {}
+        self.acquire_wait = Histogram()
+        self.started_at = time.time()
+
+    def reset(self):
+        self.entries = {}
+        self.connections = {}
+        self.acquire_wait = Histogram()
+        self.started_at = time.time()
+
+    def measure(self, sql):
+        """
+        Context manager that records the time of the query run inside it.
+        Set the rows attribute of the returned object to record rows returned
+        """
+        return _QueryTimer(self, sql)
+
+    def acquire(self, pool):
+        return _TimedAcquire(self, pool)
+
+    def get_connection_entry(self, module):
+        entry = self.connections.get(module)
+        if entry is None:
+            entry = ConnectionEntry()
+            self.connections[module] = entry
+
+        return entry
+
+    def record(self, sql, duration, rows=None, error=False):
+        fp = fingerprint(sql)
+        entry = self.entries.get(fp)
+        if entry is None:
+            entry = QueryEntry()
+            self.entries[fp] = entry
+
+        entry.latency.add(duration)
+        if rows:
+            entry.rows += rows
+        if error:
+            entry.errors += 1
+
+        _, site = call_site()
+        entry.callers[site] = entry.callers.get(site, 0) + 1
+
+        if duration >= self.slow_threshold:
+            logger.warning(f'Slow query {format_ms(duration)} from {site}: {fp[:500]}')
+
+    SORT_KEYS = {
+        'total': lambda e: e.latency.total,
+        'count': lambda e: e.latency.count,
+        'p99': lambda e: e.latency.percentile(99),
+        'rows': lambda e: e.rows
+    }
+
+    def sorted_entries(self, sort='total'):
+        """
+        Args:
+            sort: One of total, count, p99 or rows
+
+        Returns:
+            List of (fingerprint, QueryEntry) tuples in descending order
+        """
+        key = self.SORT_KEYS.get(sort, self.SORT_KEYS['total'])
+        return sorted(self.entries.items(), key=lambda kv: key(kv[1]), reverse=True)
+
+    def format_table(self, sort='total', limit=20):
+        """
+        Args:
+            sort: One of total, count, p99 or rows
+            limit: Amount of fingerprints shown
+        """
+        rows = []
+        for idx, (fp, entry) in enumerate(self.sorted_entries(sort)[:limit]):
+            lat = entry.latency
+            rows.append(f'{idx:>2} {lat.count:>8} {lat.total:>8.1f}s {format_ms(lat.percentile(50)):>8} '
+                        f'{format_ms(lat.percentile(95)):>8} {format_ms(lat.percentile(99)):>8} '
+                        f'{entry.rows:>9} {entry.errors:>4}\n   {fp[:150]}')
+
+        header = f'{"#":>2} {"calls":>8} {"total":>9} {"p50":>8} {"p95":>8} {"p99":>8} {"rows":>9} {"err":>4}'
+        return '\n'.join([header, *rows])
+
+    def format_connections(self):
+        """Connection wait and hold times per module sorted by total time held"""
+        rows = []
+        for module, entry in sorted(self.connections.items(), key=lambda kv: kv[1].held.total, reverse=True):
+            rows.append(f'{module[:24]:<24} {entry.held.count:>8} {entry.held.total:>8.1f}s '
+                        f'{format_ms(entry.held.percentile(99)):>8} {format_ms(entry.wait.percentile(50)):>8} '
+                        f'{format_ms(entry.wait.percentile(99)):>8}')
+
+        wait = self.acquire_wait
+        header = (f'Pool acquire wait p50 {format_ms(wait.percentile(50))} p99 {format_ms(wait.percentile(99))} '
+                  f'max {format_ms(wait.max)}\n'
+                  f'{"module":<24} {"acquires":>8} {"held":>9} {"held p99":>8} {"wait p50":>8} {"wait p99":>8}')
+        return '\n'.join([header, *rows])
+
+    def to_dict(self):
+        """All collected stats as a json serializable dict"""
+        def hist(h):
+            return {'count': h.count, 'total': h.total, 'max': h.max,
+                    'p50': h.percentile(50), 'p95': h.percentile(95), 'p99': h.percentile(99)}
+
+        return {
+            'started_at': self.started_at,
+            'acquire_wait': hist(self.acquire_wait),
+            'queries': [
+                {'fingerprint': fp, 'latency': hist(e.latency), 'rows': e.rows,
+                 'errors': e.errors, 'callers': e.callers}
+                for fp, e in sorted(self.entries.items(), key=lambda kv: kv[1].latency.total, reverse=True)
+            ],
+            'connections': {
+                module: {'wait': hist(e.wait), 'held': hist(e.held)}
+                for module, e in self.connections.items()
+            }
+        }
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import re
+from datetime import datetime
+
+from asyncpg.exceptions import PostgresError, InterfaceError
+
+from bot.pool_manager import BACKGROUND
+
+logger = logging.getLogger('terminal')
+
+DISCORD_EPOCH = 1420070400000
+PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def month_start(dt, offset=0):
+    """First moment of the month dt is in shifted by offset months"""
+    month = dt.year * 12 + dt.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def snowflake_from_datetime(dt):
+    """Smallest snowflake that could have been created at the given naive utc datetime"""
+    ms = int((dt - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return max(ms - DISCORD_EPOCH, 0) << 22
+
+
+class PartitionManager:
+    """
+    Maintains the monthly range partitions of messages and command_usage.
+
+    messages is partitioned by message_id. Snowflakes contain their creation
+    time so the partition bounds are the smallest snowflakes of each month.
+    command_usage is partitioned by used_at. Partitions are named
+    {table}_yYYYYmMM.
+
+    Partitions are created premake months in advance. Both tables also have
+    a {table}_default partition that catches rows outside the monthly
+    partitions, e.g. when the bot hasn't created them yet. Rows in the
+    default partition are moved when the partition of their month is
+    created. Partitions whose month ended over retention months ago are
+    detached and dropped. A retention of 0 keeps everything.
+    """
+    # table name -> (partition column, function that converts a month start to a partition bound)
+    TABLES = {
+        'messages': ('message_id', snowflake_from_datetime),
+        'command_usage': ('used_at', lambda dt: dt)
+    }
+
+    def __init__(self, bot, retention, drop_expired=True, premake=2, interval=3600*6):
+        """
+        Args:
+            retention: dict of table name -> months of data to keep
+            drop_expired: When False expired partitions are only detached
+                          so they can be archived manually
+        """
+        self._bot = bot
+        self.retention = retention
+        self.drop_expired = drop_expired
+        self.premake = premake
+        self.interval = interval
+        self._task = None
+
+    @property
+    def bot(self):
+        return self._bot
+
+    @staticmethod
+    def partition_name(table, month):
+        return f'{table}_y{month.year:04}m{month.month:02}'
+
+    async def get_partitions(self, table):
+        """Returns a dict of partition name -> month start for the given table"""
+        sql = 'SELECT c.relname FROM pg_inherits i ' \
+              'INNER JOIN pg_class c ON c.oid=i.inhrelid ' \
+              'INNER JOIN pg_class p ON p.oid=i.inhparent ' \
+              'WHERE p.relname=$1'
+
+        partitions = {}
+        for row in await self.bot.dbutil.fetch(sql, (table,), priority=BACKGROUND):
+            m = PARTITION_NAME.search(row['relname'])
+            if not m:
+                continue
+
+            partitions[row['relname']] = datetime(int(m.group(1)), int(m.group(2)), 1)
+
+        return partitions
+
+    async def get_default_partition(self, table):
+        """Name of the default partition of the table or None if it doesn't have one"""
+        sql = 'SELECT c.relname FROM pg_partitioned_table pt ' \
+              'INNER JOIN pg_class p ON p.oid=pt.partrelid ' \
+              'INNER JOIN pg_class c ON c.oid=pt.partdefid ' \
+              'WHERE p.relname=$1'
+
+        return await self.bot.dbutil.fetchval(sql, (table,), priority=BACKGROUND)
+
+    async def create_partitions(self, table, now=None):
+        """Create partitions from the current month to premake months ahead"""
+        now = now or datetime.utcnow()
+        column, to_bound = self.TABLES[table]
+        existing = await self.get_partitions(table)
+        default = await self.get_default_partition(table)
+        created = []
+
+        for offset in range(self.premake + 1):
+            month = month_start(now, offset)
+            name = self.partition_name(table, month)
+            if name in existing:
+                continue
+
+            start = to_bound(month)
+            end = to_bound(month_start(now, offset + 1))
+            # Partition bounds can't be given as query parameters
+            sql = f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+            in_range = f"{column} >= '{start}' AND {column} < '{end}'"
+            if default and await self.bot.dbutil.fetchval(f'SELECT EXISTS(SELECT 1 FROM {default} WHERE {in_range})',
+                                                          priority=BACKGROUND):
+                # The partition can't be created while the default partition has rows
+                # that belong to it so they are moved to the new partition
+                await self.bot.dbutil.execute_chunked([
+                    f'ALTER TABLE {table} DETACH PARTITION {default}',
+                    sql,
+                    f'WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *) '
+                    f'INSERT INTO {table} SELECT * FROM moved',
+                    f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT'
+                ], priority=BACKGROUND)
+                logger.info(f'Moved rows from {default} to {name}')
+            else:
+                await self.bot.dbutil.execute(sql, priority=BACKGROUND)
+            created.append(name)
+
+        if created:
+            logger.info(f'Created partitions {", ".join(created)}')
+
+        return created
+
+    async def remove_expired(self, table, now=None):
+        """Detach and optionally drop partitions older than the retention of the table"""
+        months = self.retention.get(table)
+        if not months:
+            return []
+
+        now = now or datetime.utcnow()
+        # Partitions of months starting before this are completely expired
+        cutoff = month_start(now, -months)
+        removed = []
+
+        for name, month in sorted((await self.get_partitions(table)).items(), key=lambda p: p[1]):
+            if month >= cutoff:
+                continue
+
+            await self.bot.dbutil.execute(f'ALTER TABLE {table} DETACH PARTITION {name}', priority=BACKGROUND)
+            if self.drop_expired:
+                await self.bot.dbutil.execute(f'DROP TABLE {name}', priority=BACKGROUND)
+            removed.append(name)
+
+        if removed:
+            action = 'Dropped' if self.drop_expired else 'Detached'
+            logger.info(f'{action} expired partitions {", ".join(removed)}')
+
+        return removed
+
+    async def maintain(self):
+        for table in self.TABLES:
+            try:
+                await self.create_partitions(table)
+                await self.remove_expired(table)
+            except (PostgresError, InterfaceError, OSError):
+                logger.exception(f'Failed to maintain partitions of {table}')
+
+    async def _maintain_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.maintain()
+
+    def start(self):
+        """Run maintain every interval seconds. The first run happens after one interval"""
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._maintain_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
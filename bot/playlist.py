@@ -284,8 +284,8 @@ class Playlist:
 
         while True:
             try:
-                result = await self.bot.wait_for('reaction_changed', check=check,
-                                                 timeout=60)
+                result = await self.bot.wait_for_reaction(message.id, check=check,
+                                                          timeout=60)
             except asyncio.TimeoutError:
                 return await ctx.send('Took too long.')
 
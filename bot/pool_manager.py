@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from bot.metrics import Histogram, format_ms
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class _LaneAcquire:
+    __slots__ = ('_manager', '_lane', '_semaphore', '_inner')
+
+    def __init__(self, manager, lane):
+        self._manager = manager
+        self._lane = lane
+        self._semaphore = manager.get_semaphore(lane)
+        self._inner = None
+
+    async def __aenter__(self):
+        manager = self._manager
+        t = time.perf_counter()
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+
+        try:
+            self._inner = manager.bot.query_stats.acquire(manager.bot.pool)
+            conn = await self._inner.__aenter__()
+        except BaseException:
+            if self._semaphore is not None:
+                self._semaphore.release()
+            raise
+
+        manager.wait[self._lane].add(time.perf_counter() - t)
+        manager.active[self._lane] += 1
+        return conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        manager = self._manager
+        manager.active[self._lane] -= 1
+        try:
+            await self._inner.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+class PoolManager:
+    """
+    Splits the connection pool into an interactive and a background lane.
+
+    Interactive work (commands, event handlers) can use the whole pool.
+    Background work (reindexing, batched writes, periodic loads) can only
+    hold background_limit connections at once so the rest of the pool is
+    always reserved for interactive work. Wait times include the time
+    spent waiting for a free slot in the lane.
+    """
+    def __init__(self, bot, background_limit=6):
+        self._bot = bot
+        self.limits = {INTERACTIVE: None, BACKGROUND: background_limit}
+        # Created on first acquire so they are bound to the running loop
+        self._semaphores = {}
+        self.wait = {lane: Histogram() for lane in self.limits}
+        self.active = {lane: 0 for lane in self.limits}
+
+    @property
+    def bot(self):
+        return self._bot
+
+    def get_semaphore(self, lane):
+        limit = self.limits[lane]
+        if limit is None:
+            return None
+
+        semaphore = self._semaphores.get(lane)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[lane] = semaphore
+
+        return semaphore
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        Acquire a connection from the given lane
+
+        Args:
+            priority: INTERACTIVE or BACKGROUND
+        """
+        return _LaneAcquire(self, priority)
+
+    def reset(self):
+        self.wait = {lane: Histogram() for lane in self.limits}
+
+    def format_stats(self):
+        lines = [f'{"lane":<12} {"limit":>5} {"active":>6} {"acquires":>8} {"wait p50":>8} {"wait p99":>8} {"max":>8}']
+        for lane, wait in self.wait.items():
+            limit = self.limits[lane] or '-'
+            lines.append(f'{lane:<12} {limit:>5} {self.active[lane]:>6} {wait.count:>8} '
+                         f'{format_ms(wait.percentile(50)):>8} {format_ms(wait.percentile(99)):>8} '
+                         f'{format_ms(wait.max):>8}')
+
+        return '\n'.join(lines)
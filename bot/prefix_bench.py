@@ -0,0 +1,105 @@
+"""
+Prefix matching benchmark. Run with test_run.py --bench prefix [guilds]
+
+Compares BotBase.match_prefix to the path every message took before
+the precompiled matchers: get_command_prefix built a tuple of every
+prefix and discord.py created a StringView and a Context before checking
+the prefixes with startswith. Doesn't need discord or the database.
+"""
+
+import random
+import time
+
+from discord.ext.commands import Context
+from discord.ext.commands.view import StringView
+
+from bot.botbase import BotBase
+from bot.guildcache import GuildCache
+
+_CHAT = ('lol', 'good morning', 'anyone here?', 'https://example.com/some/page',
+         'did you see the new update', '!!!', '?', 'pls no', '$5 is a lot')
+_COMMANDS = ('ping', 'help', 'userinfo', 'avatar', 'color red')
+_CUSTOM_PREFIXES = ({'?'}, {'!', '?'}, {'pls '}, {'$', '!', 'b!'}, {'!', '!!'})
+
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Bot:
+    default_prefix = '!'
+
+    def __init__(self, guilds, rng):
+        self.guild_cache = GuildCache(self)
+        self._mention_prefix = ('<@123456789012345678> ', '<@!123456789012345678> ')
+        for guild_id in range(guilds):
+            if rng.random() < 0.1:
+                self.guild_cache.update_cached_guild(guild_id, prefixes=rng.choice(_CUSTOM_PREFIXES))
+
+    def old_prefixes(self, message):
+        # get_command_prefix before the matchers
+        guild = message.guild
+        if not guild:
+            return (*self._mention_prefix, self.default_prefix)
+
+        return (*self.guild_cache.prefixes(message.guild.id), *self._mention_prefix)
+
+
+def _messages(rng, bot, guilds, count, command_ratio):
+    author = _Obj(id=1)
+    messages = []
+    for _ in range(count):
+        guild_id = rng.randrange(guilds)
+        if rng.random() < command_ratio:
+            prefix = rng.choice(bot.guild_cache.prefixes(guild_id))
+            content = prefix + rng.choice(_COMMANDS)
+        else:
+            content = rng.choice(_CHAT)
+
+        messages.append(_Obj(content=content, guild=_Obj(id=guild_id), author=author, _state=None))
+
+    return messages
+
+
+def _old_path(bot, message):
+    # Same steps as commands.Bot.get_context took for every message
+    view = StringView(message.content)
+    ctx = Context(prefix=None, view=view, bot=bot, message=message)
+    prefixes = bot.old_prefixes(message)
+    if message.content.startswith(prefixes):
+        ctx.prefix = next(p for p in prefixes if view.skip_string(p))
+    return ctx.prefix
+
+
+def _time_ns(func, bot, messages):
+    t = time.perf_counter()
+    for message in messages:
+        func(bot, message)
+    return (time.perf_counter() - t) / len(messages) * 1e9
+
+
+def run(guilds=1000, messages=200000, seed=0):
+    """
+    Returns:
+        The report as a string
+    """
+    rng = random.Random(seed)
+    bot = _Bot(guilds, rng)
+    lines = [f'{guilds} guilds (10% with custom prefixes)',
+             f'{"messages":<16} {"before":>8} {"matcher":>8}']
+
+    for name, ratio in (('chat', 0), ('commands', 1), ('2% commands', 0.02)):
+        batch = _messages(rng, bot, guilds, messages, ratio)
+        for message in batch[:100]:
+            assert BotBase.match_prefix(bot, message) == _old_path(bot, message)
+
+        old = _time_ns(_old_path, bot, batch)
+        new = _time_ns(BotBase.match_prefix, bot, batch)
+        lines.append(f'{name:<16} {old:>6.0f}ns {new:>6.0f}ns')
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,113 @@
+"""
+Reaction waiter benchmark. Run with test_run.py --bench reactions [paginators]
+
+Starts paginators that wait for reactions to their own message with
+Bot.wait_for_reaction and, for comparison, with wait_for('reaction_changed')
+which checked every waiter on every reaction before waiters were indexed
+by message id. Then times Bot.handle_reaction_changed for reactions that
+don't complete any waiter. Doesn't need discord or the database.
+"""
+
+import asyncio
+import random
+import time
+
+import discord
+
+from bot.bot import Bot
+
+_EMOJIS = ('◀', '▶', '⏪', '⏩', '✅')
+
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Bot:
+    """The parts of Bot used by the reaction waiters"""
+    wait_for = discord.Client.wait_for
+    wait_for_reaction = Bot.wait_for_reaction
+    handle_reaction_changed = Bot.handle_reaction_changed
+    _handle_message_reaction_waiters = Bot._handle_message_reaction_waiters
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._listeners = {}
+        self._reaction_waiters = {}
+
+
+def _paginator_check(message_id, user_id):
+    # Same kind of check as send_paged_message uses
+    def check(reaction, user):
+        return reaction.message.id == message_id and user.id == user_id and reaction.emoji in _EMOJIS
+
+    return check
+
+
+def _reactions(rng, paginators, count, paginated_ratio):
+    reactions = []
+    for _ in range(count):
+        if rng.random() < paginated_ratio:
+            message_id = rng.randrange(paginators)
+        else:
+            message_id = paginators + rng.randrange(100000)
+
+        # Reactions from users that don't own the paginator so no waiter completes
+        reaction = _Obj(message=_Obj(id=message_id), emoji=rng.choice(_EMOJIS))
+        reactions.append((reaction, _Obj(id=-1)))
+
+    return reactions
+
+
+async def _measure(bot, reactions):
+    t = time.perf_counter()
+    for reaction, user in reactions:
+        bot.handle_reaction_changed(reaction, user)
+    return (time.perf_counter() - t) / len(reactions) * 1e6
+
+
+async def _run(paginators, count, paginated_ratio, seed):
+    loop = asyncio.get_event_loop()
+    rng = random.Random(seed)
+    reactions = _reactions(rng, paginators, count, paginated_ratio)
+    lines = [f'{paginators} paginators waiting. {count} reactions of which '
+             f'{paginated_ratio:.0%} are to paginated messages',
+             f'{"waiters":<26} {"per reaction":>12}']
+
+    for name in ('wait_for_reaction', "wait_for('reaction_changed')"):
+        bot = _Bot(loop)
+        if name == 'wait_for_reaction':
+            tasks = [loop.create_task(bot.wait_for_reaction(i, _paginator_check(i, i)))
+                     for i in range(paginators)]
+        else:
+            tasks = [loop.create_task(bot.wait_for('reaction_changed', check=_paginator_check(i, i)))
+                     for i in range(paginators)]
+
+        # Let the waiters register themselves
+        await asyncio.sleep(0)
+        per_reaction = await _measure(bot, reactions)
+        lines.append(f'{name:<26} {per_reaction:>10.1f}us')
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return '\n'.join(lines)
+
+
+def run(paginators=1000, reactions=20000, paginated_ratio=0.1, seed=0):
+    """
+    Returns:
+        The report as a string
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_run(paginators, reactions, paginated_ratio, seed))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,374 @@
+"""
+Offline gateway replay harness used for benchmarking the bot without
+connecting to discord.
+
+Gateway events are either generated or read from a file of recorded
+payloads in the format {"t": "MESSAGE_CREATE", "d": {...}} (one per line)
+and fed to the parsers of the connection state at a controlled rate.
+HTTP requests to discord are answered locally and redis is replaced
+with an in memory stand-in. Postgres is expected to be running locally
+unless the bot is configured with Backend = memory in which case the
+results exclude database latency.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+
+import discord
+
+from bot.metrics import Histogram, format_ms
+
+logger = logging.getLogger('terminal')
+
+_CHAT_CORPUS = [
+    'lol', 'what', 'good morning', 'anyone here?', 'same', 'gg',
+    'did you see the new update', 'no way', 'that is actually so funny',
+    'brb', 'who is playing tonight', 'ok', 'i dont think so',
+    'send the link', 'https://example.com/some/page', 'billy',
+    'this channel is dead', 'haha yeah', 'can someone help me with this',
+    'its been like 3 hours', 'nice', 'why would you do that',
+]
+_COMMAND_CORPUS = ['ping', 'help', 'userinfo', 'avatar', 'color', 'seen', 'stats']
+
+
+class MemoryRedis:
+    """Minimal in memory stand-in for the aioredis methods used by the cogs"""
+    def __init__(self):
+        self._data = {}
+
+    def _expired(self, key):
+        value = self._data.get(key)
+        if value is None:
+            return True
+
+        _, expires_at = value
+        if expires_at is not None and expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return True
+
+        return False
+
+    async def get(self, key):
+        if self._expired(key):
+            return None
+
+        return self._data[key][0]
+
+    async def set(self, key, value, expire=0):
+        self._data[key] = (str(value), time.monotonic() + expire if expire else None)
+
+    async def ttl(self, key):
+        if self._expired(key):
+            return -2
+
+        expires_at = self._data[key][1]
+        if expires_at is None:
+            return -1
+
+        return int(expires_at - time.monotonic())
+
+    def close(self):
+        self._data.clear()
+
+    async def wait_closed(self):
+        return
+
+
+class EventFactory:
+    """Creates synthetic gateway payloads"""
+    def __init__(self, guilds=5, channels=5, members=200, roles=10, command_ratio=0.02,
+                 prefix='!', seed=None):
+        self._random = random.Random(seed)
+        self._ids = 10 ** 17
+        self.command_ratio = command_ratio
+        self.prefix = prefix
+        self.user = self.user_data(bot=True)
+        self.guilds = [self.guild_data(channels, members, roles) for _ in range(guilds)]
+        self._message_ids = []
+
+    def next_id(self):
+        self._ids += 1
+        return self._ids
+
+    @staticmethod
+    def timestamp():
+        return datetime.utcnow().isoformat()
+
+    def user_data(self, bot=False):
+        uid = self.next_id()
+        return {'id': str(uid), 'username': f'user{uid % 10000}',
+                'discriminator': f'{uid % 10000:04}', 'avatar': None, 'bot': bot}
+
+    def member_data(self, guild_id, role_ids, user=None):
+        roles = self._random.sample(role_ids, k=min(len(role_ids), self._random.randint(0, 3)))
+        return {'user': user or self.user_data(), 'roles': [str(r) for r in roles],
+                'joined_at': self.timestamp(), 'deaf': False, 'mute': False,
+                'nick': None, 'guild_id': str(guild_id)}
+
+    def guild_data(self, channels, members, roles):
+        guild_id = self.next_id()
+        role_ids = [self.next_id() for _ in range(roles)]
+        roles_data = [{'id': str(guild_id), 'name': '@everyone', 'permissions': '104324673',
+                       'position': 0, 'color': 0, 'hoist': False, 'managed': False,
+                       'mentionable': False}]
+        roles_data.extend({'id': str(r), 'name': f'role{idx}', 'permissions': '104324673',
+                           'position': idx + 1, 'color': 0, 'hoist': False, 'managed': False,
+                           'mentionable': False} for idx, r in enumerate(role_ids))
+
+        channels_data = [{'id': str(self.next_id()), 'type': 0, 'name': f'channel{idx}',
+                          'position': idx, 'permission_overwrites': [], 'nsfw': False,
+                          'parent_id': None} for idx in range(channels)]
+
+        members_data = [self.member_data(guild_id, role_ids) for _ in range(members)]
+        members_data.append(self.member_data(guild_id, [], user=self.user))
+
+        return {'id': str(guild_id), 'name': f'guild{guild_id % 1000}', 'owner_id': members_data[0]['user']['id'],
+                'region': 'europe', 'afk_timeout': 300, 'verification_level': 0,
+                'default_message_notifications': 0, 'explicit_content_filter': 0,
+                'mfa_level': 0, 'features': [], 'emojis': [], 'roles': roles_data,
+                'channels': channels_data, 'members': members_data,
+                'member_count': len(members_data), 'large': False, 'unavailable': False}
+
+    def _random_location(self):
+        guild = self._random.choice(self.guilds)
+        channel = self._random.choice(guild['channels'])
+        return guild, channel
+
+    def message_create(self):
+        guild, channel = self._random_location()
+        member = self._random.choice(guild['members'][:-1])
+        if self._random.random() < self.command_ratio:
+            content = self.prefix + self._random.choice(_COMMAND_CORPUS)
+        else:
+            content = self._random.choice(_CHAT_CORPUS)
+
+        message_id = self.next_id()
+        self._message_ids.append((guild['id'], channel['id'], message_id))
+        if len(self._message_ids) > 1000:
+            self._message_ids.pop(0)
+
+        # The author and the member data must be the same user
+        author = member['user']
+        member = {k: v for k, v in member.items() if k != 'user'}
+        return {'id': str(message_id), 'channel_id': channel['id'], 'guild_id': guild['id'],
+                'author': author, 'member': member,
+                'content': content, 'timestamp': self.timestamp(), 'edited_timestamp': None,
+                'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+                'attachments': [], 'embeds': [], 'pinned': False, 'type': 0}
+
+    def member_update(self):
+        guild = self._random.choice(self.guilds)
+        member = self._random.choice(guild['members'][:-1])
+        role_ids = [r['id'] for r in guild['roles'][1:]]
+        member['roles'] = self._random.sample(role_ids, k=min(len(role_ids), self._random.randint(0, 3)))
+        return {'guild_id': guild['id'], 'user': member['user'], 'roles': member['roles'],
+                'nick': None, 'joined_at': member['joined_at']}
+
+    def reaction_add(self):
+        if not self._message_ids:
+            return None
+
+        guild_id, channel_id, message_id = self._random.choice(self._message_ids)
+        guild = next(g for g in self.guilds if g['id'] == guild_id)
+        member = self._random.choice(guild['members'][:-1])
+        return {'user_id': member['user']['id'], 'channel_id': channel_id,
+                'message_id': str(message_id), 'guild_id': guild_id,
+                'emoji': {'id': None, 'name': '👍'}, 'member': member}
+
+    def member_join(self):
+        guild = self._random.choice(self.guilds)
+        role_ids = [r['id'] for r in guild['roles'][1:]]
+        member = self.member_data(guild['id'], role_ids)
+        member['roles'] = []
+        guild['members'].append(member)
+        return member
+
+    def events(self, count, weights=None):
+        """
+        Generate events in the format (event type, payload)
+
+        Args:
+            count: Amount of events to generate
+            weights: dict of event type: weight. Defaults to mostly messages
+        """
+        weights = weights or {'MESSAGE_CREATE': 90, 'GUILD_MEMBER_UPDATE': 5,
+                              'MESSAGE_REACTION_ADD': 4, 'GUILD_MEMBER_ADD': 1}
+        factories = {'MESSAGE_CREATE': self.message_create,
+                     'GUILD_MEMBER_UPDATE': self.member_update,
+                     'MESSAGE_REACTION_ADD': self.reaction_add,
+                     'GUILD_MEMBER_ADD': self.member_join}
+        types = list(weights.keys())
+        type_weights = list(weights.values())
+
+        for _ in range(count):
+            t = self._random.choices(types, type_weights)[0]
+            data = factories[t]()
+            if data is None:
+                t = 'MESSAGE_CREATE'
+                data = self.message_create()
+
+            yield t, data
+
+
+def read_recorded_events(filename):
+    """Read recorded gateway events from a file with one json payload per line"""
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            payload = json.loads(line)
+            if payload.get('t') and payload.get('d') is not None:
+                yield payload['t'], payload['d']
+
+
+class ReplayHarness:
+    def __init__(self, bot, factory: EventFactory):
+        self.bot = bot
+        self.factory = factory
+        self.latencies = {}
+        self.loop_lag = Histogram()
+        self.errors = 0
+        self._scheduled = None
+        self._original_schedule = bot._schedule_event
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = self._original_schedule(coro, event_name, *args, **kwargs)
+        if self._scheduled is not None:
+            self._scheduled.append(task)
+        return task
+
+    async def _offline_request(self, route, **kwargs):
+        # Answer message sends with a message so the cogs can keep going
+        if route.method == 'POST' and route.path.endswith('/messages'):
+            payload = kwargs.get('json') or {}
+            return {'id': str(self.factory.next_id()), 'channel_id': str(route.channel_id),
+                    'author': self.factory.user, 'content': payload.get('content') or '',
+                    'timestamp': self.factory.timestamp(), 'edited_timestamp': None,
+                    'tts': False, 'mention_everyone': False, 'mentions': [],
+                    'mention_roles': [], 'attachments': [], 'embeds': [],
+                    'pinned': False, 'type': 0}
+
+        return {}
+
+    async def setup(self):
+        bot = self.bot
+        state = bot._connection
+        bot.http.request = self._offline_request
+        bot._schedule_event = self._schedule_event
+
+        state.user = discord.ClientUser(state=state, data=self.factory.user)
+        for guild in self.factory.guilds:
+            state._add_guild_from_data(guild)
+
+        # Recorded in the startup timeline like on_ready does
+        bot.startup.mark_connected()
+        bot._mention_prefix = (bot.user.mention + ' ', f'<@!{bot.user.id}> ')
+        bot.redis = MemoryRedis()
+
+        t = time.perf_counter()
+        with bot.startup.phase('cache_guilds'):
+            await bot.cache_guilds()
+        logger.info(f'Cached guilds in {format_ms(time.perf_counter() - t)}')
+
+        t = time.perf_counter()
+        with bot.startup.phase('cogs'):
+            await bot.loop.run_in_executor(bot.threadpool, bot._load_cogs)
+        logger.info(f'Loaded cogs in {format_ms(time.perf_counter() - t)}')
+
+        bot.startup.mark_ready()
+        bot._ready_called = True
+        bot._ready.set()
+
+    async def _monitor_loop_lag(self, interval=0.01):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.add(max(0.0, time.perf_counter() - t - interval))
+
+    async def _wait_event(self, event_type, started, tasks):
+        if tasks:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            self.errors += sum(isinstance(r, Exception) for r in results)
+
+        histogram = self.latencies.get(event_type)
+        if histogram is None:
+            histogram = Histogram()
+            self.latencies[event_type] = histogram
+
+        histogram.add(time.perf_counter() - started)
+
+    def feed(self, event_type, data):
+        """Feed a single gateway event and return the tasks it scheduled"""
+        parser = self.bot._connection.parsers.get(event_type)
+        if parser is None:
+            return []
+
+        self._scheduled = []
+        try:
+            parser(data)
+        except Exception:  # skipcq: PYL-W0703
+            logger.exception(f'Failed to parse {event_type}')
+            self.errors += 1
+        finally:
+            tasks = self._scheduled
+            self._scheduled = None
+
+        return tasks
+
+    async def run(self, events, rate=100):
+        """
+        Feed the events at the given rate (events per second) and wait
+        for every listener they scheduled to finish
+
+        Returns:
+            Benchmark report as a string
+        """
+        monitor = self.bot.loop.create_task(self._monitor_loop_lag())
+        waiters = []
+        interval = 1 / rate if rate else 0
+        started = time.perf_counter()
+        count = 0
+
+        for event_type, data in events:
+            due = started + count * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif count % 100 == 0:
+                # Let the listeners run even when we are behind schedule
+                await asyncio.sleep(0)
+
+            t = time.perf_counter()
+            tasks = self.feed(event_type, data)
+            waiters.append(self.bot.loop.create_task(self._wait_event(event_type, t, tasks)))
+            count += 1
+
+        await asyncio.gather(*waiters)
+        elapsed = time.perf_counter() - started
+        monitor.cancel()
+
+        return self.format_report(count, elapsed, rate)
+
+    def format_report(self, count, elapsed, rate):
+        lines = [f'{count} events in {elapsed:.2f}s ({count / elapsed:.1f} events/s, target {rate}/s). '
+                 f'{self.errors} errors',
+                 '',
+                 f'{"event":<22} {"count":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}']
+
+        for event_type, h in sorted(self.latencies.items()):
+            lines.append(f'{event_type:<22} {h.count:>7} {format_ms(h.percentile(50)):>8} '
+                         f'{format_ms(h.percentile(95)):>8} {format_ms(h.percentile(99)):>8} '
+                         f'{format_ms(h.max):>8}')
+
+        lag = self.loop_lag
+        lines.append('')
+        lines.append(f'Event loop lag p50 {format_ms(lag.percentile(50))} '
+                     f'p99 {format_ms(lag.percentile(99))} max {format_ms(lag.max)}')
+
+        return '\n'.join(lines)
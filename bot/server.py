@@ -18,6 +18,12 @@ class WebhookServer:
             logger.info('Sanic not installed. Webhook not initialized')
             return
 
+        if not bot.is_primary_cluster:
+            # Only one process can bind to the port
+            self._listeners = set()
+            logger.info('Webhook is only initialized on the first cluster')
+            return
+
         app = Sanic(name='webhook', configure_logging=bot.test_mode)
         self.bot = bot
         self._listeners = set() if not listeners else set(listeners)
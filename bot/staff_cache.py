@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+
+from asyncpg.exceptions import PostgresError
+
+logger = logging.getLogger('terminal')
+
+
+class StaffCache:
+    """
+    Caches the bot_staff table which is small and rarely changes.
+    The table is reloaded when it has been cached for longer than ttl
+    seconds or when invalidate has been called.
+    """
+    def __init__(self, bot, ttl=600):
+        self._bot = bot
+        self._ttl = ttl
+        self._auth_levels = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def bot(self):
+        return self._bot
+
+    @property
+    def expired(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    async def load(self):
+        rows = await self.bot.dbutil.fetch('SELECT uid, auth_level FROM bot_staff')
+        self._auth_levels = {r['uid']: r['auth_level'] for r in rows}
+        self._loaded_at = time.monotonic()
+        logger.debug(f'Loaded {len(self._auth_levels)} bot staff members')
+
+    async def get_auth_level(self, user_id):
+        if self.expired:
+            async with self._lock:
+                # Another coroutine might have reloaded the cache while we waited
+                if self.expired:
+                    try:
+                        await self.load()
+                    except PostgresError:
+                        # Keep using the old values if the reload fails
+                        logger.exception('Failed to reload bot staff')
+                        if self._loaded_at is None:
+                            raise
+
+        return self._auth_levels.get(user_id, 0)
@@ -0,0 +1,77 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from bot.metrics import format_ms
+
+logger = logging.getLogger('terminal')
+
+# Approximate start of the process. This module is imported by bot.botbase
+# so everything imported before the bot is created falls before this
+IMPORTED_AT = time.perf_counter()
+
+
+class StartupTimeline:
+    """
+    Records how long the different phases of startup take so slow
+    startups can be diagnosed. Offsets are relative to IMPORTED_AT
+    """
+    def __init__(self):
+        self.started_at = IMPORTED_AT
+        # list of (name, start offset, duration)
+        self.phases = []
+        self._initialized_at = None
+        self.ready_at = None
+        self.first_command_at = None
+
+    def add(self, name, start, duration):
+        self.phases.append((name, start - self.started_at, duration))
+
+    @contextmanager
+    def phase(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, t, time.perf_counter() - t)
+
+    def mark_initialized(self):
+        """Called when the bot has been created and is about to connect"""
+        self._initialized_at = time.perf_counter()
+
+    def mark_connected(self):
+        """Records the time from mark_initialized to the first on_ready"""
+        if self._initialized_at is None or self.ready_at is not None:
+            return
+
+        t = self._initialized_at
+        self.add('login and connect', t, time.perf_counter() - t)
+
+    def mark_ready(self):
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter() - self.started_at
+
+    def mark_command(self):
+        """Called after a command has been invoked. Only the first call is recorded"""
+        if self.first_command_at is None:
+            self.first_command_at = time.perf_counter() - self.started_at
+            logger.info(f'First command finished {self.first_command_at:.2f}s after startup')
+
+    def format(self, min_duration=0.01):
+        """
+        Args:
+            min_duration: Phases shorter than this are left out
+        """
+        lines = [f'{"phase":<32} {"start":>8} {"took":>8}']
+        for name, start, duration in sorted(self.phases, key=lambda p: p[1]):
+            if duration < min_duration:
+                continue
+
+            lines.append(f'{name[:32]:<32} {start:>7.2f}s {format_ms(duration):>8}')
+
+        if self.ready_at is not None:
+            lines.append(f'{"READY":<32} {self.ready_at:>7.2f}s')
+        if self.first_command_at is not None:
+            lines.append(f'{"first command":<32} {self.first_command_at:>7.2f}s')
+
+        return '\n'.join(lines)
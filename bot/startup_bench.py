@@ -0,0 +1,116 @@
+"""
+Cold start benchmark. Run with test_run.py --bench startup [runs]
+
+Starts the bot in new processes with the in memory backend and the replay
+harness instead of discord and measures the time from startup to ready
+and to the first finished command with the StartupTimeline. Each run is
+a separate process so imports are cold every time. The eager runs import
+the lazily loaded modules before the first command like the bot did
+before they were deferred. Doesn't need discord or the database.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Prefix of the line a child process reports its results on
+_RESULT = 'STARTUP_RESULT '
+
+
+def _child(eager):
+    # Imported first so the timeline starts as close to process start as possible
+    from bot.startup import StartupTimeline  # noqa: F401
+
+    import asyncio
+
+    from bot.bench import create_bot
+    from bot.config import Config
+    from bot.replay import EventFactory, ReplayHarness
+    from utils.lazy import warmup_modules
+
+    config = Config()
+    config.db_backend = 'memory'
+    bot = create_bot(config)
+    factory = EventFactory(prefix=bot.default_prefix, seed=0)
+    harness = ReplayHarness(bot, factory)
+    try:
+        bot.loop.run_until_complete(harness.setup())
+        if eager:
+            for module in warmup_modules:
+                with bot.startup.phase(f'import {module._name}'):
+                    module.load()
+
+        for _ in range(10):
+            data = factory.message_create()
+            data['content'] = bot.default_prefix + 'ping'
+            tasks = harness.feed('MESSAGE_CREATE', data)
+            bot.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            if bot.startup.first_command_at is not None:
+                break
+    finally:
+        bot.loop.run_until_complete(bot.close())
+
+    startup = bot.startup
+    print(_RESULT + json.dumps({'ready': startup.ready_at, 'first_command': startup.first_command_at,
+                                'timeline': startup.format()}))
+
+
+def _start(eager):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (root, env.get('PYTHONPATH'))))
+    args = [sys.executable, '-m', 'bot.startup_bench', '--child']
+    if eager:
+        args.append('--eager')
+
+    t = time.perf_counter()
+    out = subprocess.run(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True, check=True).stdout
+    elapsed = time.perf_counter() - t
+
+    for line in out.splitlines():
+        if line.startswith(_RESULT):
+            result = json.loads(line[len(_RESULT):])
+            result['process'] = elapsed
+            return result
+
+    raise RuntimeError('Startup benchmark process did not report a result')
+
+
+def run(runs=5):
+    """
+    Args:
+        runs: Amount of processes started for each mode
+
+    Returns:
+        The report as a string
+    """
+    lines = [f'Median of {runs} cold starts with the memory backend',
+             f'{"imports":<8} {"ready":>7} {"first command":>14} {"process":>8}']
+    timeline = None
+    for name, eager in (('lazy', False), ('eager', True)):
+        results = [_start(eager) for _ in range(runs)]
+        if None in (r['first_command'] for r in results):
+            raise RuntimeError('The command never finished')
+
+        results.sort(key=lambda r: r['first_command'])
+        ready = statistics.median(r['ready'] for r in results)
+        first_command = statistics.median(r['first_command'] for r in results)
+        process = statistics.median(r['process'] for r in results)
+        lines.append(f'{name:<8} {ready:>6.2f}s {first_command:>13.2f}s {process:>7.2f}s')
+        if timeline is None:
+            timeline = results[len(results) // 2]['timeline']
+
+    lines.append('\nTimeline of the median lazy run')
+    lines.append(timeline)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        _child('--eager' in sys.argv)
+    else:
+        print(run())
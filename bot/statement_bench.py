@@ -0,0 +1,88 @@
+"""
+Named statement benchmark. Run with test_run.py --bench statements [queries]
+
+Runs read only statements from STATEMENTS with DatabaseUtils.fetch_statement
+and, for comparison, the same queries with the values formatted into the
+sql like they were before the statements existed. The sql of a formatted
+query changes with its values so asyncpg has to prepare it again and
+postgres plans it on every call. Needs postgres. Nothing is written.
+"""
+
+import random
+import time
+
+from bot.metrics import format_ms
+
+_ROLES = 10
+
+
+def _snowflake(rng):
+    return rng.randrange(10**17, 10**18)
+
+
+# statement name -> (sql with the values formatted in, function returning the statement args)
+_CASES = {
+    'guild_settings': ('SELECT guilds.*, prefixes.prefix FROM guilds LEFT OUTER JOIN prefixes '
+                       'ON guilds.guild=prefixes.guild WHERE guilds.guild=%s',
+                       lambda rng: (_snowflake(rng),)),
+    'is_guild_blacklisted': ('SELECT 1 FROM guild_blacklist WHERE guild=%s',
+                             lambda rng: (_snowflake(rng),)),
+    'last_attachment': ('SELECT attachment FROM attachments WHERE channel=%s',
+                        lambda rng: (_snowflake(rng),)),
+    'user_guild_roles': ('SELECT roles.id FROM userroles INNER JOIN roles ON roles.id=userroles.role '
+                         'WHERE roles.guild=%s AND userroles.uid=%s',
+                         lambda rng: (_snowflake(rng), _snowflake(rng))),
+    'check_role_grant': ('SELECT role FROM role_granting WHERE guild=%s AND role=%s '
+                         'AND (uid=%s OR user_role IN (%s)) LIMIT 1',
+                         lambda rng: (_snowflake(rng), _snowflake(rng), _snowflake(rng),
+                                      [_snowflake(rng) for _ in range(_ROLES)])),
+}
+
+
+def _format(sql, args):
+    return sql % tuple(', '.join(map(str, a)) if isinstance(a, list) else a for a in args)
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def _measure(func, calls):
+    times = []
+    for call in calls:
+        t = time.perf_counter()
+        await func(*call)
+        times.append(time.perf_counter() - t)
+
+    times.sort()
+    return times
+
+
+async def run(dbutil, queries=2000, seed=0):
+    """
+    Args:
+        dbutil: DatabaseUtils connected to postgres
+        queries: Amount of queries run per statement and path
+
+    Returns:
+        The report as a string
+    """
+    rng = random.Random(seed)
+    lines = [f'{queries} queries per statement with random ids',
+             f'{"statement":<22} {"formatted p50":>13} {"p99":>7} {"named p50":>10} {"p99":>7}']
+
+    for name, (sql, get_args) in _CASES.items():
+        args = [get_args(rng) for _ in range(queries)]
+        formatted = [(_format(sql, a),) for a in args]
+        named = [(name, *a) for a in args]
+
+        # Warm up the connections so pool startup isn't measured
+        await _measure(dbutil.fetch_statement, named[:100])
+        await _measure(dbutil.fetch, formatted[:100])
+
+        old = await _measure(dbutil.fetch, formatted)
+        new = await _measure(dbutil.fetch_statement, named)
+        lines.append(f'{name:<22} {format_ms(_percentile(old, 50)):>13} {format_ms(_percentile(old, 99)):>7} '
+                     f'{format_ms(_percentile(new, 50)):>10} {format_ms(_percentile(new, 99)):>7}')
+
+    return '\n'.join(lines)
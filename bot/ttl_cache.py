@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Read-through cache for small values loaded from the database.
+
+    Entries expire after their ttl and the least recently used entries are
+    evicted when the cache holds more than maxsize entries. Concurrent
+    misses of the same key share a single load. Setters invalidate the
+    keys they change so cached values only go stale when the database
+    is modified from somewhere else, in which case the ttl limits how
+    long the old value is served.
+    """
+    def __init__(self, name, maxsize=5000, ttl=600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, expires_at)
+        self._data = OrderedDict()
+        # key -> Future of the load in progress
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses + self.coalesced
+        if not total:
+            return 0.0
+
+        return (self.hits + self.coalesced) / total
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return False, None
+
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, ttl=None):
+        """Set the value of key. A load of key in progress won't overwrite the value"""
+        self._pending.pop(key, None)
+        self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key, load, ttl=None):
+        """
+        Get the value of key loading it with load on a miss.
+        Exceptions raised by load are not cached and are raised to every
+        caller waiting for that load
+
+        Args:
+            key: Key of the value
+            load: Function that returns an awaitable that resolves to the value
+            ttl: Time to live of the value in seconds if not the default
+        """
+        found, value = self._lookup(key)
+        if found:
+            self.hits += 1
+            return value
+
+        fut = self._pending.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise
+
+                # The task doing the load was cancelled so try loading again
+                return await self.get(key, load, ttl)
+
+        self.misses += 1
+        fut = asyncio.get_event_loop().create_future()
+        self._pending[key] = fut
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            if self._pending.get(key) is fut:
+                del self._pending[key]
+            fut.cancel()
+            raise
+        except Exception as e:
+            if self._pending.get(key) is fut:
+                del self._pending[key]
+            fut.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            fut.exception()
+            raise
+
+        # If the key was invalidated during the load the value might be outdated
+        if self._pending.get(key) is fut:
+            del self._pending[key]
+            self.set(key, value, ttl)
+
+        fut.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        self._pending.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Invalidate every key for which predicate(key) is true"""
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+        for key in [k for k in self._pending if predicate(k)]:
+            del self._pending[key]
+
+    def clear(self):
+        self._data.clear()
+        self._pending.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def format_stats(self):
+        return (f'{self.name:<20} {len(self._data):>6}/{self.maxsize:<6} {self.hits:>8} {self.misses:>8} '
+                f'{self.coalesced:>8} {self.evictions:>8} {self.hit_rate*100:>6.1f}%')
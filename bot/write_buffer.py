@@ -0,0 +1,253 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from bot.metrics import Histogram, format_ms
+from bot.pool_manager import BACKGROUND
+
+logger = logging.getLogger('terminal')
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for the high volume writes done by the Logger cog.
+    Rows are coalesced in memory and written in one transaction every
+    interval seconds or when the buffer holds max_size rows.
+
+    - mention_stats increments are summed per (guild, role)
+    - only the newest attachment of a channel is kept
+    - only the newest join or leave of a member is kept
+    - only the first join date of a member is kept
+    - command uses are recorded in one go with DatabaseUtils.record_command_uses
+
+    If a flush fails the rows are put back to be retried on the next flush.
+    Each kind of row is capped at max_pending and the oldest rows are
+    dropped when the database can't keep up.
+    """
+    def __init__(self, bot, max_size=2000, interval=10, max_pending=50000):
+        self._bot = bot
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._mentions = {}  # (guild, role) -> [role_name, amount]
+        self._messages = []  # (guild, channel, user_id, message_id)
+        self._attachments = {}  # channel -> attachment
+        self._join_leave = {}  # (uid, guild) -> value
+        self._join_dates = {}  # (uid, guild) -> first_join
+        self._command_uses = []  # (parent, name, used_at, user_id, guild)
+
+        self._wakeup = None
+        self._closed = False
+        # Created on first flush as this class might be created outside of the event loop
+        self._flush_lock = None
+
+        self.flush_latency = Histogram()
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+
+    @property
+    def bot(self):
+        return self._bot
+
+    @property
+    def depth(self):
+        """Amount of rows waiting to be written"""
+        return (len(self._mentions) + len(self._messages) + len(self._attachments) +
+                len(self._join_leave) + len(self._join_dates) + len(self._command_uses))
+
+    def _added(self):
+        depth = self.depth
+        if depth >= self.max_size and self._wakeup is not None:
+            self._wakeup.set()
+
+        if depth > self.max_pending:
+            self._drop_overflow()
+
+    def _drop_overflow(self):
+        for name, rows in (('mention counts', self._mentions), ('messages', self._messages),
+                           ('attachments', self._attachments), ('joins and leaves', self._join_leave),
+                           ('join dates', self._join_dates), ('command uses', self._command_uses)):
+            overflow = len(rows) - self.max_pending
+            if overflow <= 0:
+                continue
+
+            # Both lists and dicts are in insertion order so the oldest rows go first
+            if isinstance(rows, list):
+                del rows[:overflow]
+            else:
+                for key in list(itertools.islice(rows, overflow)):
+                    del rows[key]
+
+            self.dropped += overflow
+            logger.warning(f'Write buffer full. Dropped {overflow} {name}')
+
+    def add_mentions(self, guild_id, roles):
+        for role in roles:
+            key = (guild_id, role.id)
+            pending = self._mentions.get(key)
+            if pending is None:
+                self._mentions[key] = [role.name, 1]
+            else:
+                pending[0] = role.name
+                pending[1] += 1
+
+        self._added()
+
+    def add_message(self, guild_id, channel_id, user_id, message_id):
+        self._messages.append((guild_id, channel_id, user_id, message_id))
+        self._added()
+
+    def set_attachment(self, channel_id, attachment):
+        # Pop first so the channel is moved to the end of the dict
+        self._attachments.pop(channel_id, None)
+        self._attachments[channel_id] = attachment
+        self._added()
+
+    def member_joined(self, member):
+        key = (member.id, member.guild.id)
+        self._join_leave[key] = 1
+        self._join_dates.setdefault(key, member.joined_at)
+        self._added()
+
+    def member_left(self, member):
+        self._join_leave[(member.id, member.guild.id)] = -1
+        self._added()
+
+    def command_used(self, parent, name, used_at, user_id=None, guild=None):
+        self._command_uses.append((parent, name, used_at, user_id, guild))
+        self._added()
+
+    def _take(self):
+        data = (self._mentions, self._messages, self._attachments,
+                self._join_leave, self._join_dates, self._command_uses)
+        self._mentions = {}
+        self._messages = []
+        self._attachments = {}
+        self._join_leave = {}
+        self._join_dates = {}
+        self._command_uses = []
+        return data
+
+    def _restore(self, data):
+        """
+        Put rows from a failed flush back in the buffer without overwriting newer rows.
+        The restored rows are older so they are put before the rows added during the flush
+        """
+        mentions, messages, attachments, join_leave, join_dates, command_uses = data
+
+        for key, (role_name, amount) in self._mentions.items():
+            pending = mentions.get(key)
+            if pending is None:
+                mentions[key] = [role_name, amount]
+            else:
+                pending[0] = role_name
+                pending[1] += amount
+
+        attachments.update(self._attachments)
+        join_leave.update(self._join_leave)
+        for key, value in self._join_dates.items():
+            join_dates.setdefault(key, value)
+
+        self._mentions = mentions
+        self._messages = messages + self._messages
+        self._attachments = attachments
+        self._join_leave = join_leave
+        self._join_dates = join_dates
+        self._command_uses = command_uses + self._command_uses
+        self._drop_overflow()
+
+    async def _write(self, conn, data):
+        mentions, messages, attachments, join_leave, join_dates, command_uses = data
+        dbutil = self.bot.dbutil
+
+        if mentions:
+            sql = 'INSERT INTO mention_stats AS ms (guild, role, role_name, amount) VALUES ($1, $2, $3, $4) ' \
+                  'ON CONFLICT (guild, role) DO UPDATE SET amount=ms.amount+EXCLUDED.amount, role_name=EXCLUDED.role_name'
+            await conn.executemany(sql, [(*key, name, amount) for key, (name, amount) in mentions.items()])
+
+        await dbutil.bulk_upsert('messages', ('guild', 'channel', 'user_id', 'message_id'),
+                                 messages, conn=conn)
+
+        await dbutil.bulk_upsert('attachments', ('channel', 'attachment'), attachments.items(),
+                                 conflict=('channel',), update=('attachment',), conn=conn)
+
+        if join_leave:
+            sql = 'INSERT INTO join_leave (uid, guild, value) VALUES ($1, $2, $3) ' \
+                  'ON CONFLICT (guild, uid) DO UPDATE SET value=EXCLUDED.value, at=CURRENT_TIMESTAMP'
+            await conn.executemany(sql, [(*key, value) for key, value in join_leave.items()])
+
+        await dbutil.bulk_upsert('join_dates', ('uid', 'guild', 'first_join'),
+                                 ((*key, value) for key, value in join_dates.items()), conn=conn)
+
+        await dbutil.record_command_uses(command_uses, conn=conn)
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self.depth:
+                return
+
+            rows = self.depth
+            data = self._take()
+            t = time.perf_counter()
+            try:
+                async with self.bot.dbutil.acquire(BACKGROUND) as conn:
+                    async with conn.transaction():
+                        await self._write(conn, data)
+            except asyncio.CancelledError:
+                self._restore(data)
+                raise
+            except Exception:
+                # Not only database errors. Anything raised here would lose the rows
+                logger.exception('Failed to flush write buffer')
+                self.failed_flushes += 1
+                self._restore(data)
+                return
+
+            # Join dates that were just written might be cached as missing
+            for key in data[4]:
+                self.bot.dbutil.join_dates.invalidate(key)
+
+            self.flush_latency.add(time.perf_counter() - t)
+            self.flushes += 1
+            self.rows_written += rows
+
+    async def run(self):
+        """Flushes the buffer periodically until close is called"""
+        self._wakeup = asyncio.Event()
+        try:
+            while not self._closed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # Keep flushing. Stopping the loop would buffer rows until max_pending
+                    logger.exception('Write buffer flush loop error')
+        finally:
+            await self.flush()
+
+    def close(self):
+        """Stop the flush loop after one final flush. Must be called from the event loop"""
+        self._closed = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def format_stats(self):
+        latency = self.flush_latency
+        return (f'{self.depth} rows buffered. {self.rows_written} rows written in {self.flushes} flushes, '
+                f'{self.failed_flushes} failed. {self.dropped} rows dropped\n'
+                f'Flush latency p50 {format_ms(latency.percentile(50))} '
+                f'p99 {format_ms(latency.percentile(99))} max {format_ms(latency.max)}')
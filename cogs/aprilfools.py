@@ -10,7 +10,7 @@ from discord.ext.commands import is_owner, Greedy
 from discord.ext.commands.cooldowns import CooldownMapping, BucketType
 from numpy.random import choice
 
-from bot.bot import command
+from bot.bot import command, listener_scope
 from bot.commands import cooldown
 from bot.converters import TimeDelta
 from cogs.cog import Cog
@@ -380,6 +380,7 @@ class BattleArena(Cog):
         self._active_spawn = PointSpawn(amount, await chn.send(embed=embed))
 
     @Cog.listener()
+    @listener_scope(guilds=(353927534439825429, 217677285442977792))
     async def on_message(self, msg):
         if not msg.guild or msg.guild.id != self._guild or msg.webhook_id or msg.type != discord.MessageType.default:
             return
@@ -4,6 +4,7 @@ from random import choice
 
 import discord
 
+from bot.bot import listener_scope
 from cogs.cog import Cog
 from utils.utilities import Snowflake, wants_to_be_noticed
 
@@ -19,6 +20,7 @@ class AutoRoles(Cog):
         return self.bot.dbutil
 
     @Cog.listener()
+    @listener_scope(guilds=(217677285442977792,))
     async def on_message(self, message):
         if self.bot.test_mode:
             return
@@ -80,10 +82,8 @@ class AutoRoles(Cog):
         roles = set()
         muted_role = self.bot.guild_cache.mute_role(guild.id)
         if self.bot.guild_cache.keeproles(guild.id):
-            sql = 'SELECT roles.id FROM userroles LEFT OUTER JOIN roles ON roles.id=userroles.role ' \
-                  'WHERE roles.guild=%s AND userroles.uid=%s' % (guild.id, member.id)
-
-            roles = {r['id'] for r in await self.bot.dbutil.fetch(sql) if r['id']}
+            rows = await self.bot.dbutil.fetch_statement('user_guild_roles', guild.id, member.id)
+            roles = {r['id'] for r in rows if r['id']}
             if not roles:
                 return await self.add_random_color(member)
 
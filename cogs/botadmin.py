@@ -3,6 +3,7 @@ import asyncio
 import contextlib
 import functools
 import inspect
+import json
 import logging
 import os
 import pprint
@@ -23,26 +24,29 @@ from py_compile import PyCompileError
 
 import aiohttp
 import discord
-import matplotlib.pyplot as plt
 from asyncpg.exceptions import PostgresError
 from discord import File
 from discord.errors import HTTPException, InvalidArgument
 from discord.ext.commands.errors import ExtensionError, ExtensionFailed
 from discord.user import BaseUser
-from matplotlib.dates import AutoDateLocator, DateFormatter
-from matplotlib.ticker import MultipleLocator
 
-from bot.bot import command
+from bot.bot import command, group
 from bot.config import Config
 from bot.converters import PossibleUser, CommandConverter
 from bot.globals import SFX_FOLDER
+from bot.metrics import ListenerStats
 from cogs.cog import Cog
+from utils.lazy import lazy_import
 from utils.utilities import split_string
 from utils.utilities import (y_n_check, basic_check, y_check, check_import,
                              parse_timeout, is_owner, format_timedelta,
                              call_later, seconds2str, test_url,
                              wants_to_be_noticed, DateAccuracy)
 
+plt = lazy_import('matplotlib.pyplot')
+dates = lazy_import('matplotlib.dates')
+ticker = lazy_import('matplotlib.ticker')
+
 logger = logging.getLogger('terminal')
 
 
@@ -416,7 +420,13 @@ class BotAdmin(Cog):
     async def reload_dbutil(self, ctx):
         reload(import_module('bot.dbutil'))
         from bot import dbutil
-        self.bot._dbutil = dbutil.DatabaseUtils(self.bot)
+        if self.bot.config.db_backend == 'memory':
+            # Reloaded after dbutil so it subclasses the new DatabaseUtils
+            reload(import_module('bot.memory_db'))
+            from bot import memory_db
+            self.bot._dbutil = memory_db.MemoryDatabaseUtils(self.bot)
+        else:
+            self.bot._dbutil = dbutil.DatabaseUtils(self.bot)
         await ctx.send(':ok_hand:')
 
     @command()
@@ -426,6 +436,34 @@ class BotAdmin(Cog):
         self.bot.help_command = HelpCommand()
         await ctx.send(':ok_hand:')
 
+    @command()
+    async def reload_staff(self, ctx):
+        staff = getattr(self.bot, 'staff', None)
+        if staff is None:
+            return await ctx.send('No staff cache in use')
+
+        try:
+            await staff.load()
+        except PostgresError:
+            logger.exception('Failed to reload bot staff')
+            return await ctx.send('Failed to reload bot staff')
+
+        await ctx.send(':ok_hand:')
+
+    @command()
+    async def reload_blacklist(self, ctx):
+        cache = getattr(self.bot, 'blacklist_cache', None)
+        if cache is None:
+            return await ctx.send('No command blacklist cache in use')
+
+        try:
+            await cache.load()
+        except PostgresError:
+            logger.exception('Failed to reload command blacklist')
+            return await ctx.send('Failed to reload command blacklist')
+
+        await ctx.send(f'Loaded {len(cache)} rules')
+
     @command()
     async def reload_config(self, ctx):
         try:
@@ -604,6 +642,160 @@ class BotAdmin(Cog):
 
         await ctx.send(f'Removed the botban of {name}`{user_id}`')
 
+    @command()
+    async def botban_stats(self, ctx):
+        botbans = getattr(self.bot, 'botbans', None)
+        if botbans is None:
+            return await ctx.send('No botban cache in use')
+
+        total = botbans.hits + botbans.misses
+        await ctx.send(f'{len(botbans)} botbanned users\n'
+                       f'{total} lookups. {botbans.hits} hits and {botbans.misses} misses')
+
+    @command()
+    async def write_buffer(self, ctx):
+        """Show the state of the write buffer used by the logging cog"""
+        cog = self.bot.get_cog('Logger')
+        if cog is None:
+            return await ctx.send('Logger cog not loaded')
+
+        await ctx.send(cog.buffer.format_stats())
+
+    @command()
+    async def log_batcher(self, ctx):
+        """Show the queues of log messages posted by the logging cog"""
+        cog = self.bot.get_cog('Logger')
+        if cog is None:
+            return await ctx.send('Logger cog not loaded')
+
+        await ctx.send(cog.batcher.format_stats())
+
+    @command()
+    async def startup(self, ctx):
+        """Show how long the different phases of startup took"""
+        startup = getattr(self.bot, 'startup', None)
+        if startup is None:
+            return await ctx.send('No startup timeline recorded')
+
+        for page in split_string(startup.format(), maxlen=1990, splitter='\n'):
+            await ctx.send(f'```\n{page}\n```')
+
+    @group(invoke_without_command=True)
+    async def listener_stats(self, ctx, event_name=None):
+        """
+        Show latency percentiles of event listeners.
+        Await is the mean time spent waiting instead of running
+        """
+        stats = self.bot.listener_stats
+        if stats is None:
+            return await ctx.send(f'Listener stats are disabled. Enable them with `{ctx.prefix}listener_stats on`')
+
+        if event_name and not event_name.startswith('on_'):
+            event_name = 'on_' + event_name
+
+        table = stats.format_table(event_name)
+        await ctx.send(f'Stats collected for {seconds2str(time.time() - stats.started_at, False)}')
+        for msg in split_string(table, splitter='\n', maxlen=1990):
+            await ctx.send(f'```\n{msg}```')
+
+    @listener_stats.command(name='on')
+    async def listener_stats_on(self, ctx):
+        if self.bot.listener_stats is None:
+            self.bot.listener_stats = ListenerStats()
+        await ctx.send('Listener stats enabled')
+
+    @listener_stats.command(name='off')
+    async def listener_stats_off(self, ctx):
+        self.bot.listener_stats = None
+        await ctx.send('Listener stats disabled')
+
+    @listener_stats.command(name='reset')
+    async def listener_stats_reset(self, ctx):
+        if self.bot.listener_stats is not None:
+            self.bot.listener_stats.reset()
+        await ctx.send(':ok_hand:')
+
+    @listener_stats.command(name='hist')
+    async def listener_stats_hist(self, ctx, listener, event_name):
+        """Show the wall time histogram of a single listener"""
+        stats = self.bot.listener_stats
+        if stats is None:
+            return await ctx.send('Listener stats are disabled')
+
+        if not event_name.startswith('on_'):
+            event_name = 'on_' + event_name
+
+        entry = stats.entries.get((listener, event_name))
+        if entry is None:
+            return await ctx.send(f'No stats found for {listener} {event_name}')
+
+        await ctx.send(f'```\n{entry.wall.format()}```')
+
+    @command()
+    async def db_caches(self, ctx, reset: bool=False):
+        """Show the hit rates of the database caches. Hits include coalesced misses"""
+        caches = self.bot.dbutil.caches
+        s = f'{"cache":<20} {"size":>13} {"hits":>8} {"misses":>8} {"shared":>8} {"evicted":>8} {"rate":>7}\n'
+        s += '\n'.join(c.format_stats() for c in caches)
+        if reset:
+            for c in caches:
+                c.reset_stats()
+
+        await ctx.send(f'```\n{s}```')
+
+    @command()
+    async def invalidations(self, ctx, reset: bool=False):
+        """Show delivery latency and missed messages of cache invalidations from other processes"""
+        bus = self.bot.invalidation
+        s = bus.format_stats()
+        if reset:
+            bus.reset()
+
+        await ctx.send(f'```\n{s}```')
+
+    @group(invoke_without_command=True)
+    async def query_stats(self, ctx, sort='total', limit: int=15):
+        """
+        Show latency percentiles of database queries grouped by query fingerprint.
+        Sort by one of total, count, p99 or rows
+        """
+        stats = self.bot.query_stats
+        await ctx.send(f'Stats collected for {seconds2str(time.time() - stats.started_at, False)}')
+        for msg in split_string(stats.format_table(sort, limit), splitter='\n', maxlen=1990):
+            await ctx.send(f'```\n{msg}```')
+
+    @query_stats.command(name='pool')
+    async def query_stats_pool(self, ctx):
+        """Show the wait times of the pool lanes and how long each module holds connections"""
+        s = self.bot.pool_manager.format_stats() + '\n\n' + self.bot.query_stats.format_connections()
+        for msg in split_string(s, splitter='\n', maxlen=1990):
+            await ctx.send(f'```\n{msg}```')
+
+    @query_stats.command(name='callers')
+    async def query_stats_callers(self, ctx, idx: int, sort='total'):
+        """Show where the query with the given index in the query_stats table is called from"""
+        entries = self.bot.query_stats.sorted_entries(sort)
+        if not 0 <= idx < len(entries):
+            return await ctx.send(f'No query with index {idx}')
+
+        fp, entry = entries[idx]
+        callers = sorted(entry.callers.items(), key=lambda kv: kv[1], reverse=True)
+        s = fp[:500] + '\n\n' + '\n'.join(f'{n:>8} {site}' for site, n in callers)
+        for msg in split_string(s, splitter='\n', maxlen=1990):
+            await ctx.send(f'```\n{msg}```')
+
+    @query_stats.command(name='reset')
+    async def query_stats_reset(self, ctx):
+        self.bot.query_stats.reset()
+        self.bot.pool_manager.reset()
+        await ctx.send(':ok_hand:')
+
+    @query_stats.command(name='dump')
+    async def query_stats_dump(self, ctx):
+        """Send all collected query stats as a json file"""
+        data = json.dumps(self.bot.query_stats.to_dict(), indent=2)
+        await ctx.send(file=File(BytesIO(data.encode('utf-8')), filename='query_stats.json'))
+
     @command()
     async def leave_guild(self, ctx, guild_id: int):
         g = self.bot.get_guild(guild_id)
@@ -840,17 +1032,17 @@ class BotAdmin(Cog):
                 plt.xlabel(xlabel.title())
                 plt.ylabel(ylabel.title())
                 if parsed.x_int:
-                    ax.xaxis.set_major_locator(MultipleLocator(1))
+                    ax.xaxis.set_major_locator(ticker.MultipleLocator(1))
                 if parsed.y_int:
-                    ax.yaxis.set_major_locator(MultipleLocator(1))
+                    ax.yaxis.set_major_locator(ticker.MultipleLocator(1))
 
                 if isinstance(rows[0][0], datetime):
-                    ax.xaxis.set_major_locator(AutoDateLocator())
-                    ax.xaxis.set_major_formatter(DateFormatter(parsed.date_fmt))
+                    ax.xaxis.set_major_locator(dates.AutoDateLocator())
+                    ax.xaxis.set_major_formatter(dates.DateFormatter(parsed.date_fmt))
                     fig.autofmt_xdate()
                 if isinstance(rows[0][1], datetime):
-                    ax.yaxis.set_major_locator(AutoDateLocator())
-                    ax.yaxis.set_major_formatter(DateFormatter(parsed.date_fmt))
+                    ax.yaxis.set_major_locator(dates.AutoDateLocator())
+                    ax.yaxis.set_major_formatter(dates.DateFormatter(parsed.date_fmt))
 
                 buf = BytesIO()
                 plt.savefig(buf, format='png', bbox_inches='tight')
@@ -9,7 +9,6 @@ from io import BytesIO
 from math import ceil, sqrt
 
 import discord
-import matplotlib.pyplot as plt
 from PIL import Image, ImageDraw, ImageFont
 from asyncpg.exceptions import PostgresError
 from colormath.color_conversions import convert_color
@@ -25,9 +24,12 @@ from bot.bot import command, has_permissions, cooldown, group, \
     bot_has_permissions
 from bot.globals import WORKING_DIR
 from cogs.cog import Cog
+from utils.lazy import lazy_import
 from utils.utilities import (split_string, get_role, y_n_check, y_check,
                              Snowflake, check_botperm, send_paged_message)
 
+plt = lazy_import('matplotlib.pyplot')
+
 logger = logging.getLogger('terminal')
 
 rgb_splitter = re.compile(r'^(\d{1,3})([, ])(\d{1,3})\2(\d{1,3})$')
@@ -82,6 +84,7 @@ class Colors(Cog):
         self.bot.colors = self._colors
         self._color_jobs = set()
         asyncio.run_coroutine_threadsafe(self._cache_colors(), self.bot.loop)
+        self.bot.invalidation.subscribe('colors', self._load_colors, self._load_colors)
 
         with open(os.path.join(os.getcwd(), 'data', 'color_names.json'), 'r', encoding='utf-8') as f:
             self._color_names = json.load(f)
@@ -102,6 +105,40 @@ class Colors(Cog):
 
             await self._add_color(**row)
 
+    def cog_unload(self):
+        self.bot.invalidation.unsubscribe('colors')
+
+    async def _load_colors(self, guild_id=None):
+        """
+        Replace the cached colors of a guild or all guilds with the ones in the database.
+        Unlike _cache_colors this doesn't update the colors to match the roles
+        """
+        sql = 'SELECT colors.id, colors.name, colors.value, roles.guild, colors.lab_l, colors.lab_a, colors.lab_b FROM ' \
+              'colors LEFT OUTER JOIN roles on roles.id=colors.id'
+        args = ()
+        if guild_id is not None:
+            if not self.bot.get_guild(guild_id):
+                return
+
+            sql += ' WHERE roles.guild=$1'
+            args = (guild_id,)
+
+        colors = {}
+        for row in await self.bot.dbutil.fetch(sql, args):
+            if not self.bot.get_guild(row['guild']):
+                continue
+
+            color = Color(row['id'], row['name'], row['value'], row['guild'],
+                          (row['lab_l'], row['lab_a'], row['lab_b']))
+            colors.setdefault(row['guild'], {})[row['id']] = color
+
+        # bot.colors refers to the same dict so it's modified in place
+        if guild_id is None:
+            self._colors.clear()
+            self._colors.update(colors)
+        else:
+            self._colors[guild_id] = colors.get(guild_id, {})
+
     async def _add_color2db(self, color, update=False):
         await self.bot.dbutils.add_roles(color.guild_id, color.role_id)
         sql = 'INSERT INTO colors (id, name, "value", lab_l, lab_a, lab_b) VALUES ' \
@@ -139,8 +176,12 @@ class Colors(Cog):
         except PostgresError:
             logger.exception('Failed to add color to db')
             return False
-        else:
-            return True
+
+        guild_ids = {c.guild_id for c in color} if many else (color.guild_id,)
+        for guild_id in guild_ids:
+            await self.bot.invalidation.publish('colors', guild_id)
+
+        return True
 
     def get_color_from_type(self, color, guild_id):
         """
@@ -242,6 +283,7 @@ class Colors(Cog):
             logger.debug(f'Deleting color {role_id} from guild {guild_id} if it existed')
 
         await self.bot.dbutils.delete_role(role_id, guild_id)
+        await self.bot.invalidation.publish('colors', guild_id)
 
     def get_color(self, name, guild_id):
         name = name.lower()
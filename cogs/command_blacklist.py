@@ -226,16 +226,20 @@ class CommandBlacklist(Cog):
             await ctx.send('Failed to remove %s' % type_string)
             return False
 
+        cache = self.bot.blacklist_cache
         if row:
             if row['type'] == type_:
-                sql = 'DELETE FROM command_blacklist WHERE %s' % whereclause
+                sql = 'DELETE FROM command_blacklist WHERE %s RETURNING id' % whereclause
                 try:
-                    await self.bot.dbutil.execute(sql, whereargs)
+                    rows = await self.bot.dbutil.fetch(sql, whereargs)
                 except PostgresError:
                     logger.exception(f'Could not update {type_string} with whereclause {whereclause}')
                     await ctx.send(f'Failed to remove {type_string}')
                     return False
                 else:
+                    for r in rows:
+                        cache.remove_rule(r['id'])
+                        await self.bot.invalidation.publish('command_blacklist', r['id'])
                     return
             else:
                 sql = 'UPDATE command_blacklist SET type=$1 WHERE id=$2'
@@ -246,6 +250,8 @@ class CommandBlacklist(Cog):
                     await ctx.send(f'Failed to remove {type_string}')
                     return False
                 else:
+                    cache.set_rule_type(row['id'], type_)
+                    await self.bot.invalidation.publish('command_blacklist', row['id'])
                     return True
         else:
             # Dynamically create a insert that looks like this
@@ -262,14 +268,17 @@ class CommandBlacklist(Cog):
                     sql += ', '
                     val += ', '
 
-            sql += ') VALUES ' + val + ')'
+            sql += ') VALUES ' + val + ') RETURNING id'
             try:
-                await self.bot.dbutil.execute(sql, values.values())
+                rowid = await self.bot.dbutil.fetchval(sql, values.values())
             except PostgresError:
                 logger.exception(f'Could not set values {values}')
                 await ctx.send(f'Failed to set {type_string}')
                 return False
 
+            cache.add_rule(rowid, **values)
+            await self.bot.invalidation.publish('command_blacklist', rowid)
+
         return True
 
     async def _add_user_blacklist(self, ctx, command_name, user, guild):
@@ -346,7 +355,7 @@ class CommandBlacklist(Cog):
 
     @command(owner_only=True)
     async def test_perms(self, ctx, user: discord.Member, command_):
-        value = await self.bot.dbutil.check_blacklist(f"(command='{command_}' OR command IS NULL)", user, ctx, True)
+        value = await self.bot.dbutil.check_blacklist(command_, user, ctx, True)
         await ctx.send(value or 'No special perms')
 
     async def get_rows(self, whereclause, select='*'):
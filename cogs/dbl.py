@@ -11,6 +11,9 @@ logger = logging.getLogger('terminal')
 
 
 class DBApi(Cog):
+    # Redis hash of shard id: guild count used in cluster mode
+    GUILD_COUNTS = 'dbl_guild_counts'
+
     def __init__(self, bot):
         super().__init__(bot)
         self.bot.server.add_listener(self.on_vote)
@@ -48,14 +51,47 @@ class DBApi(Cog):
     async def update_stats(self):
         while True:
             await asyncio.sleep(3600)
-            logger.info('Posting server count')
             try:
-                await self.dbl.post_guild_count()
-                logger.info(f'Posted server count {len(self.bot.guilds)}')
+                await self._post_guild_count()
             except Exception as e:
                 logger.exception(f'Failed to post server count\n{e}')
 
-            await self._check_votes()
+            # Votes are only counted once
+            if self.bot.is_primary_cluster:
+                await self._check_votes()
+
+    async def _post_guild_count(self):
+        if self.bot.cluster_id is None:
+            logger.info('Posting server count')
+            await self.dbl.post_guild_count()
+            logger.info(f'Posted server count {len(self.bot.guilds)}')
+            return
+
+        # In cluster mode every cluster only has the guilds of its own shards.
+        # Each cluster saves the guild counts of its shards and the first
+        # cluster posts the total so clusters don't overwrite each others counts
+        counts = {shard_id: 0 for shard_id in self.bot.shard_ids}
+        for guild in self.bot.guilds:
+            counts[guild.shard_id] = counts.get(guild.shard_id, 0) + 1
+
+        await self.bot.redis.hmset_dict(self.GUILD_COUNTS, counts)
+        if not self.bot.is_primary_cluster:
+            return
+
+        shard_count = self.bot.shard_count
+        counts = await self.bot.redis.hgetall(self.GUILD_COUNTS)
+        counts = {int(shard_id): int(count) for shard_id, count in counts.items()}
+        missing = [i for i in range(shard_count) if i not in counts]
+        if missing:
+            # Clusters start at different times so on the first run the
+            # others might not have saved their counts yet
+            logger.warning(f'No server count saved for shards {missing}. Not posting a partial count')
+            return
+
+        total = sum(count for shard_id, count in counts.items() if shard_id < shard_count)
+        logger.info('Posting server count')
+        await self.dbl.post_guild_count(total)
+        logger.info(f'Posted server count {total}')
 
     async def _check_votes(self):
         try:
@@ -10,7 +10,6 @@ from math import ceil
 from random import randint
 from typing import Optional
 
-import matplotlib.pyplot as plt
 from PIL import (Image, ImageSequence, ImageFont, ImageDraw, ImageChops,
                  GifImagePlugin)
 from asyncpg.exceptions import PostgresError
@@ -29,10 +28,13 @@ from cogs.cog import Cog
 from utils.imagetools import (resize_keep_aspect_ratio, gradient_flash, sepia,
                               optimize_gif, func_to_gif,
                               get_duration, convert_frames, apply_transparency)
+from utils.lazy import lazy_import
 from utils.utilities import (get_image_from_ctx, find_coeffs, check_botperm,
                              split_string, get_image, dl_image, call_later,
                              get_images, send_paged_message)
 
+plt = lazy_import('matplotlib.pyplot')
+
 logger = logging.getLogger('terminal')
 TEMPLATES = os.path.join('data', 'templates')
 
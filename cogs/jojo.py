@@ -37,8 +37,6 @@ import numpy as np
 from PIL import Image, ImageFont
 from colour import Color
 from discord.ext.commands import BucketType
-from matplotlib import pyplot as plt
-from matplotlib.patches import Polygon, Circle
 from numpy import pi, random
 
 from bot.bot import command, cooldown, bot_has_permissions
@@ -49,10 +47,14 @@ from utils.imagetools import (create_shadow, create_text,
                               resize_keep_aspect_ratio, get_color,
                               IMAGES_PATH, image_from_url, GeoPattern,
                               color_distance, MAX_COLOR_DIFF)
+from utils.lazy import lazy_import
 from utils.utilities import (get_picture_from_msg, y_n_check,
                              check_negative, normalize_text,
                              get_image, basic_check, test_url)
 
+plt = lazy_import('matplotlib.pyplot')
+patches = lazy_import('matplotlib.patches')
+
 terminal = logging.getLogger('terminal')
 HALFWIDTH_TO_FULLWIDTH = str.maketrans(
     '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!"#$%&()*+,-./:;<=>?@[]^_`{|}~ ',
@@ -93,7 +95,6 @@ class JoJo(Cog):
         super().__init__(bot)
         self.stat_lock = Lock()
         self.stats = OrderedDict.fromkeys(POWERS, None)
-        self.stat_spread_figure = plt.figure()
         self.line_points = [1 - 0.2*i for i in range(6)]
         self.parser = ArgumentParser()
 
@@ -103,7 +104,8 @@ class JoJo(Cog):
                                      required=False)
 
     def cog_unload(self):  # skipcq: PYL-R0201
-        plt.close('all')
+        if plt.loaded:
+            plt.close('all')
 
     def create_empty_stats_circle(self, color='k'):
         fig = plt.figure()
@@ -138,9 +140,9 @@ class JoJo(Cog):
         if color_distance(Color(c), bg_color) < (MAX_COLOR_DIFF/2):
             c = 'white'
 
-        inner_circle = Circle((0, 0), radius=1.1, fc='none', ec=c)
-        outer_circle = Circle((0, 0), radius=1.55, fc='none', ec=c)
-        outest_circle = Circle((0, 0), radius=1.65, fc='none', ec=c)
+        inner_circle = patches.Circle((0, 0), radius=1.1, fc='none', ec=c)
+        outer_circle = patches.Circle((0, 0), radius=1.55, fc='none', ec=c)
+        outest_circle = patches.Circle((0, 0), radius=1.65, fc='none', ec=c)
         fig, ax = self.create_empty_stats_circle(c)
         stat_spread = []
         for idx, line in enumerate(self.stats.values()):
@@ -191,7 +193,7 @@ class JoJo(Cog):
             y = (r1*cosr, r2*cosr)
             ax.plot(x, y, '-', color=c, linewidth=w)
 
-        pol = Polygon(stat_spread, fc='y', alpha=0.7)
+        pol = patches.Polygon(stat_spread, fc='y', alpha=0.7)
         pol.set_color(color)
 
         fig.gca().add_patch(inner_circle)
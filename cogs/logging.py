@@ -1,12 +1,14 @@
+import asyncio
 import logging
 
 import discord
 from discord.abc import PrivateChannel
 
+from bot.log_batcher import LogBatcher
+from bot.write_buffer import WriteBuffer
 from cogs.cog import Cog
-from utils.utilities import (split_string, format_on_delete, format_on_edit,
-                             format_join_leave, get_avatar,
-                             get_image_from_embeds,
+from utils.utilities import (format_on_delete, format_on_edit,
+                             format_join_leave, get_image_from_embeds,
                              is_image_url)
 
 logger = logging.getLogger('terminal')
@@ -15,6 +17,44 @@ logger = logging.getLogger('terminal')
 class Logger(Cog):
     def __init__(self, bot):
         super().__init__(bot)
+        self._buffer = WriteBuffer(bot)
+        self._flush_task = asyncio.run_coroutine_threadsafe(self._buffer.run(), loop=bot.loop)
+        # Log messages posted to the log channels of guilds
+        self._batcher = LogBatcher(bot)
+
+    def cog_unload(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # Unloaded from the event loop, e.g. by Bot.close. Waiting for the flush
+            # here would block the loop it runs on so it's left to finish on its own
+            self._batcher.close()
+            self._buffer.close()
+            return
+
+        self.bot.loop.call_soon_threadsafe(self._batcher.close)
+        # Flush everything that is still in the buffer before unloading
+        self.bot.loop.call_soon_threadsafe(self._buffer.close)
+        try:
+            self._flush_task.result(timeout=20)
+        except (asyncio.CancelledError, asyncio.TimeoutError, asyncio.InvalidStateError):
+            self._flush_task.cancel()
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    @property
+    def batcher(self):
+        return self._batcher
+
+    def _set_last_image(self, channel_id, url):
+        self.bot.dbutil.set_last_image(channel_id, url)
+        # Only needed so the image is remembered over restarts and evictions
+        if self.bot.config.persist_last_images:
+            self._buffer.set_attachment(channel_id, url)
 
     @staticmethod
     def format_for_db(message):
@@ -42,7 +82,7 @@ class Logger(Cog):
                 user_id,
                 message_id), attachment
 
-    async def check_mentions(self, message):
+    def check_mentions(self, message):
         if message.guild is None:
             return
 
@@ -59,44 +99,24 @@ class Logger(Cog):
         if not roles:
             return
 
-        sql = 'INSERT INTO mention_stats AS ms (guild, role, role_name) ' \
-              'VALUES %s' % self.bot.dbutil.create_bind_groups(len(roles), 3)
-
-        data = []
-        for role in roles:
-            data.extend((guild.id, role.id, role.name))
-
-        sql = sql.rstrip(',')
-        sql += ' ON CONFLICT (guild, role) DO UPDATE SET amount=ms.amount+1, role_name=EXCLUDED.role_name'
-        await self.bot.dbutil.execute(sql, data)
+        self._buffer.add_mentions(guild.id, roles)
 
     @Cog.listener()
     async def on_message(self, message):
-        await self.check_mentions(message)
+        self.check_mentions(message)
         d, attachment = self.format_for_db(message)
 
         if message.guild and message.guild.id in (217677285442977792,475623556164878347):
-            sql = "INSERT INTO messages (guild, channel, user_id, message_id) " \
-                  "VALUES ($1, $2, $3, $4)"
-
-            await self.bot.dbutil.execute(sql, d)
+            self._buffer.add_message(*d)
 
         # Channel index is 1
         if attachment and d[1]:
-            sql = 'INSERT INTO attachments (channel, attachment) ' \
-                  'VALUES ($1, $2) ON CONFLICT (channel) DO UPDATE SET attachment=$2'
-            await self.bot.dbutil.execute(sql, (d[1], attachment))
+            self._set_last_image(d[1], attachment)
 
     @Cog.listener()
     async def on_member_join(self, member):
         guild = member.guild
-        sql = "INSERT INTO join_leave (uid, guild, value) VALUES " \
-              "($1, $2, $3) ON CONFLICT (guild, uid) DO UPDATE SET value=1, at=CURRENT_TIMESTAMP"
-
-        await self.bot.dbutil.execute(sql, (member.id, guild.id, 1))
-
-        sql = "INSERT INTO join_dates (uid, guild, first_join) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING"
-        await self.bot.dbutil.execute(sql, (member.id, guild.id, member.joined_at))
+        self._buffer.member_joined(member)
 
         channel = self.bot.guild_cache.join_channel(guild.id)
         channel = guild.get_channel(channel)
@@ -116,15 +136,12 @@ class Logger(Cog):
         else:
             message = format_join_leave(member, message)
 
-        await channel.send(message)
+        self._batcher.add_text(channel, message)
 
     @Cog.listener()
     async def on_member_remove(self, member):
         guild = member.guild
-        sql = "INSERT INTO join_leave (uid, guild, value) VALUES " \
-              "($1, $2, $3) ON CONFLICT (guild, uid) DO UPDATE SET value=-1, at=CURRENT_TIMESTAMP"
-
-        await self.bot.dbutil.execute(sql, (member.id, guild.id, -1))
+        self._buffer.member_left(member)
 
         channel = self.bot.guild_cache.leave_channel(guild.id)
         channel = guild.get_channel(channel)
@@ -140,14 +157,23 @@ class Logger(Cog):
             return
 
         message = format_join_leave(member, message)
-        await channel.send(message)
+        self._batcher.add_text(channel, message)
 
     @Cog.listener()
     async def on_message_delete(self, msg):
+        self._log_deletes([msg])
+
+    @Cog.listener()
+    async def on_bulk_message_delete(self, messages):
+        self._log_deletes(messages)
+
+    def _log_deletes(self, messages):
+        """Log deleted messages. All messages must be from the same channel"""
+        msg = messages[0]
         if isinstance(msg.channel, discord.DMChannel) or msg.guild is None:
             return
 
-        if msg.author.bot or msg.channel.id == 336917918040326166:
+        if msg.channel.id == 336917918040326166:
             return
 
         channel = self.bot.guild_cache.on_delete_channel(msg.guild.id)
@@ -162,21 +188,16 @@ class Logger(Cog):
             return
 
         message = self.bot.guild_cache.on_delete_message(msg.guild.id, default_message=True)
-        message = format_on_delete(msg, message)
-        message = split_string(message, splitter='\n', maxlen=2048 if is_embed else 2000)
-        if len(message) > 2:
-            m = '{0.id}: {0.name} On delete message had to post over 2 messages'.format(msg.guild)
-            logger.info(m)
-            logger.warning(m)
-
-        for m in message:
+        title = f'Message deleted in #{msg.channel.name} {msg.channel.id}'
+        for msg in sorted(messages, key=lambda m: m.id):
+            if msg.author.bot:
+                continue
+
+            text = format_on_delete(msg, message)
             if is_embed:
-                await channel.send(embed=self.create_embed(msg,
-                                                           f'Message deleted in #{msg.channel.name} {msg.channel.id}',
-                                                           m,
-                                                           msg.created_at))
+                self._batcher.add_embed(channel, text, title, msg.author, msg.created_at)
             else:
-                await channel.send(m)
+                self._batcher.add_text(channel, text)
 
     @Cog.listener()
     async def on_message_edit(self, before, after):
@@ -188,9 +209,7 @@ class Logger(Cog):
             if not image:
                 return
 
-            sql = 'INSERT INTO attachments (channel, attachment) ' \
-                  'VALUES ($1, $2) ON CONFLICT (channel) DO UPDATE SET attachment=$2'
-            await self.bot.dbutil.execute(sql, (after.channel.id, image))
+            self._set_last_image(after.channel.id, image)
 
         if before.author.bot or before.channel.id == 336917918040326166:
             return
@@ -214,27 +233,11 @@ class Logger(Cog):
         if not perms.send_messages or (is_embed and not perms.embed_links):
             return
 
-        message = split_string(message, maxlen=2048 if is_embed else 2000)
-        if len(message) > 4:
-            m = '{0.id}: {0.name} On edit message had to post over 4 messages'.format(before.guild)
-            logger.info(m)
-            logger.warning(m)
-
-        for m in message:
-            if is_embed:
-                await channel.send(
-                    embed=self.create_embed(after,
-                                            f'Message edited in #{after.channel.name} {after.channel.id}',
-                                            m,
-                                            after.edited_at))
-            else:
-                await channel.send(m)
-
-    @staticmethod
-    def create_embed(message, title, description, timestamp):
-        embed = discord.Embed(title=title, description=description, timestamp=timestamp)
-        embed.set_author(name=str(message.author), icon_url=get_avatar(message.author))
-        return embed
+        if is_embed:
+            title = f'Message edited in #{after.channel.name} {after.channel.id}'
+            self._batcher.add_embed(channel, message, title, after.author, after.edited_at)
+        else:
+            self._batcher.add_text(channel, message)
 
     @Cog.listener()
     async def on_guild_role_delete(self, role):
@@ -255,9 +258,8 @@ class Logger(Cog):
         entries = list(reversed(entries))
         entries.append(cmd.name)
         guild = ctx.guild.id if ctx.guild else None
-        await self.bot.dbutil.command_used(entries[0], ' '.join(entries[1:]) or "",
-                                           ctx.message.created_at, ctx.author.id,
-                                           guild)
+        self._buffer.command_used(entries[0], ' '.join(entries[1:]) or "",
+                                  ctx.message.created_at, ctx.author.id, guild)
 
 
 def setup(bot):
@@ -15,6 +15,7 @@ from bot.bot import (command, group, has_permissions, cooldown,
 from bot.converters import MentionedMember, PossibleUser, TimeDelta
 from bot.formatter import Paginator, EmbedLimits
 from bot.globals import DATA
+from bot.pool_manager import BACKGROUND
 from cogs.cog import Cog
 from utils.utilities import (call_later, parse_timeout,
                              get_avatar, is_image_url,
@@ -40,9 +41,11 @@ class Moderator(Cog):
         self._pause = 1800
 
         asyncio.run_coroutine_threadsafe(self._load_automute(), loop=bot.loop).result()
+        self.bot.invalidation.subscribe('automute', self._load_automute, self._load_automute)
         self._event_loop = asyncio.run_coroutine_threadsafe(self.load_expiring_events(), loop=bot.loop)
 
     def cog_unload(self):
+        self.bot.invalidation.unsubscribe('automute')
         self._event_loop.cancel()
 
         for timeouts in list(self.timeouts.values()):
@@ -54,33 +57,31 @@ class Moderator(Cog):
                 for temprole in list(user_temproles.values()):
                     temprole.cancel()
 
-    async def _load_automute(self):
-        sql = 'SELECT * FROM automute_blacklist'
-
-        rows = await self.bot.dbutil.fetch(sql)
-        for row in rows:
-            id_ = row['guild']
-            if id_ not in self.automute_blacklist:
-                s = set()
-                self.automute_blacklist[id_] = s
-
-            else:
-                s = self.automute_blacklist[id_]
-
-            s.add(row['channel'])
-
-        sql = 'SELECT * FROM automute_whitelist'
-        rows = await self.bot.dbutil.fetch(sql)
-        for row in rows:
-            id_ = row['guild']
-            if id_ not in self.automute_whitelist:
-                s = set()
-                self.automute_whitelist[id_] = s
-
-            else:
-                s = self.automute_whitelist[id_]
+    async def _load_automute(self, guild_id=None):
+        """Load the automute blacklist and whitelist of a guild or all guilds if guild_id is None"""
+        where = ''
+        args = ()
+        if guild_id is not None:
+            where = ' WHERE guild=$1'
+            args = (guild_id,)
+
+        blacklist = {}
+        sql = 'SELECT * FROM automute_blacklist' + where
+        for row in await self.bot.dbutil.fetch(sql, args, priority=BACKGROUND):
+            blacklist.setdefault(row['guild'], set()).add(row['channel'])
+
+        whitelist = {}
+        sql = 'SELECT * FROM automute_whitelist' + where
+        for row in await self.bot.dbutil.fetch(sql, args, priority=BACKGROUND):
+            whitelist.setdefault(row['guild'], set()).add(row['role'])
+
+        if guild_id is None:
+            self.automute_blacklist = blacklist
+            self.automute_whitelist = whitelist
+            return
 
-            s.add(row['role'])
+        self.automute_blacklist[guild_id] = blacklist.get(guild_id, set())
+        self.automute_whitelist[guild_id] = whitelist.get(guild_id, set())
 
     async def load_expiring_events(self):
         # Load events that expire in an hour
@@ -96,11 +97,14 @@ class Moderator(Cog):
     async def _load_temproles(self, expires_in: timedelta):
         date = datetime.utcnow() + expires_in
         sql = 'SELECT * FROM temproles WHERE expires_at < $1'
-        rows = await self.bot.dbutil.fetch(sql, (date,))
+        rows = await self.bot.dbutil.fetch(sql, (date,), priority=BACKGROUND)
 
         for row in rows:
-            time = row['expires_at'] - datetime.utcnow()
             guild = row['guild']
+            if not self.bot.owns_guild(guild):
+                continue
+
+            time = row['expires_at'] - datetime.utcnow()
             user = row['uid']
             role = row['role']
 
@@ -109,10 +113,13 @@ class Moderator(Cog):
     async def _load_timeouts(self, expires_in: timedelta):
         date = datetime.utcnow() + expires_in
         sql = 'SELECT * FROM timeouts WHERE expires_on < $1'
-        rows = await self.bot.dbutil.fetch(sql, (date,))
+        rows = await self.bot.dbutil.fetch(sql, (date,), priority=BACKGROUND)
         for row in rows:
-            time = row['expires_on'] - datetime.utcnow()
             guild = row['guild']
+            if not self.bot.owns_guild(guild):
+                continue
+
+            time = row['expires_on'] - datetime.utcnow()
             user = row['uid']
 
             self.register_timeout(user, guild, time.total_seconds(), ignore_dupe=True)
@@ -294,6 +301,7 @@ class Moderator(Cog):
             return await ctx.send('Failed to add role because of an error')
 
         roles.add(role.id)
+        await self.bot.invalidation.publish('automute', guild.id)
         await ctx.send('Added role {0.name} `{0.id}`'.format(role))
 
     @automute_whitelist_.command(aliases=['del', 'delete'], no_pm=True)
@@ -315,6 +323,7 @@ class Moderator(Cog):
             return await ctx.send('Failed to remove role because of an error')
 
         roles.discard(role.id)
+        await self.bot.invalidation.publish('automute', guild.id)
         await ctx.send('Role {0.name} `{0.id}` removed from automute whitelist'.format(role))
 
     @group(invoke_without_command=True, name='automute_blacklist', aliases=['mute_blacklist'], no_pm=True)
@@ -344,13 +353,14 @@ class Moderator(Cog):
         channels = self.automute_blacklist.get(guild.id)
         if channels is None:
             channels = set()
-            self.automute_whitelist[guild.id] = channels
+            self.automute_blacklist[guild.id] = channels
 
         success = await self.bot.dbutils.add_automute_blacklist(guild.id, channel.id)
         if not success:
             return await ctx.send('Failed to add channel because of an error')
 
         channels.add(channel.id)
+        await self.bot.invalidation.publish('automute', guild.id)
         await ctx.send('Added channel {0.name} `{0.id}`'.format(channel))
 
     @automute_blacklist_.command(name='remove', aliases=['del', 'delete'], no_pm=True)
@@ -367,11 +377,12 @@ class Moderator(Cog):
         if channel_.id not in channels:
             return await ctx.send('Channel {0.name} not found in blacklist'.format(channel_))
 
-        success = await self.bot.dbutils.remove_automute_blacklist(guild.id, channel.id)
+        success = await self.bot.dbutils.remove_automute_blacklist(guild.id, channel_.id)
         if not success:
             return await ctx.send('Failed to remove channel because of an error')
 
-        channels.discard(channel.id)
+        channels.discard(channel_.id)
+        await self.bot.invalidation.publish('automute', guild.id)
         await ctx.send('Channel {0.name} `{0.id}` removed from automute blacklist'.format(channel_))
 
     # Required perms: manage roles
@@ -1302,14 +1313,7 @@ class Moderator(Cog):
         # snowflake reference
         t = ((int(t.timestamp()*1000)-1420070400000) << 22) | (11111 << 18) | (11111 << 12) | 111111111111
 
-        sql = "SELECT message_id, channel FROM messages WHERE guild=%s AND user_id=%s AND message_id > %s " % (guild.id, user, t)
-
-        if channel is not None:
-            sql += 'AND channel=%s ' % channel.id
-
-        sql += 'ORDER BY message_id DESC LIMIT %s' % max_messages
-
-        rows = await self.bot.dbutil.fetch(sql)
+        rows = await self.bot.dbutil.fetch_statement('user_messages_after', guild.id, user, t, max_messages)
 
         if not rows:
             channel = ctx.channel
@@ -1341,9 +1345,8 @@ class Moderator(Cog):
                 ids.extend(channel_messages[k])
 
         if ids:
-            sql = 'DELETE FROM messages WHERE message_id IN (%s)' % ', '.join(str(i.id) for i in ids)
             try:
-                await self.bot.dbutil.execute(sql)
+                await self.bot.dbutil.execute_statement('delete_messages', [i.id for i in ids])
             except PostgresError:
                 logger.exception('Could not delete messages from database')
 
@@ -1,6 +1,7 @@
 import logging
 import re
 
+from bot.bot import listener_scope
 from cogs.cog import Cog
 from utils import unzalgo
 
@@ -18,6 +19,7 @@ class NNLogger(Cog):
         return ' '.join(''.join(filter(str.isalnum, ss)) for ss in s.split(' '))
 
     @Cog.listener()
+    @listener_scope(channels=(297061271205838848,))
     async def on_message(self, msg):
         if self.bot.test_mode:
             return
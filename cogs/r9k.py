@@ -8,6 +8,7 @@ from discord.errors import HTTPException
 from discord.ext.commands.cooldowns import CooldownMapping, BucketType
 from discord.ext.tasks import Loop
 
+from bot.bot import listener_scope
 from cogs.cog import Cog
 from utils import unzalgo
 
@@ -74,6 +75,7 @@ class R9K(Cog):
             pass
 
     @Cog.listener()
+    @listener_scope(guilds=(217677285442977792,), channels=(354712220761980939,))
     async def on_message(self, msg):
         guild = msg.guild
         if self.bot.test_mode:
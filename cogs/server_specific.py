@@ -26,8 +26,10 @@ from numpy.random import choice
 from tatsu.data_structures import RankingObject
 from tatsu.wrapper import ApiWrapper
 
-from bot.bot import command, has_permissions, cooldown, bot_has_permissions
+from bot.bot import (command, has_permissions, cooldown, bot_has_permissions,
+                     listener_scope)
 from bot.formatter import Paginator
+from bot.pool_manager import BACKGROUND
 from cogs.cog import Cog
 from cogs.colors import Colors
 from cogs.voting import Poll
@@ -346,19 +348,21 @@ class ServerSpecific(Cog):
 
         user = int(user)
 
-        sql = "UPDATE role_cooldown SET last_use=(last_use - INTERVAL '150' MINUTE ) WHERE uid=$1"
-        await self.bot.dbutil.execute(sql, (user,))
+        await self.bot.dbutil.reduce_role_cooldown(user, timedelta(minutes=150))
 
     async def load_giveaways(self):
         sql = 'SELECT * FROM giveaways'
         try:
-            rows = await self.bot.dbutil.fetch(sql)
+            rows = await self.bot.dbutil.fetch(sql, priority=BACKGROUND)
         except PostgresError:
             logger.exception('Failed to load giveaways')
             return
 
         for row in rows:
             guild = row['guild']
+            if not self.bot.owns_guild(guild):
+                continue
+
             channel = row['channel']
             message = row['message']
             title = row['title']
@@ -376,11 +380,9 @@ class ServerSpecific(Cog):
         return self.bot.dbutil
 
     async def _check_role_grant(self, ctx, user, role_id, guild_id):
-        where = 'uid=%s OR user_role IN (%s)' % (user.id, ', '.join((str(r.id) for r in user.roles)))
-
-        sql = 'SELECT role FROM role_granting WHERE guild=%s AND role=%s AND (%s) LIMIT 1' % (guild_id, role_id, where)
         try:
-            row = await self.bot.dbutil.fetch(sql, fetchmany=False)
+            row = await self.bot.dbutil.fetch_statement('check_role_grant', guild_id, role_id, user.id,
+                                                        [r.id for r in user.roles], fetchmany=False)
             if not row:
                 return False
         except PostgresError:
@@ -390,6 +392,7 @@ class ServerSpecific(Cog):
         return True
 
     @Cog.listener()
+    @listener_scope(guilds=(217677285442977792,))
     async def on_member_update(self, before, after):
         if before.guild.id != 217677285442977792:
             return
@@ -587,9 +590,8 @@ class ServerSpecific(Cog):
         if not user:
             user = ctx.author
 
-        sql = 'SELECT role FROM role_granting WHERE guild=%s AND (uid=%s OR user_role IN (%s))' % (guild.id, user.id, ', '.join((str(r.id) for r in user.roles)))
         try:
-            rows = await self.dbutil.fetch(sql)
+            rows = await self.dbutil.fetch_statement('user_role_grants', guild.id, user.id, [r.id for r in user.roles])
         except PostgresError:
             logger.exception('Failed to get role grants')
             return await ctx.send('Failed execute sql')
@@ -907,6 +909,7 @@ class ServerSpecific(Cog):
         await self.delete_giveaway_from_db(message.id)
 
     @Cog.listener()
+    @listener_scope(guilds=(366940074635558912,))
     async def on_member_join(self, member):
         if self.bot.test_mode:
             return
@@ -922,6 +925,7 @@ class ServerSpecific(Cog):
         await member.edit(nick=name, reason='Auto nick')
 
     @Cog.listener()
+    @listener_scope(guilds=whitelist)
     async def on_message(self, message):
         if not self.bot.antispam or not self.redis:
             return
@@ -13,6 +13,7 @@ from emoji import emoji_count
 
 from bot.bot import command, has_permissions, cooldown, bot_has_permissions
 from bot.formatter import EmbedLimits
+from bot.pool_manager import BACKGROUND
 from cogs.cog import Cog
 from utils.utilities import (get_emote_name_id, parse_time, get_avatar)
 
@@ -182,9 +183,8 @@ class Poll:
         except discord.DiscordException:
             logger.exception('Failed to end poll')
             channel = self.bot.get_channel(self.channel)
-            sql = 'DELETE FROM polls WHERE message=%s' % self.message
             try:
-                await self.bot.dbutil.execute(sql)
+                await self.bot.dbutil.execute_statement('delete_poll', self.message)
             except PostgresError:
                 logger.exception('Could not delete poll')
             return await channel.send('Failed to end poll.\nReason: Could not get the poll message')
@@ -285,9 +285,8 @@ class Poll:
         except discord.HTTPException:
             pass
 
-        sql = 'DELETE FROM polls WHERE message= %s' % self.message
         try:
-            await self.bot.dbutil.execute(sql)
+            await self.bot.dbutil.execute_statement('delete_poll', self.message)
         except PostgresError:
             logger.exception('Could not delete poll')
             await chn.send('Could not delete poll from database. The poll result might be recalculated')
@@ -316,9 +315,12 @@ class VoteManager(Cog):
     async def load_polls(self):
         sql = 'SELECT polls.*, emotes.emote ' \
               'FROM polls LEFT OUTER JOIN pollemotes pe ON polls.message = pe.poll_id LEFT OUTER JOIN emotes ON emotes.emote = pe.emote_id'
-        poll_rows = await self.bot.dbutil.fetch(sql)
+        poll_rows = await self.bot.dbutil.fetch(sql, priority=BACKGROUND)
         polls = {}
         for row in poll_rows:
+            if not self.bot.owns_guild(row['guild']):
+                continue
+
             poll = polls.get(row['message'], Poll(self.bot, row['message'], row['channel'], row['title'],
                                                   expires_at=row['expires_in'],
                                                   strict=row['strict'],
@@ -89,17 +89,64 @@ create index idx_27177_uses
 create unique index idx_27177_parent
   on command_stats (parent, cmd);
 
+-- Partitioned monthly by used_at. Partitions are named command_usage_yYYYYmMM
+-- and are created and removed by bot.partitions.PartitionManager.
+-- Rows go to the default partition until the partition of their month exists
 create table command_usage
 (
     cmd TEXT NOT NULL,
     used_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
     uid BIGINT DEFAULT NULL,
     guild BIGINT DEFAULT NULL
-);
+) partition by range (used_at);
+
+create table command_usage_default
+    partition of command_usage default;
 
 create index cmd_name_index
     on command_usage (cmd);
 
+create index command_usage_used_at_index
+    on command_usage (used_at);
+
+-- Daily rollups of command_usage. Maintained by DatabaseUtils.record_command_uses
+create table command_usage_daily
+(
+    day date not null,
+    cmd TEXT not null,
+    uses integer default 0 not null,
+
+    constraint command_usage_daily_pk
+        primary key (cmd, day)
+);
+
+create index command_usage_daily_day_index
+    on command_usage_daily (day);
+
+create table command_usage_daily_guild
+(
+    day date not null,
+    guild bigint not null,
+    cmd TEXT not null,
+    uses integer default 0 not null,
+
+    constraint command_usage_daily_guild_pk
+        primary key (guild, day, cmd)
+);
+
+-- guild is 0 for uses outside of guilds
+create table command_usage_daily_user
+(
+    day date not null,
+    uid bigint not null,
+    guild bigint not null,
+    cmd TEXT not null,
+    uses integer default 0 not null,
+
+    constraint command_usage_daily_user_pk
+        primary key (uid, day, guild, cmd)
+);
+
 create table emotes
 (
   name  text        not null,
@@ -203,6 +250,10 @@ create table mention_stats
     primary key (guild, role)
 );
 
+-- Partitioned monthly by message_id which contains the creation time of the message.
+-- Partitions are named messages_yYYYYmMM and are created and removed by
+-- bot.partitions.PartitionManager.
+-- Rows go to the default partition until the partition of their month exists
 create table messages
 (
   guild      bigint,
@@ -211,7 +262,10 @@ create table messages
   message_id bigint    default 0                 not null,
   constraint idx_27225_primary
     primary key (message_id)
-);
+) partition by range (message_id);
+
+create table messages_default
+  partition of messages default;
 
 create index idx_27225_user_id
   on messages (user_id);
@@ -222,9 +276,6 @@ create index idx_27225_channel_id
 create index idx_27225_server_id
   on messages (guild);
 
-create index idx_27225_time
-  on messages (time);
-
 create table mute_roll_stats
 (
   guild          bigint not null,
@@ -0,0 +1,66 @@
+-- Adds the daily rollup tables of command_usage and backfills them from
+-- existing rows. Run while the bot is stopped so uses recorded during the
+-- backfill aren't counted twice.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS command_usage_used_at_index
+    ON command_usage (used_at);
+
+CREATE TABLE IF NOT EXISTS command_usage_daily
+(
+    day date NOT NULL,
+    cmd TEXT NOT NULL,
+    uses integer DEFAULT 0 NOT NULL,
+
+    CONSTRAINT command_usage_daily_pk
+        PRIMARY KEY (cmd, day)
+);
+
+CREATE INDEX IF NOT EXISTS command_usage_daily_day_index
+    ON command_usage_daily (day);
+
+CREATE TABLE IF NOT EXISTS command_usage_daily_guild
+(
+    day date NOT NULL,
+    guild bigint NOT NULL,
+    cmd TEXT NOT NULL,
+    uses integer DEFAULT 0 NOT NULL,
+
+    CONSTRAINT command_usage_daily_guild_pk
+        PRIMARY KEY (guild, day, cmd)
+);
+
+-- guild is 0 for uses outside of guilds
+CREATE TABLE IF NOT EXISTS command_usage_daily_user
+(
+    day date NOT NULL,
+    uid bigint NOT NULL,
+    guild bigint NOT NULL,
+    cmd TEXT NOT NULL,
+    uses integer DEFAULT 0 NOT NULL,
+
+    CONSTRAINT command_usage_daily_user_pk
+        PRIMARY KEY (uid, day, guild, cmd)
+);
+
+TRUNCATE command_usage_daily, command_usage_daily_guild, command_usage_daily_user;
+
+INSERT INTO command_usage_daily (day, cmd, uses)
+    SELECT used_at::date, cmd, COUNT(*)
+    FROM command_usage
+    GROUP BY used_at::date, cmd;
+
+INSERT INTO command_usage_daily_guild (day, guild, cmd, uses)
+    SELECT used_at::date, guild, cmd, COUNT(*)
+    FROM command_usage
+    WHERE guild IS NOT NULL
+    GROUP BY used_at::date, guild, cmd;
+
+INSERT INTO command_usage_daily_user (day, uid, guild, cmd, uses)
+    SELECT used_at::date, uid, COALESCE(guild, 0), cmd, COUNT(*)
+    FROM command_usage
+    WHERE uid IS NOT NULL
+    GROUP BY used_at::date, uid, COALESCE(guild, 0), cmd;
+
+COMMIT;
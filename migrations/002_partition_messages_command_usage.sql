@@ -0,0 +1,97 @@
+-- Converts messages and command_usage to tables range partitioned by month.
+-- Requires PostgreSQL 11 or newer. Run while the bot is stopped.
+-- Partitions are created for every month that has data plus two months
+-- ahead. After this the bot creates new partitions itself. Both tables get
+-- a default partition so inserts succeed even if the bot hasn't created
+-- the partition of the current month.
+
+BEGIN;
+
+ALTER TABLE messages RENAME TO messages_old;
+ALTER INDEX idx_27225_primary RENAME TO messages_old_pk;
+DROP INDEX IF EXISTS idx_27225_user_id;
+DROP INDEX IF EXISTS idx_27225_channel_id;
+DROP INDEX IF EXISTS idx_27225_server_id;
+DROP INDEX IF EXISTS idx_27225_time;
+
+CREATE TABLE messages
+(
+  guild      bigint,
+  channel    bigint,
+  user_id    bigint,
+  message_id bigint    default 0                 not null,
+  constraint idx_27225_primary
+    primary key (message_id)
+) PARTITION BY RANGE (message_id);
+
+CREATE INDEX idx_27225_user_id
+  ON messages (user_id);
+
+CREATE INDEX idx_27225_channel_id
+  ON messages (channel);
+
+CREATE INDEX idx_27225_server_id
+  ON messages (guild);
+
+CREATE TABLE messages_default
+  PARTITION OF messages DEFAULT;
+
+ALTER TABLE command_usage RENAME TO command_usage_old;
+DROP INDEX IF EXISTS cmd_name_index;
+DROP INDEX IF EXISTS command_usage_used_at_index;
+
+CREATE TABLE command_usage
+(
+    cmd TEXT NOT NULL,
+    used_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    uid BIGINT DEFAULT NULL,
+    guild BIGINT DEFAULT NULL
+) PARTITION BY RANGE (used_at);
+
+CREATE INDEX cmd_name_index
+    ON command_usage (cmd);
+
+CREATE INDEX command_usage_used_at_index
+    ON command_usage (used_at);
+
+CREATE TABLE command_usage_default
+    PARTITION OF command_usage DEFAULT;
+
+DO $$
+DECLARE
+    month timestamp;
+    last_month timestamp := date_trunc('month', now() AT TIME ZONE 'utc') + INTERVAL '2 months';
+    -- Discord epoch in milliseconds
+    epoch bigint := 1420070400000;
+BEGIN
+    -- Snowflakes store the creation time in the bits above the 22nd bit
+    SELECT date_trunc('month', to_timestamp(((MIN(message_id) >> 22) + epoch) / 1000.0) AT TIME ZONE 'utc')
+        INTO month FROM messages_old;
+    month := COALESCE(month, date_trunc('month', now() AT TIME ZONE 'utc'));
+
+    WHILE month <= last_month LOOP
+        EXECUTE format('CREATE TABLE messages_%s PARTITION OF messages FOR VALUES FROM (%s) TO (%s)',
+                       to_char(month, '"y"YYYY"m"MM'),
+                       GREATEST((extract(epoch FROM month) * 1000)::bigint - epoch, 0) << 22,
+                       ((extract(epoch FROM month + INTERVAL '1 month') * 1000)::bigint - epoch) << 22);
+        month := month + INTERVAL '1 month';
+    END LOOP;
+
+    SELECT date_trunc('month', MIN(used_at)) INTO month FROM command_usage_old;
+    month := COALESCE(month, date_trunc('month', now() AT TIME ZONE 'utc'));
+
+    WHILE month <= last_month LOOP
+        EXECUTE format('CREATE TABLE command_usage_%s PARTITION OF command_usage FOR VALUES FROM (%L) TO (%L)',
+                       to_char(month, '"y"YYYY"m"MM'), month, month + INTERVAL '1 month');
+        month := month + INTERVAL '1 month';
+    END LOOP;
+END
+$$;
+
+INSERT INTO messages SELECT guild, channel, user_id, message_id FROM messages_old;
+INSERT INTO command_usage SELECT cmd, used_at, uid, guild FROM command_usage_old;
+
+DROP TABLE messages_old;
+DROP TABLE command_usage_old;
+
+COMMIT;
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*-coding=utf-8 -*-
 
+import argparse
 import logging
 import os
 import subprocess
@@ -8,14 +9,23 @@ import sys
 
 import discord
 
-from bot.Not_a_bot import NotABot
+from bot.Not_a_bot import NotABot, INITIAL_COGS
 from bot.config import Config
 from bot.formatter import LoggingFormatter
 from utils import init_tf
 
+# Set when started by run_cluster.py
+parser = argparse.ArgumentParser()
+parser.add_argument('--cluster-id', type=int, default=None)
+parser.add_argument('--shard-count', type=int, default=None)
+parser.add_argument('--shards', default=None, help='Comma separated list of shard ids')
+args = parser.parse_args()
+
+discord_log = 'discord.log' if args.cluster_id is None else f'discord_{args.cluster_id}.log'
+
 discord_logger = logging.getLogger('discord')
 discord_logger.setLevel(logging.INFO)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8-sig', mode='w')
+handler = logging.FileHandler(filename=discord_log, encoding='utf-8-sig', mode='w')
 handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
 discord_logger.addHandler(handler)
 
@@ -41,33 +51,6 @@ except:
 
 config = Config()
 
-initial_cogs = [
-    'admin',
-    'autoresponds',
-    'autoroles',
-    'botadmin',
-    'botmod',
-    'colors',
-    'command_blacklist',
-    'dbl',
-    'emotes',
-    'gachiGASM',
-    'images',
-    'jojo',
-    'last_seen',
-    'logging',
-    'misc',
-    'moderator',
-    'pokemon',
-    'privacy',
-    'search',
-    'server',
-    'server_specific',
-    'settings',
-    'stats',
-    'utils',
-    'voting']
-
 terminal.info('Main bot starting up')
 
 # check whether convert is invoked with 'magick convert' or just convert
@@ -78,13 +61,6 @@ if not os.environ.get('MAGICK_PREFIX'):
     except FileNotFoundError:
         os.environ['MAGICK_PREFIX'] = ''
 
-# Initialize tensorflow for text cmd
-try:
-    model = init_tf.init_tf()
-except:
-    terminal.exception('Failed to initialize tensorflow')
-    model = None
-
 
 intents = discord.Intents.default()
 intents.members = True
@@ -92,8 +68,13 @@ intents.members = True
 intents.invites = False
 intents.voice_states = False
 
-bot = NotABot(prefix='!', conf=config, max_messages=5000, cogs=initial_cogs,
-              model=model, shard_count=2, intents=intents, chunk_guilds_at_startup=False)
+shard_ids = [int(s) for s in args.shards.split(',')] if args.shards else None
+
+# Tensorflow for the text cmd is initialized in the background after ready
+bot = NotABot(prefix='!', conf=config, max_messages=5000, cogs=INITIAL_COGS,
+              model_loader=init_tf.init_tf, shard_count=args.shard_count or config.shard_count,
+              shard_ids=shard_ids, cluster_id=args.cluster_id,
+              intents=intents, chunk_guilds_at_startup=False)
 bot.run(config.token)
 
 # We have systemctl set up in a way that different exit codes
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*-coding=utf-8 -*-
+
+"""
+Runs the main bot split into multiple processes. The amount of shards and
+processes are set with ShardCount and Clusters in the config
+"""
+
+import asyncio
+import logging
+import os
+import sys
+
+from bot.cluster import Supervisor
+from bot.config import Config
+from bot.formatter import LoggingFormatter
+
+terminal = logging.getLogger('terminal')
+terminal.setLevel(logging.DEBUG)
+handler = logging.StreamHandler(sys.stdout)
+handler.setFormatter(LoggingFormatter('{color}[{module}][{asctime}] [{levelname}]:{colorend} {message}', datefmt='%Y-%m-%d %H:%M:%S', style='{'))
+terminal.addHandler(handler)
+
+config = Config()
+
+terminal.info(f'Starting {config.clusters} clusters with {config.shard_count} shards')
+
+loop = asyncio.get_event_loop()
+supervisor = Supervisor(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run.py'),
+                        config.shard_count, config.clusters, loop=loop)
+exit_code = loop.run_until_complete(supervisor.run())
+
+# We have systemctl set up in a way that different exit codes
+# have different effects on restarting behavior
+sys.exit(exit_code)
@@ -69,6 +69,15 @@ try:
 except:
     terminal.exception('test exception')
 
+if '--bench' in sys.argv:
+    # Offline benchmarks. The bot is created by bot.bench like run.py does
+    # instead of the test mode bot below. See bot/bench.py for the benchmarks
+    # Usage: test_run.py --bench [name] [args]
+    from bot.bench import run_benchmark
+
+    terminal.info('\n' + run_benchmark(Config(), [a for a in sys.argv[1:] if a != '--bench']))
+    sys.exit(0)
+
 config = Config()
 
 initial_cogs = [
@@ -116,6 +125,7 @@ intents.members = True
 #bot=Ganypepe(prefix='-', conf=config, pm_help=False, max_messages=10000, test_mode=True)
 bot = NotABot(prefix='-', conf=config, max_messages=10000,
               test_mode=True, cogs=initial_cogs, model=model, intents=intents)
+
 bot.run(config.test_token)
 
 # We have systemctl set up in a way that different exit codes
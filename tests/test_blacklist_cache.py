@@ -0,0 +1,134 @@
+"""
+Parity tests of BlacklistCache against the queries that were used before
+the cache. The old queries are reproduced here as filters over the rows
+of command_blacklist and reduced with check_perms the same way.
+"""
+
+import random
+import unittest
+
+from bot.blacklist_cache import BlacklistCache
+from bot.globals import BlacklistTypes
+from utils.utilities import check_perms
+
+GUILDS = (1, 2)
+COMMANDS = ('ping', 'ban', None)
+USERS = (100, 101, 102, 103)
+ROLES = (200, 201, 202, 203, 204)
+CHANNELS = (300, 301, 302)
+
+
+def sql_global(rows, command, user_id):
+    """type=GLOBAL AND (command=$1 OR command IS NULL) AND (uid=$2 OR uid IS NULL)"""
+    return any(r['type'] == BlacklistTypes.GLOBAL and r['command'] in (command, None)
+               and r['uid'] in (user_id, None) for r in rows)
+
+
+def sql_value(rows, command, guild_id, user_id, role_ids, channel_id):
+    """
+    guild=$1 AND (command=$2 OR command IS NULL) AND (uid IS NULL OR uid=$3)
+    AND (role IS NULL OR role IN (...)) AND (channel IS NULL OR channel=$4)
+    """
+    matched = [r for r in rows
+               if r['guild'] == guild_id and r['command'] in (command, None)
+               and r['uid'] in (None, user_id)
+               and (r['role'] is None or r['role'] in role_ids)
+               and r['channel'] in (None, channel_id)]
+    if not matched:
+        return None
+
+    return check_perms(matched, return_raw=True)
+
+
+class RuleTable:
+    """Rows of command_blacklist kept next to the cache"""
+    def __init__(self, rng):
+        self.rng = rng
+        self.rows = {}
+        self._next_id = 1
+
+    def random_row(self):
+        rng = self.rng
+        row = {'id': self._next_id, 'command': rng.choice(COMMANDS),
+               'uid': None, 'role': None, 'channel': None}
+        self._next_id += 1
+
+        if rng.random() < 0.1:
+            row['type'] = BlacklistTypes.GLOBAL
+            row['guild'] = None
+            if rng.random() < 0.7:
+                row['uid'] = rng.choice(USERS)
+            return row
+
+        row['type'] = rng.choice((BlacklistTypes.WHITELIST, BlacklistTypes.BLACKLIST))
+        row['guild'] = rng.choice(GUILDS)
+        # Most rules have one scope but compound rules are possible
+        for col, values in (('uid', USERS), ('role', ROLES), ('channel', CHANNELS)):
+            if rng.random() < 0.35:
+                row[col] = rng.choice(values)
+
+        return row
+
+
+class BlacklistCacheParityTest(unittest.TestCase):
+    SEEDS = range(25)
+
+    def assert_parity(self, rng, cache, rows):
+        rows = list(rows)
+        for _ in range(300):
+            command = rng.choice(COMMANDS[:-1])
+            guild_id = rng.choice(GUILDS)
+            user_id = rng.choice(USERS)
+            role_ids = rng.sample(ROLES, rng.randint(0, len(ROLES)))
+            channel_id = rng.choice(CHANNELS)
+
+            self.assertEqual(cache.is_globally_blacklisted(command, user_id),
+                             sql_global(rows, command, user_id))
+            self.assertEqual(cache.get_value(command, guild_id, user_id, role_ids, channel_id),
+                             sql_value(rows, command, guild_id, user_id, role_ids, channel_id),
+                             (command, guild_id, user_id, role_ids, channel_id))
+
+    def test_loaded_rules(self):
+        for seed in self.SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                table = RuleTable(rng)
+                cache = BlacklistCache(None)
+                for _ in range(rng.randint(0, 60)):
+                    row = table.random_row()
+                    table.rows[row['id']] = row
+                    cache.add_rule(**row)
+
+                self.assertEqual(len(cache), len(table.rows))
+                self.assert_parity(rng, cache, table.rows.values())
+
+    def test_incremental_updates(self):
+        for seed in self.SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                table = RuleTable(rng)
+                cache = BlacklistCache(None)
+
+                for _ in range(150):
+                    action = rng.random()
+                    if action < 0.5 or not table.rows:
+                        row = table.random_row()
+                        table.rows[row['id']] = row
+                        cache.add_rule(**row)
+                    elif action < 0.8:
+                        row = table.rows.pop(rng.choice(list(table.rows)))
+                        cache.remove_rule(row['id'])
+                    else:
+                        row = table.rows[rng.choice(list(table.rows))]
+                        if row['type'] == BlacklistTypes.GLOBAL:
+                            continue
+
+                        row['type'] = BlacklistTypes.get_opposite(row['type'])
+                        cache.set_rule_type(row['id'], row['type'])
+
+                self.assertEqual(len(cache), len(table.rows))
+                self.assert_parity(rng, cache, table.rows.values())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported the first time one of its
+    attributes is accessed. Used for heavy dependencies that are only
+    needed by a few commands so they don't slow down startup.
+
+    Example:
+        plt = LazyModule('matplotlib.pyplot')
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Import the module if it hasn't been imported yet and return it"""
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    self.__dict__['_module'] = module
+
+        return module
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self.load(), key, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f'<LazyModule {self._name} ({state})>'
+
+
+# Modules imported in the background after the bot is ready.
+# See NotABot.on_ready
+warmup_modules = []
+
+
+def lazy_import(name):
+    """Create a LazyModule that will also be warmed up after startup"""
+    for module in warmup_modules:
+        if module._name == name:
+            return module
+
+    module = LazyModule(name)
+    warmup_modules.append(module)
+    return module
@@ -40,7 +40,6 @@ from urllib.parse import urlparse
 
 import discord
 import numpy
-from asyncpg.exceptions import PostgresError
 from discord import abc
 from discord.embeds import EmptyEmbed
 from discord.ext.commands.errors import MissingPermissions
@@ -450,6 +449,23 @@ async def retry(f, *args, retries_=3, break_on=(), **kwargs):
     return e
 
 
+async def gather_bounded(f, items, limit=4):
+    """
+    Call the coroutine function f for every item with at most limit calls
+    running at the same time
+
+    Returns:
+        list of results in the same order as items
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await f(item)
+
+    return await asyncio.gather(*map(run, items))
+
+
 def get_emote_id(s):
     emote = re.match(r'(?:<(a)?:\w+:)(\d+)(?=>)', s)
     if emote:
@@ -676,13 +692,7 @@ async def get_image_from_ctx(ctx, message, current_message_only=False):
             except discord.HTTPException:
                 pass
         else:
-            sql = 'SELECT attachment FROM attachments WHERE channel=%s' % ctx.channel.id
-            try:
-                row = await dbutil.fetch(sql, fetchmany=False)
-                if row:
-                    image = row['attachment']
-            except PostgresError:
-                pass
+            image = await dbutil.get_last_image(ctx.channel.id)
 
     if image is not None:
         if not isinstance(image, str):
@@ -1390,7 +1400,7 @@ async def send_paged_message(ctx, pages, embed=False, starting_idx=0,
 
     while True:
         try:
-            result = await bot.wait_for('reaction_changed', check=check, timeout=timeout)
+            result = await bot.wait_for_reaction(message.id, check=check, timeout=timeout)
         except asyncio.TimeoutError:
             return
 
@@ -1460,7 +1470,7 @@ async def check_blacklist(ctx):
     if not await bot.check_auth(ctx):
         return False
 
-    overwrite_perms = await bot.dbutil.check_blacklist("(command='%s' OR command IS NULL)" % ctx.command, ctx.author, ctx, True)
+    overwrite_perms = await bot.dbutil.check_blacklist(ctx.command.qualified_name, ctx.author, ctx, True)
     msg, full_msg = PermValues.BLACKLIST_MESSAGES.get(overwrite_perms, (None, None))
     if isinstance(overwrite_perms, int):
         if ctx.guild and ctx.guild.owner_id == ctx.author.id: